@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analysis Version Service
+Ngày phân tích mới nhất đã ghi xong của từng bảng summary, đọc từ các marker cron job ghi vào
+analysis_versions sau khi commit (nên không bao giờ trả về một ngày đang ghi dở).
+Kết quả được giữ trong bộ nhớ và chỉ đọc lại sau ttl giây, bằng một query duy nhất cho mọi bảng
+"""
+
+import threading
+import time
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from package.models.models import AnalysisVersion
+
+
+class AnalysisVersionService:
+    """Tra cứu ngày phân tích mới nhất theo bảng và data version (thời điểm công bố mới nhất)"""
+
+    def __init__(self, engine, ttl: float = 5.0):
+        self.engine = engine
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # {tên bảng: ngày phân tích mới nhất đã công bố}
+        self._latest_dates: Dict[str, date] = {}
+        self._data_version = None
+        # Ngày mới nhất của các bảng chưa có marker (dữ liệu ghi trước khi có analysis_versions)
+        self._fallback_dates: Dict[str, Optional[date]] = {}
+
+    def refresh(self):
+        """Buộc đọc lại marker ở lần tra cứu tiếp theo"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _snapshot(self) -> Tuple[Dict[str, date], object]:
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded_at is not None and now - self._loaded_at < self.ttl:
+                return self._latest_dates, self._data_version
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(AnalysisVersion.table_name,
+                       func.max(AnalysisVersion.analysis_date),
+                       func.max(AnalysisVersion.published_at))
+                .group_by(AnalysisVersion.table_name)
+            ).all()
+
+        with self._lock:
+            self._latest_dates = {table_name: latest_date for table_name, latest_date, _ in rows}
+            self._data_version = max((published_at for _, _, published_at in rows), default=None)
+            self._fallback_dates = {}
+            self._loaded_at = now
+            return self._latest_dates, self._data_version
+
+    def data_version(self):
+        """Thời điểm công bố mới nhất của cron job (None nếu chưa có marker nào)"""
+        return self._snapshot()[1]
+
+    def latest_date(self, model) -> Optional[date]:
+        """Ngày phân tích mới nhất đã ghi xong của bảng summary (None nếu bảng chưa có dữ liệu)"""
+        latest_dates, _ = self._snapshot()
+        table_name = model.__tablename__
+        if table_name in latest_dates:
+            return latest_dates[table_name]
+
+        with self._lock:
+            if table_name in self._fallback_dates:
+                return self._fallback_dates[table_name]
+        # Bảng chưa có marker: dùng ngày lớn nhất trong bảng (cache đến lần đọc lại marker tiếp theo)
+        with self.engine.connect() as connection:
+            latest_date = connection.execute(select(func.max(model.analysis_date))).scalar()
+        with self._lock:
+            self._fallback_dates[table_name] = latest_date
+        return latest_date
@@ -6,18 +6,27 @@ Cung cấp API để lấy dữ liệu phân tích từ database
 """
 
 from flask import Flask, jsonify, request
+from functools import wraps
 from flask_cors import CORS
 from datetime import datetime, date
-from sqlalchemy import and_, desc, asc
+from sqlalchemy import desc, select
 import sys
 import os
 # Thêm đường dẫn đến thư mục cha để có thể import package
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 from package.models.models import (
-    create_db_engine, create_session,
+    get_engine, create_session, remove_session,
     DailySalesSummary, TopSellingItem, CategorySummary, 
-    BrandSummary, RefundAnalysis, LowStockAlert, SlowMovingItem, RevenuePrediction
+    BrandSummary, RefundAnalysis, LowStockAlert, SlowMovingItem, RevenuePrediction, ApiDocument
 )
+from package.models.api_documents import (
+    DOCUMENT_ENDPOINTS, document_key,
+    daily_sales_document, top_selling_items_document, category_summary_document, brand_summary_document,
+    refund_analysis_document, low_stock_alerts_document, slow_moving_items_document,
+    summary_overview_document, comprehensive_summary_document, revenue_prediction_document
+)
+from analysis_versions import AnalysisVersionService
+from response_cache import ResponseCache
 import logging
 
 # Cấu hình logging
@@ -29,8 +38,72 @@ logging.basicConfig(
 app = Flask(__name__)
 CORS(app)  # Cho phép CORS
 
-# Tạo database engine
-engine = create_db_engine()
+# Engine dùng chung (connection pool) cho toàn bộ process
+engine = get_engine()
+
+@app.teardown_appcontext
+def close_db_session(exception=None):
+    """Trả connection của session trong request về pool (kể cả khi handler return sớm hoặc lỗi)"""
+    remove_session()
+
+# Ngày phân tích mới nhất đã ghi xong của từng bảng và data version, đọc lại từ marker sau mỗi TTL
+analysis_versions = AnalysisVersionService(engine, ttl=float(os.getenv('API_CACHE_VERSION_TTL', '5')))
+
+# Cache response theo (endpoint, query params, data version), tự làm mới khi cron job công bố dữ liệu mới
+response_cache = ResponseCache(
+    analysis_versions.data_version,
+    max_entries=int(os.getenv('API_CACHE_MAX_ENTRIES', '1024')),
+    max_bytes=int(os.getenv('API_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+    # analysis_versions đã tự giữ data version trong TTL
+    version_ttl=0,
+    enabled=os.getenv('API_CACHE_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes'),
+)
+cached = response_cache.cached(app.make_response, app.response_class)
+
+# JSON tính sẵn của cron job (api_documents) cho các tổ hợp tham số chuẩn
+precomputed_enabled = os.getenv('API_PRECOMPUTED_DOCUMENTS', 'true').strip().lower() in ('1', 'true', 'yes')
+
+def find_document(path, args):
+    """Body JSON tính sẵn cho request (None nếu tham số không chuẩn hoặc chưa có document)"""
+    if any(len(values) > 1 for values in args.listvalues()):
+        return None
+    params = args.to_dict()
+    date_str = params.pop('date', None)
+    key = document_key(path, params)
+    if key is None:
+        return None
+    
+    endpoint = DOCUMENT_ENDPOINTS[path]
+    if date_str and endpoint.accepts_date:
+        try:
+            target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return None
+    else:
+        target_date = analysis_versions.latest_date(endpoint.model)
+        if target_date is None:
+            return None
+    
+    with engine.connect() as connection:
+        return connection.execute(select(ApiDocument.body).where(
+            ApiDocument.analysis_date == target_date,
+            ApiDocument.document_key == key
+        )).scalar()
+
+def precomputed(view):
+    """Trả thẳng document tính sẵn (không qua ORM/serialize) nếu có, ngược lại chạy view"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if precomputed_enabled:
+            try:
+                body = find_document(request.path, request.args)
+            except Exception as e:
+                logging.error(f"Lỗi khi đọc api document: {e}")
+                body = None
+            if body is not None:
+                return app.response_class(body, status=200, mimetype='application/json')
+        return view(*args, **kwargs)
+    return wrapper
 
 @app.route('/')
 def home():
@@ -53,7 +126,8 @@ def home():
             'summary_all': '/api/summary/all',
             'revenue_prediction': '/api/revenue-prediction',
             'available_periods': '/api/summary/periods',
-            'available_dates': '/api/summary/dates'
+            'available_dates': '/api/summary/dates',
+            'cache_stats': '/api/cache/stats'
         },
         'query_parameters': {
             'period': 'Khoảng thời gian (1_day_ago, 7_days_ago, 1_month_ago, 3_months_ago, 6_months_ago, 1_year_ago, all_time)',
@@ -64,37 +138,18 @@ def home():
     })
 
 @app.route('/api/daily-sales')
+@cached
+@precomputed
 def get_daily_sales():
     """Lấy dữ liệu daily sales mới nhất"""
     try:
         session = create_session()
         
-        # Lấy dữ liệu mới nhất
-        latest_summary = session.query(DailySalesSummary).order_by(
-            desc(DailySalesSummary.analysis_date)
-        ).first()
-        
-        if not latest_summary:
-            return jsonify({
-                'success': False,
-                'message': 'Không có dữ liệu daily sales'
-            }), 404
-        
-        data = {
-            'success': True,
-            'data': {
-                'analysis_date': latest_summary.analysis_date.isoformat(),
-                'total_orders': latest_summary.total_orders,
-                'total_revenue': float(latest_summary.total_revenue),
-                'total_profit': float(latest_summary.total_profit),
-                'total_refunds': latest_summary.total_refunds,
-                'created_at': latest_summary.created_at.isoformat() if latest_summary.created_at else None,
-                'updated_at': latest_summary.updated_at.isoformat() if latest_summary.updated_at else None
-            }
-        }
+        # Dữ liệu của ngày phân tích mới nhất đã ghi xong
+        data, status = daily_sales_document(session, analysis_versions.latest_date(DailySalesSummary))
         
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy daily sales: {e}")
@@ -104,6 +159,7 @@ def get_daily_sales():
         }), 500
 
 @app.route('/api/daily-sales/<date_str>')
+@cached
 def get_daily_sales_by_date(date_str):
     """Lấy dữ liệu daily sales theo ngày cụ thể"""
     try:
@@ -157,6 +213,7 @@ def get_daily_sales_by_date(date_str):
         }), 500
 
 @app.route('/api/daily-sales/period/<period>')
+@cached
 def get_daily_sales_by_period(period):
     """Lấy dữ liệu daily sales theo khoảng thời gian"""
     try:
@@ -202,6 +259,8 @@ def get_daily_sales_by_period(period):
         }), 500
 
 @app.route('/api/top-selling-items')
+@cached
+@precomputed
 def get_top_selling_items():
     """Lấy dữ liệu top selling items"""
     try:
@@ -211,69 +270,21 @@ def get_top_selling_items():
         limit = int(request.args.get('limit', 10))
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        query = session.query(TopSellingItem)
-        
-        # Filter theo period và sort_type
-        query = query.filter(
-            and_(
-                TopSellingItem.data_range == period,
-                TopSellingItem.sort_type == sort_type
-            )
-        )
-        
-        # Filter theo date nếu có
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(TopSellingItem.analysis_date == target_date)
             except ValueError:
                 return jsonify({
                     'success': False,
                     'message': 'Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD'
                 }), 400
+        else:
+            target_date = analysis_versions.latest_date(TopSellingItem)
         
-        # Lấy dữ liệu mới nhất nếu không có date
-        if not date_str:
-            latest_date = session.query(TopSellingItem.analysis_date).order_by(
-                desc(TopSellingItem.analysis_date)
-            ).first()
-            if latest_date:
-                query = query.filter(TopSellingItem.analysis_date == latest_date[0])
-        
-        items = query.order_by(TopSellingItem.rank_position).limit(limit).all()
-        
-        if not items:
-            return jsonify({
-                'success': False,
-                'message': f'Không có dữ liệu top selling items cho period {period} và sort_type {sort_type}'
-            }), 404
-        
-        data = {
-            'success': True,
-            'period': period,
-            'sort_type': sort_type,
-            'limit': limit,
-            'data': []
-        }
-        
-        for item in items:
-            data['data'].append({
-                'analysis_date': item.analysis_date.isoformat(),
-                'data_range': item.data_range,
-                'sort_type': item.sort_type,
-                'sku': item.sku,
-                'item_name': item.item_name,
-                'total_quantity_sold': item.total_quantity_sold,
-                'total_revenue': float(item.total_revenue),
-                'total_profit': float(item.total_profit),
-                'rank_position': item.rank_position,
-                'created_at': item.created_at.isoformat() if item.created_at else None
-            })
-        
+        session = create_session()
+        data, status = top_selling_items_document(session, target_date, period, sort_type, limit)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy top selling items: {e}")
@@ -283,6 +294,8 @@ def get_top_selling_items():
         }), 500
 
 @app.route('/api/category-summary')
+@cached
+@precomputed
 def get_category_summary():
     """Lấy dữ liệu category summary"""
     try:
@@ -290,64 +303,21 @@ def get_category_summary():
         sort_type = request.args.get('sort_type', 'revenue')
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        query = session.query(CategorySummary).filter(
-            and_(
-                CategorySummary.data_range == period,
-                CategorySummary.sort_type == sort_type
-            )
-        )
-        
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(CategorySummary.analysis_date == target_date)
             except ValueError:
                 return jsonify({
                     'success': False,
                     'message': 'Định dạng ngày không hợp lệ'
                 }), 400
+        else:
+            target_date = analysis_versions.latest_date(CategorySummary)
         
-        if not date_str:
-            latest_date = session.query(CategorySummary.analysis_date).order_by(
-                desc(CategorySummary.analysis_date)
-            ).first()
-            if latest_date:
-                query = query.filter(CategorySummary.analysis_date == latest_date[0])
-        
-        categories = query.order_by(CategorySummary.rank_position).all()
-        
-        if not categories:
-            return jsonify({
-                'success': False,
-                'message': f'Không có dữ liệu category summary cho period {period} và sort_type {sort_type}'
-            }), 404
-        
-        data = {
-            'success': True,
-            'period': period,
-            'sort_type': sort_type,
-            'data': []
-        }
-        
-        for category in categories:
-            data['data'].append({
-                'analysis_date': category.analysis_date.isoformat(),
-                'data_range': category.data_range,
-                'sort_type': category.sort_type,
-                'category_id': category.category_id,
-                'category_name': category.category_name,
-                'total_quantity_sold': category.total_quantity_sold,
-                'total_revenue': float(category.total_revenue),
-                'total_profit': float(category.total_profit),
-                'profit_margin': float(category.profit_margin),
-                'rank_position': category.rank_position,
-                'created_at': category.created_at.isoformat() if category.created_at else None
-            })
-        
+        session = create_session()
+        data, status = category_summary_document(session, target_date, period, sort_type)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy category summary: {e}")
@@ -357,6 +327,8 @@ def get_category_summary():
         }), 500
 
 @app.route('/api/brand-summary')
+@cached
+@precomputed
 def get_brand_summary():
     """Lấy dữ liệu brand summary"""
     try:
@@ -364,64 +336,21 @@ def get_brand_summary():
         sort_type = request.args.get('sort_type', 'revenue')
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        query = session.query(BrandSummary).filter(
-            and_(
-                BrandSummary.data_range == period,
-                BrandSummary.sort_type == sort_type
-            )
-        )
-        
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(BrandSummary.analysis_date == target_date)
             except ValueError:
                 return jsonify({
                     'success': False,
                     'message': 'Định dạng ngày không hợp lệ'
                 }), 400
+        else:
+            target_date = analysis_versions.latest_date(BrandSummary)
         
-        if not date_str:
-            latest_date = session.query(BrandSummary.analysis_date).order_by(
-                desc(BrandSummary.analysis_date)
-            ).first()
-            if latest_date:
-                query = query.filter(BrandSummary.analysis_date == latest_date[0])
-        
-        brands = query.order_by(BrandSummary.rank_position).all()
-        
-        if not brands:
-            return jsonify({
-                'success': False,
-                'message': f'Không có dữ liệu brand summary cho period {period} và sort_type {sort_type}'
-            }), 404
-        
-        data = {
-            'success': True,
-            'period': period,
-            'sort_type': sort_type,
-            'data': []
-        }
-        
-        for brand in brands:
-            data['data'].append({
-                'analysis_date': brand.analysis_date.isoformat(),
-                'data_range': brand.data_range,
-                'sort_type': brand.sort_type,
-                'brand_id': brand.brand_id,
-                'brand_name': brand.brand_name,
-                'total_quantity_sold': brand.total_quantity_sold,
-                'total_revenue': float(brand.total_revenue),
-                'total_profit': float(brand.total_profit),
-                'profit_margin': float(brand.profit_margin),
-                'rank_position': brand.rank_position,
-                'created_at': brand.created_at.isoformat() if brand.created_at else None
-            })
-        
+        session = create_session()
+        data, status = brand_summary_document(session, target_date, period, sort_type)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy brand summary: {e}")
@@ -431,6 +360,8 @@ def get_brand_summary():
         }), 500
 
 @app.route('/api/refund-analysis')
+@cached
+@precomputed
 def get_refund_analysis():
     """Lấy dữ liệu refund analysis"""
     try:
@@ -438,66 +369,21 @@ def get_refund_analysis():
         sort_type = request.args.get('sort_type', 'refund_count')
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        query = session.query(RefundAnalysis).filter(
-            and_(
-                RefundAnalysis.data_range == period,
-                RefundAnalysis.sort_type == sort_type
-            )
-        )
-        
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(RefundAnalysis.analysis_date == target_date)
             except ValueError:
                 return jsonify({
                     'success': False,
                     'message': 'Định dạng ngày không hợp lệ'
                 }), 400
+        else:
+            target_date = analysis_versions.latest_date(RefundAnalysis)
         
-        if not date_str:
-            latest_date = session.query(RefundAnalysis.analysis_date).order_by(
-                desc(RefundAnalysis.analysis_date)
-            ).first()
-            if latest_date:
-                query = query.filter(RefundAnalysis.analysis_date == latest_date[0])
-        
-        refunds = query.order_by(RefundAnalysis.rank_position).all()
-        
-        if not refunds:
-            return jsonify({
-                'success': False,
-                'message': f'Không có dữ liệu refund analysis cho period {period} và sort_type {sort_type}'
-            }), 404
-        
-        data = {
-            'success': True,
-            'period': period,
-            'sort_type': sort_type,
-            'data': []
-        }
-        
-        for refund in refunds:
-            data['data'].append({
-                'analysis_date': refund.analysis_date.isoformat(),
-                'data_range': refund.data_range,
-                'sort_type': refund.sort_type,
-                'sku': refund.sku,
-                'item_name': refund.item_name,
-                'total_orders': refund.total_orders,
-                'refund_orders': refund.refund_orders,
-                'refund_rate': float(refund.refund_rate),
-                'refund_reason': refund.refund_reason,
-                'refund_quantity': refund.refund_quantity,
-                'items_affected': refund.items_affected,
-                'rank_position': refund.rank_position,
-                'created_at': refund.created_at.isoformat() if refund.created_at else None
-            })
-        
+        session = create_session()
+        data, status = refund_analysis_document(session, target_date, period, sort_type)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy refund analysis: {e}")
@@ -507,59 +393,28 @@ def get_refund_analysis():
         }), 500
 
 @app.route('/api/low-stock-alerts')
+@cached
+@precomputed
 def get_low_stock_alerts():
     """Lấy dữ liệu low stock alerts"""
     try:
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        query = session.query(LowStockAlert)
-        
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(LowStockAlert.analysis_date == target_date)
             except ValueError:
                 return jsonify({
                     'success': False,
                     'message': 'Định dạng ngày không hợp lệ'
                 }), 400
+        else:
+            target_date = analysis_versions.latest_date(LowStockAlert)
         
-        if not date_str:
-            latest_date = session.query(LowStockAlert.analysis_date).order_by(
-                desc(LowStockAlert.analysis_date)
-            ).first()
-            if latest_date:
-                query = query.filter(LowStockAlert.analysis_date == latest_date[0])
-        
-        alerts = query.order_by(asc(LowStockAlert.days_left)).all()
-        
-        if not alerts:
-            return jsonify({
-                'success': False,
-                'message': 'Không có dữ liệu low stock alerts'
-            }), 404
-        
-        data = {
-            'success': True,
-            'data': []
-        }
-        
-        for alert in alerts:
-            data['data'].append({
-                'analysis_date': alert.analysis_date.isoformat(),
-                'sku': alert.sku,
-                'item_name': alert.item_name,
-                'current_stock': alert.current_stock,
-                'avg_daily_sales': float(alert.avg_daily_sales),
-                'days_left': float(alert.days_left),
-                'alert_type': alert.alert_type,
-                'created_at': alert.created_at.isoformat() if alert.created_at else None
-            })
-        
+        session = create_session()
+        data, status = low_stock_alerts_document(session, target_date)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy low stock alerts: {e}")
@@ -569,6 +424,7 @@ def get_low_stock_alerts():
         }), 500
 
 @app.route('/api/batch-analysis')
+@cached
 def get_batch_analysis():
     """Lấy dữ liệu batch analysis"""
     try:
@@ -637,75 +493,30 @@ def get_batch_analysis():
         }), 500
 
 @app.route('/api/slow-moving-items')
+@cached
+@precomputed
 def get_slow_moving_items():
     """Lấy dữ liệu slow moving items"""
     try:
         sort_type = request.args.get('sort_type', 'no_sales')
-        date_str = request.args.get('date')
         limit = request.args.get('limit', 20, type=int)
-        
-        session = create_session()
-        
-        query = session.query(SlowMovingItem).filter(
-            SlowMovingItem.sort_type == sort_type
-        )
+        date_str = request.args.get('date')
         
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(SlowMovingItem.analysis_date == target_date)
             except ValueError:
                 return jsonify({
                     'success': False,
                     'message': 'Định dạng ngày không hợp lệ'
                 }), 400
+        else:
+            target_date = analysis_versions.latest_date(SlowMovingItem)
         
-        if not date_str:
-            latest_date = session.query(SlowMovingItem.analysis_date).order_by(
-                desc(SlowMovingItem.analysis_date)
-            ).first()
-            if latest_date:
-                query = query.filter(SlowMovingItem.analysis_date == latest_date[0])
-        
-        items = query.order_by(SlowMovingItem.rank_position).limit(limit).all()
-        
-        if not items:
-            return jsonify({
-                'success': False,
-                'message': f'Không có dữ liệu slow moving items cho sort_type {sort_type}'
-            }), 404
-        
-        data = {
-            'success': True,
-            'sort_type': sort_type,
-            'data': []
-        }
-        
-        for item in items:
-            data['data'].append({
-                'analysis_date': item.analysis_date.isoformat(),
-                'sort_type': item.sort_type,
-                'sku': item.sku,
-                'item_name': item.item_name,
-                'brand_name': item.brand_name,
-                'category_name': item.category_name,
-                'current_stock': item.current_stock,
-                'total_quantity_sold': item.total_quantity_sold,
-                'total_revenue': float(item.total_revenue),
-                'total_profit': float(item.total_profit),
-                'profit_margin': float(item.profit_margin),
-                'stock_to_sales_ratio': float(item.stock_to_sales_ratio),
-                'stock_value': float(item.stock_value),
-                'potential_loss': float(item.potential_loss),
-                'cost_price': float(item.cost_price),
-                'sale_price': float(item.sale_price),
-                'days_in_stock': item.days_in_stock,
-                'rank_position': item.rank_position,
-                'created_at': item.created_at.isoformat() if item.created_at else None
-            })
-        
+        session = create_session()
+        data, status = slow_moving_items_document(session, target_date, sort_type, limit)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy slow moving items: {e}")
@@ -715,14 +526,13 @@ def get_slow_moving_items():
         }), 500
 
 @app.route('/api/summary/overview')
+@cached
+@precomputed
 def get_summary_overview():
     """Lấy tổng quan dữ liệu summary"""
     try:
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        # Lấy ngày phân tích
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -732,103 +542,18 @@ def get_summary_overview():
                     'message': 'Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD'
                 }), 400
         else:
-            # Lấy ngày mới nhất
-            latest_date = session.query(DailySalesSummary.analysis_date).order_by(
-                desc(DailySalesSummary.analysis_date)
-            ).first()
-            if not latest_date:
+            # Lấy ngày phân tích mới nhất đã ghi xong
+            target_date = analysis_versions.latest_date(DailySalesSummary)
+            if not target_date:
                 return jsonify({
                     'success': False,
                     'message': 'Không có dữ liệu summary'
                 }), 404
-            target_date = latest_date[0]
-        
-        # Lấy daily sales summary
-        daily_sales = session.query(DailySalesSummary).filter(
-            DailySalesSummary.analysis_date == target_date
-        ).first()
-        
-        # Lấy top selling items (revenue)
-        top_items_revenue = session.query(TopSellingItem).filter(
-            and_(
-                TopSellingItem.analysis_date == target_date,
-                TopSellingItem.data_range == 'all_time',
-                TopSellingItem.sort_type == 'revenue'
-            )
-        ).order_by(TopSellingItem.rank_position).limit(5).all()
-        
-        # Lấy category summary (revenue)
-        top_categories = session.query(CategorySummary).filter(
-            and_(
-                CategorySummary.analysis_date == target_date,
-                CategorySummary.data_range == 'all_time',
-                CategorySummary.sort_type == 'revenue'
-            )
-        ).order_by(CategorySummary.rank_position).limit(5).all()
-        
-        # Lấy brand summary (revenue)
-        top_brands = session.query(BrandSummary).filter(
-            and_(
-                BrandSummary.analysis_date == target_date,
-                BrandSummary.data_range == 'all_time',
-                BrandSummary.sort_type == 'revenue'
-            )
-        ).order_by(BrandSummary.rank_position).limit(5).all()
-        
-        # Lấy low stock alerts
-        low_stock_alerts = session.query(LowStockAlert).filter(
-            LowStockAlert.analysis_date == target_date
-        ).order_by(asc(LowStockAlert.days_left)).limit(10).all()
-        
-        data = {
-            'success': True,
-            'analysis_date': target_date.isoformat(),
-            'daily_sales': {
-                'total_orders': daily_sales.total_orders if daily_sales else 0,
-                'total_revenue': float(daily_sales.total_revenue) if daily_sales else 0,
-                'total_profit': float(daily_sales.total_profit) if daily_sales else 0,
-                'total_refunds': daily_sales.total_refunds if daily_sales else 0
-            },
-            'top_selling_items': [
-                {
-                    'sku': item.sku,
-                    'item_name': item.item_name,
-                    'total_revenue': float(item.total_revenue),
-                    'total_profit': float(item.total_profit),
-                    'rank_position': item.rank_position
-                } for item in top_items_revenue
-            ],
-            'top_categories': [
-                {
-                    'category_id': cat.category_id,
-                    'category_name': cat.category_name,
-                    'total_revenue': float(cat.total_revenue),
-                    'total_profit': float(cat.total_profit),
-                    'rank_position': cat.rank_position
-                } for cat in top_categories
-            ],
-            'top_brands': [
-                {
-                    'brand_id': brand.brand_id,
-                    'brand_name': brand.brand_name,
-                    'total_revenue': float(brand.total_revenue),
-                    'total_profit': float(brand.total_profit),
-                    'rank_position': brand.rank_position
-                } for brand in top_brands
-            ],
-            'low_stock_alerts': [
-                {
-                    'sku': alert.sku,
-                    'item_name': alert.item_name,
-                    'current_stock': alert.current_stock,
-                    'days_left': float(alert.days_left),
-                    'alert_type': alert.alert_type
-                } for alert in low_stock_alerts
-            ]
-        }
         
+        session = create_session()
+        data, status = summary_overview_document(session, target_date)
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy summary overview: {e}")
@@ -838,6 +563,7 @@ def get_summary_overview():
         }), 500
 
 @app.route('/api/summary/periods')
+@cached
 def get_available_periods():
     """Lấy danh sách các khoảng thời gian có sẵn"""
     try:
@@ -862,6 +588,7 @@ def get_available_periods():
         }), 500
 
 @app.route('/api/summary/dates')
+@cached
 def get_available_dates():
     """Lấy danh sách các ngày phân tích có sẵn"""
     try:
@@ -888,14 +615,13 @@ def get_available_dates():
         }), 500
 
 @app.route('/api/summary/all')
+@cached
+@precomputed
 def get_comprehensive_summary():
     """Lấy tổng hợp tất cả data theo từng data range"""
     try:
         date_str = request.args.get('date')
         
-        session = create_session()
-        
-        # Xử lý ngày phân tích
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
@@ -905,197 +631,18 @@ def get_comprehensive_summary():
                     'message': 'Định dạng ngày không hợp lệ. Sử dụng YYYY-MM-DD'
                 }), 400
         else:
-            # Lấy ngày phân tích mới nhất nếu không có date parameter
-            latest_date = session.query(DailySalesSummary.analysis_date).order_by(
-                desc(DailySalesSummary.analysis_date)
-            ).first()
-            
-            if not latest_date:
+            # Lấy ngày phân tích mới nhất đã ghi xong
+            target_date = analysis_versions.latest_date(DailySalesSummary)
+            if not target_date:
                 return jsonify({
                     'success': False,
                     'message': 'Không có dữ liệu phân tích'
                 }), 404
-            
-            target_date = latest_date[0]
-        
-        # Danh sách các data ranges
-        data_ranges = [
-            '1_day_ago', '7_days_ago', '1_month_ago', 
-            '3_months_ago', '6_months_ago', '1_year_ago', 'all_time'
-        ]
-        
-        # Khởi tạo response structure
-        summary_data = {
-            'success': True,
-            'analysis_date': target_date.isoformat(),
-            'data': {}
-        }
-        
-        # Tổng hợp data cho từng data range
-        for data_range in data_ranges:
-            summary_data['data'][data_range] = {
-                'daily_sales': {},
-                'top_selling_items': {
-                    'revenue': [],
-                    'profit': [],
-                    'quantity': []
-                },
-                'category_summary': {
-                    'revenue': [],
-                    'quantity': []
-                },
-                'brand_summary': {
-                    'revenue': [],
-                    'quantity': []
-                },
-                'refund_analysis': {
-                    'refund_count': [],
-                    'refund_rate': [],
-                    'refund_quantity': [],
-                    'refund_reason': []
-                },
-                'slow_moving_items': {
-                    'no_sales': [],
-                    'low_sales': [],
-                    'high_stock_low_sales': [],
-                    'aging_stock': []
-                }
-            }
-            
-            # 1. Daily Sales Summary
-            daily_sales = session.query(DailySalesSummary).filter(
-                DailySalesSummary.analysis_date == target_date
-            ).first()
-            
-            if daily_sales:
-                summary_data['data'][data_range]['daily_sales'] = {
-                    'total_orders': daily_sales.total_orders,
-                    'total_revenue': float(daily_sales.total_revenue),
-                    'total_profit': float(daily_sales.total_profit),
-                    'total_refunds': daily_sales.total_refunds
-                }
-            
-            # 2. Top Selling Items
-            for sort_type in ['revenue', 'profit', 'quantity']:
-                top_items = session.query(TopSellingItem).filter(
-                    and_(
-                        TopSellingItem.analysis_date == target_date,
-                        TopSellingItem.data_range == data_range,
-                        TopSellingItem.sort_type == sort_type
-                    )
-                ).order_by(TopSellingItem.rank_position).limit(10).all()
-                
-                summary_data['data'][data_range]['top_selling_items'][sort_type] = [
-                    {
-                        'sku': item.sku,
-                        'item_name': item.item_name,
-                        'total_quantity_sold': item.total_quantity_sold,
-                        'total_revenue': float(item.total_revenue),
-                        'total_profit': float(item.total_profit),
-                        'rank_position': item.rank_position
-                    } for item in top_items
-                ]
-            
-            # 3. Category Summary
-            for sort_type in ['revenue', 'quantity']:
-                categories = session.query(CategorySummary).filter(
-                    and_(
-                        CategorySummary.analysis_date == target_date,
-                        CategorySummary.data_range == data_range,
-                        CategorySummary.sort_type == sort_type
-                    )
-                ).order_by(CategorySummary.rank_position).limit(10).all()
-                
-                summary_data['data'][data_range]['category_summary'][sort_type] = [
-                    {
-                        'category_id': cat.category_id,
-                        'category_name': cat.category_name,
-                        'total_quantity_sold': cat.total_quantity_sold,
-                        'total_revenue': float(cat.total_revenue),
-                        'total_profit': float(cat.total_profit),
-                        'profit_margin': float(cat.profit_margin),
-                        'rank_position': cat.rank_position
-                    } for cat in categories
-                ]
-            
-            # 4. Brand Summary
-            for sort_type in ['revenue', 'quantity']:
-                brands = session.query(BrandSummary).filter(
-                    and_(
-                        BrandSummary.analysis_date == target_date,
-                        BrandSummary.data_range == data_range,
-                        BrandSummary.sort_type == sort_type
-                    )
-                ).order_by(BrandSummary.rank_position).limit(10).all()
-                
-                summary_data['data'][data_range]['brand_summary'][sort_type] = [
-                    {
-                        'brand_id': brand.brand_id,
-                        'brand_name': brand.brand_name,
-                        'total_quantity_sold': brand.total_quantity_sold,
-                        'total_revenue': float(brand.total_revenue),
-                        'total_profit': float(brand.total_profit),
-                        'profit_margin': float(brand.profit_margin),
-                        'rank_position': brand.rank_position
-                    } for brand in brands
-                ]
-            
-            # 5. Refund Analysis
-            for sort_type in ['refund_count', 'refund_rate', 'refund_quantity', 'refund_reason']:
-                refunds = session.query(RefundAnalysis).filter(
-                    and_(
-                        RefundAnalysis.analysis_date == target_date,
-                        RefundAnalysis.data_range == data_range,
-                        RefundAnalysis.sort_type == sort_type
-                    )
-                ).order_by(RefundAnalysis.rank_position).limit(10).all()
-                
-                summary_data['data'][data_range]['refund_analysis'][sort_type] = [
-                    {
-                        'sku': refund.sku,
-                        'item_name': refund.item_name,
-                        'total_orders': refund.total_orders,
-                        'refund_orders': refund.refund_orders,
-                        'refund_rate': float(refund.refund_rate),
-                        'refund_reason': refund.refund_reason,
-                        'refund_quantity': refund.refund_quantity,
-                        'items_affected': refund.items_affected,
-                        'rank_position': refund.rank_position
-                    } for refund in refunds
-                ]
-            
-            # 6. Slow Moving Items
-            for sort_type in ['no_sales', 'low_sales', 'high_stock_low_sales', 'aging_stock']:
-                slow_items = session.query(SlowMovingItem).filter(
-                    and_(
-                        SlowMovingItem.analysis_date == target_date,
-                        SlowMovingItem.sort_type == sort_type
-                    )
-                ).order_by(SlowMovingItem.rank_position).limit(20).all()
-                
-                summary_data['data'][data_range]['slow_moving_items'][sort_type] = [
-                    {
-                        'sku': item.sku,
-                        'item_name': item.item_name,
-                        'brand_name': item.brand_name,
-                        'category_name': item.category_name,
-                        'current_stock': item.current_stock,
-                        'total_quantity_sold': item.total_quantity_sold,
-                        'total_revenue': float(item.total_revenue),
-                        'total_profit': float(item.total_profit),
-                        'profit_margin': float(item.profit_margin),
-                        'stock_to_sales_ratio': float(item.stock_to_sales_ratio),
-                        'stock_value': float(item.stock_value),
-                        'potential_loss': float(item.potential_loss),
-                        'cost_price': float(item.cost_price),
-                        'sale_price': float(item.sale_price),
-                        'days_in_stock': item.days_in_stock,
-                        'rank_position': item.rank_position
-                    } for item in slow_items
-                ]
         
+        session = create_session()
+        data, status = comprehensive_summary_document(session, target_date)
         session.close()
-        return jsonify(summary_data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy comprehensive summary: {e}")
@@ -1105,70 +652,18 @@ def get_comprehensive_summary():
         }), 500
 
 @app.route('/api/revenue-prediction')
+@cached
+@precomputed
 def get_revenue_prediction():
     """Lấy dự đoán doanh thu tháng tới từ database"""
     try:
-        import json
-        
         session = create_session()
         
-        # Lấy dự đoán mới nhất
-        latest_prediction = session.query(RevenuePrediction).filter(
-            RevenuePrediction.prediction_period == 'next_month'
-        ).order_by(desc(RevenuePrediction.analysis_date)).first()
-        
-        if not latest_prediction:
-            return jsonify({
-                'success': False,
-                'message': 'Không có dữ liệu dự đoán doanh thu'
-            }), 404
-        
-        # Parse JSON data
-        daily_predictions = json.loads(latest_prediction.daily_predictions) if latest_prediction.daily_predictions else []
-        weekday_analysis = json.loads(latest_prediction.weekday_analysis) if latest_prediction.weekday_analysis else {}
-        features_used = json.loads(latest_prediction.features_used) if latest_prediction.features_used else []
-        
-        data = {
-            'success': True,
-            'analysis_date': latest_prediction.analysis_date.isoformat(),
-            'prediction_period': latest_prediction.prediction_period,
-            'prediction_days': latest_prediction.prediction_days,
-            'historical_analysis': {
-                'total_revenue': float(latest_prediction.total_historical_revenue),
-                'avg_daily_revenue': float(latest_prediction.avg_daily_revenue),
-                'std_daily_revenue': float(latest_prediction.std_daily_revenue),
-                'data_days': latest_prediction.data_days,
-                'trend_percentage': float(latest_prediction.trend_percentage),
-                'r2_score': float(latest_prediction.r2_score),
-                'mape': float(latest_prediction.mape) if latest_prediction.mape > 0 else None
-            },
-            'predictions': {
-                'total_predicted_revenue': float(latest_prediction.total_predicted_revenue),
-                'avg_daily_prediction': float(latest_prediction.avg_daily_prediction),
-                'confidence_interval': float(latest_prediction.confidence_interval),
-                'lower_bound': float(latest_prediction.lower_bound),
-                'upper_bound': float(latest_prediction.upper_bound)
-            },
-            'daily_predictions': daily_predictions,
-            'weekday_analysis': weekday_analysis,
-            'model_info': {
-                'algorithm': latest_prediction.algorithm,
-                'features_used': features_used,
-                'data_points': latest_prediction.data_points,
-                'confidence_level': float(latest_prediction.confidence_level)
-            },
-            'risk_assessment': {
-                'high_volatility': latest_prediction.high_volatility,
-                'negative_trend': latest_prediction.negative_trend,
-                'low_confidence': latest_prediction.low_confidence,
-                'insufficient_data': latest_prediction.insufficient_data
-            },
-            'created_at': latest_prediction.created_at.isoformat() if latest_prediction.created_at else None,
-            'updated_at': latest_prediction.updated_at.isoformat() if latest_prediction.updated_at else None
-        }
+        # Dữ liệu của ngày phân tích mới nhất đã ghi xong
+        data, status = revenue_prediction_document(session, analysis_versions.latest_date(RevenuePrediction))
         
         session.close()
-        return jsonify(data)
+        return jsonify(data), status
         
     except Exception as e:
         logging.error(f"Lỗi khi lấy dự đoán doanh thu: {e}")
@@ -1177,6 +672,14 @@ def get_revenue_prediction():
             'message': f'Lỗi server: {str(e)}'
         }), 500
 
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    """Thống kê response cache (hit ratio tổng và theo endpoint)"""
+    return jsonify({
+        'success': True,
+        'data': response_cache.stats()
+    })
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({
@@ -1209,6 +712,7 @@ if __name__ == '__main__':
     print("   - GET /api/revenue-prediction")
     print("   - GET /api/summary/periods")
     print("   - GET /api/summary/dates")
+    print("   - GET /api/cache/stats")
     print("\n Server đang chạy tại: http://localhost:5000")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark connection pool
+So sánh thời gian một request đọc daily sales mới nhất khi tạo engine mới cho mỗi request (cách cũ của
+create_session) với engine dùng chung (get_engine + scoped session) trên database đang cấu hình (DB_*)
+
+    python bench_pool.py
+BENCH_REQUESTS: số request tuần tự cho mỗi cách (mặc định 300)
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import create_engine, desc
+from sqlalchemy.orm import sessionmaker
+
+from package.models.models import (
+    DailySalesSummary, create_session, dispose_engines, get_database_url, remove_session
+)
+
+
+def latest_daily_sales(session):
+    return session.query(DailySalesSummary).order_by(desc(DailySalesSummary.analysis_date)).first()
+
+
+def engine_per_request():
+    """Cách cũ: mỗi request một engine (và connection pool) mới"""
+    engine = create_engine(get_database_url())
+    session = sessionmaker(bind=engine)()
+    try:
+        latest_daily_sales(session)
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def shared_pool():
+    """Engine dùng chung của process, session trả connection về pool khi kết thúc request"""
+    try:
+        latest_daily_sales(create_session())
+    finally:
+        remove_session()
+
+
+if __name__ == "__main__":
+    requests = int(os.getenv('BENCH_REQUESTS', '300'))
+    print(f"⏱️ {requests} request tuần tự đọc daily sales mới nhất")
+    for run in range(2):
+        for label, handle in (('Engine mới mỗi request', engine_per_request), ('Engine dùng chung', shared_pool)):
+            # Request đầu tiên khởi tạo engine/pool dùng chung, không tính vào thời gian
+            handle()
+            started = time.perf_counter()
+            for _ in range(requests):
+                handle()
+            elapsed = time.perf_counter() - started
+            print(f"   [{run + 1}] {label:24s} {elapsed / requests * 1000:7.3f} ms/request")
+    dispose_engines()
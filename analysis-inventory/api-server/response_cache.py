@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Response Cache cho Analytics API
+Dữ liệu summary chỉ thay đổi khi cron job ghi xong một lần phân tích, nên response được cache theo
+(endpoint, query params đã chuẩn hóa, data version). Data version là thời điểm công bố mới nhất trong
+bảng analysis_versions: khi cron job công bố dữ liệu mới, key cũ không còn được dùng và bị LRU đẩy ra
+"""
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+
+class ResponseCache:
+    """LRU cache các response JSON (bytes) giới hạn theo số entry và tổng số byte, an toàn với nhiều thread"""
+
+    def __init__(self, version_loader: Callable[[], object], max_entries: int = 1024,
+                 max_bytes: int = 64 * 1024 * 1024, version_ttl: float = 5.0, enabled: bool = True):
+        """
+        version_loader: trả về data version hiện tại (None: chưa có marker, bỏ qua cache)
+        version_ttl: số giây dùng lại data version đã đọc trước khi hỏi lại database
+        """
+        if max_entries <= 0 or max_bytes <= 0:
+            raise ValueError(f"Giới hạn cache phải lớn hơn 0: {max_entries} entries, {max_bytes} bytes")
+        self.version_loader = version_loader
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version_ttl = version_ttl
+        self.enabled = enabled
+        self._entries: 'OrderedDict[Tuple, Tuple[bytes, int, str]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = None
+        self._hits = defaultdict(int)
+        self._misses = defaultdict(int)
+        self._evictions = 0
+
+    def data_version(self):
+        """Data version hiện tại (đọc lại từ database tối đa mỗi version_ttl giây)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._version_checked_at is not None and now - self._version_checked_at < self.version_ttl:
+                return self._version
+        version = self.version_loader()
+        with self._lock:
+            if version != self._version:
+                # Dữ liệu mới: các entry của version cũ không bao giờ được dùng lại
+                self._entries.clear()
+                self._bytes = 0
+            self._version, self._version_checked_at = version, now
+        return version
+
+    def invalidate(self):
+        """Xóa toàn bộ cache và buộc đọc lại data version ở request tiếp theo"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._version_checked_at = None
+
+    @staticmethod
+    def make_key(endpoint: str, view_args: Dict, query_args, version) -> Tuple:
+        """Key chuẩn hóa: tham số rỗng bị bỏ, thứ tự tham số không ảnh hưởng"""
+        params = tuple(sorted((name, value) for name, values in query_args.lists()
+                              for value in values if value != ''))
+        return endpoint, tuple(sorted(view_args.items())), params, version
+
+    def get(self, key: Tuple) -> Optional[Tuple[bytes, int, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses[key[0]] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits[key[0]] += 1
+            return entry
+
+    def put(self, key: Tuple, body: bytes, status: int, mimetype: str):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key[-1] != self._version:
+                # Version đã đổi trong lúc tạo response
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[0])
+            self._entries[key] = (body, status, mimetype)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted, _, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._evictions += 1
+
+    def cached(self, make_response: Callable, response_class):
+        """
+        Decorator cho view GET của Flask: trả response đã cache nếu có, ngược lại chạy view và cache response 200
+        make_response: app.make_response để chuẩn hóa giá trị trả về của view
+        """
+        from flask import request
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return view(*args, **kwargs)
+                version = self.data_version()
+                if version is None:
+                    return view(*args, **kwargs)
+                key = self.make_key(request.endpoint, request.view_args or {}, request.args, version)
+                entry = self.get(key)
+                if entry is not None:
+                    body, status, mimetype = entry
+                    return response_class(body, status=status, mimetype=mimetype)
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self.put(key, response.get_data(), response.status_code, response.mimetype)
+                return response
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict:
+        """Số hit/miss và tỷ lệ hit (tổng và theo endpoint), số entry, số byte, số lần bị đẩy ra"""
+        with self._lock:
+            endpoints = sorted(set(self._hits) | set(self._misses))
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            return {
+                'enabled': self.enabled,
+                'data_version': str(self._version) if self._version is not None else None,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self._evictions,
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': self._ratio(hits, misses),
+                'endpoints': {
+                    endpoint: {
+                        'hits': self._hits[endpoint],
+                        'misses': self._misses[endpoint],
+                        'hit_ratio': self._ratio(self._hits[endpoint], self._misses[endpoint]),
+                    }
+                    for endpoint in endpoints
+                },
+            }
+
+    @staticmethod
+    def _ratio(hits: int, misses: int) -> float:
+        return round(hits / (hits + misses), 4) if hits + misses else 0.0
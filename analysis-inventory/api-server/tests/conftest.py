@@ -0,0 +1,8 @@
+"""Thêm thư mục gốc (package.models) và api-server vào sys.path như khi chạy api.py"""
+
+import os
+import sys
+
+API_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(API_SERVER_DIR))
+sys.path.insert(0, API_SERVER_DIR)
@@ -0,0 +1,125 @@
+"""
+/api/summary/all (comprehensive_summary_document) đọc mỗi bảng summary đúng một query cho ngày phân tích,
+thay vì một query cho từng (data range, sort type) như trước (khoảng 100 query)
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from package.models.api_documents import (
+    DATA_RANGES, GROUP_SORT_TYPES, REFUND_SORT_TYPES, SLOW_MOVING_SORT_TYPES, TOP_SELLING_SORT_TYPES,
+    brand_summary_document, category_summary_document, comprehensive_summary_document,
+    refund_analysis_document, slow_moving_items_document, top_selling_items_document
+)
+from package.models.models import (
+    Base, BrandSummary, CategorySummary, DailySalesSummary, RefundAnalysis, SlowMovingItem, TopSellingItem
+)
+
+ANALYSIS_DATE = date(2024, 6, 30)
+# Số dòng mỗi lát dữ liệu, nhiều hơn giới hạn của /api/summary/all (10 và 20) để kiểm tra việc cắt
+ROWS_PER_SLICE = 25
+
+
+def ranked_rows(analysis_date):
+    """Dòng của các bảng xếp hạng cho mọi (data range, sort type), rank ghi theo thứ tự ngược để kiểm tra sắp xếp"""
+    money = {'total_revenue': Decimal('1250000.50'), 'total_profit': Decimal('250000.25')}
+    for rank in range(ROWS_PER_SLICE, 0, -1):
+        for data_range in DATA_RANGES:
+            for sort_type in TOP_SELLING_SORT_TYPES:
+                yield TopSellingItem(analysis_date=analysis_date, data_range=data_range, sort_type=sort_type,
+                                     sku=f'SKU{rank:03d}', item_name=f'Item {rank}', total_quantity_sold=rank,
+                                     rank_position=rank, **money)
+            for sort_type in GROUP_SORT_TYPES:
+                yield CategorySummary(analysis_date=analysis_date, data_range=data_range, sort_type=sort_type,
+                                      category_id=rank, category_name=f'Category {rank}', profit_margin=Decimal('20.00'),
+                                      total_quantity_sold=rank, rank_position=rank, **money)
+                yield BrandSummary(analysis_date=analysis_date, data_range=data_range, sort_type=sort_type,
+                                   brand_id=rank, brand_name=f'Brand {rank}', profit_margin=Decimal('20.00'),
+                                   total_quantity_sold=rank, rank_position=rank, **money)
+            for sort_type in REFUND_SORT_TYPES:
+                # Các dòng refund_reason đều có sku=''
+                yield RefundAnalysis(analysis_date=analysis_date, data_range=data_range, sort_type=sort_type,
+                                     sku='' if sort_type == 'refund_reason' else f'SKU{rank:03d}',
+                                     item_name='', total_orders=100, refund_orders=rank, refund_rate=Decimal(rank),
+                                     refund_reason=f'Lý do {rank}', refund_quantity=rank, items_affected=1,
+                                     rank_position=rank)
+        for sort_type in SLOW_MOVING_SORT_TYPES:
+            yield SlowMovingItem(analysis_date=analysis_date, sort_type=sort_type, sku=f'SKU{rank:03d}',
+                                 item_name=f'Item {rank}', brand_name='Brand', category_name='Category',
+                                 current_stock=rank, days_in_stock=rank, rank_position=rank, **money)
+
+
+@pytest.fixture()
+def session():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        # Ngày trước đó cũng có dữ liệu để kiểm tra lọc theo ngày phân tích
+        for analysis_date in (ANALYSIS_DATE - timedelta(days=1), ANALYSIS_DATE):
+            session.add(DailySalesSummary(analysis_date=analysis_date, total_orders=10, total_refunds=1,
+                                          total_revenue=Decimal('99999999.99'), total_profit=Decimal('12.34')))
+            session.add_all(ranked_rows(analysis_date))
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+@pytest.fixture()
+def statements(session):
+    """Danh sách câu SQL được thực thi sau khi fixture đã ghi dữ liệu"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', record)
+    yield executed
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def test_one_query_per_summary_table(session, statements):
+    payload, status = comprehensive_summary_document(session, ANALYSIS_DATE)
+
+    assert status == 200
+    # daily_sales_summary, top_selling_items, category_summary, brand_summary, refund_analysis, slow_moving_items
+    assert len(statements) == 6
+    tables = [table for table in ('daily_sales_summary', 'top_selling_items', 'category_summary',
+                                  'brand_summary', 'refund_analysis', 'slow_moving_items')
+              if any(f'FROM {table}' in statement for statement in statements)]
+    assert len(tables) == 6
+    assert set(payload['data']) == set(DATA_RANGES)
+
+
+def test_matches_per_slice_documents(session):
+    """Kết quả chia nhóm trong bộ nhớ giống với việc query từng (data range, sort type) riêng"""
+    payload, _ = comprehensive_summary_document(session, ANALYSIS_DATE)
+    slices = [
+        ('top_selling_items', TOP_SELLING_SORT_TYPES, lambda period, sort_type:
+            top_selling_items_document(session, ANALYSIS_DATE, period, sort_type, 10)),
+        ('category_summary', GROUP_SORT_TYPES, lambda period, sort_type:
+            category_summary_document(session, ANALYSIS_DATE, period, sort_type)),
+        ('brand_summary', GROUP_SORT_TYPES, lambda period, sort_type:
+            brand_summary_document(session, ANALYSIS_DATE, period, sort_type)),
+        ('refund_analysis', REFUND_SORT_TYPES, lambda period, sort_type:
+            refund_analysis_document(session, ANALYSIS_DATE, period, sort_type)),
+    ]
+    for data_range in DATA_RANGES:
+        data = payload['data'][data_range]
+        assert data['daily_sales']['total_revenue'] == 99999999.99
+        for section, sort_types, load_slice in slices:
+            for sort_type in sort_types:
+                rows = data[section][sort_type]
+                expected = load_slice(data_range, sort_type)[0]['data'][:10]
+                assert [row['rank_position'] for row in rows] == list(range(1, 11))
+                assert rows == [{name: row[name] for name in rows[0]} for row in expected]
+        for sort_type in SLOW_MOVING_SORT_TYPES:
+            rows = data['slow_moving_items'][sort_type]
+            expected = slow_moving_items_document(session, ANALYSIS_DATE, sort_type, 20)[0]['data']
+            assert len(rows) == 20
+            assert rows == [{name: row[name] for name in rows[0]} for row in expected]
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Persisted Aggregate State
+Tổng hợp bán hàng theo (ngày, item) lưu giữa các lần chạy, kèm watermark để chỉ đọc lại các ngày có thay đổi
+"""
+
+import json
+import os
+import numpy as np
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sales_fact import SalesFact, sum_by_index
+
+# Tăng khi cách lưu state thay đổi để state cũ được tổng hợp lại từ đầu
+STATE_FORMAT = 2
+# Cột tổng bán hàng hợp lệ theo (ngày, item); revenue theo đơn vị tiền nhỏ nhất,
+# lợi nhuận tính lại theo giá vốn hiện tại khi dùng
+STATE_SALES_COLUMNS = {'line_count': np.int64, 'quantity': np.int64, 'revenue': np.int64}
+# Cột tổng refund theo (ngày, item, lý do gốc)
+STATE_REFUND_COLUMNS = {'refund_count': np.int64, 'refund_quantity': np.int64}
+# Cột đếm đơn hàng theo (ngày, trạng thái refund)
+STATE_ORDER_COLUMNS = {'order_count': np.int64}
+
+
+class DailyTable:
+    """Bảng tổng thưa theo các cột key (cột đầu tiên là ngày), cộng dồn theo chunk"""
+
+    def __init__(self, key_columns: Tuple[str, ...], value_columns: Dict[str, type]):
+        self.key_columns = key_columns
+        self.value_columns = value_columns
+        self.keys = {column: np.zeros(0, dtype=np.int64) for column in key_columns}
+        self.values = {column: np.zeros(0, dtype=dtype) for column, dtype in value_columns.items()}
+        self._chunks = []
+
+    def __len__(self):
+        return len(self.keys[self.key_columns[0]])
+
+    def add(self, keys: Dict[str, np.ndarray], values: Dict[str, np.ndarray]):
+        if len(keys[self.key_columns[0]]):
+            self._chunks.append((keys, values))
+
+    def finalize(self):
+        """Gộp các chunk với dữ liệu hiện có thành một dòng cho mỗi key"""
+        if not self._chunks:
+            return
+        parts = [(self.keys, self.values)] + self._chunks
+        stacked = np.stack([np.concatenate([keys[column] for keys, _ in parts]).astype(np.int64)
+                            for column in self.key_columns], axis=1)
+        unique, inverse = np.unique(stacked, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        self.keys = {column: unique[:, pos] for pos, column in enumerate(self.key_columns)}
+        for column, dtype in self.value_columns.items():
+            values = np.concatenate([values[column] for _, values in parts])
+            self.values[column] = sum_by_index(inverse, values.astype(dtype, copy=False), len(unique))
+        self._chunks = []
+
+    def drop_days(self, days: np.ndarray):
+        """Bỏ toàn bộ dòng của các ngày (số ngày kể từ epoch)"""
+        keep = ~np.isin(self.keys[self.key_columns[0]], days)
+        self.keys = {column: values[keep] for column, values in self.keys.items()}
+        self.values = {column: values[keep] for column, values in self.values.items()}
+
+    def arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        columns = {**self.keys, **self.values}
+        return {f'{prefix}_{column}': values for column, values in columns.items()}
+
+    def load_arrays(self, prefix: str, data):
+        self.keys = {column: data[f'{prefix}_{column}'] for column in self.key_columns}
+        self.values = {column: data[f'{prefix}_{column}'] for column in self.value_columns}
+
+
+class DailyAggregateState:
+    """Tổng hợp theo ngày của orders/order_items, lưu ra file .npz giữa các lần chạy"""
+
+    def __init__(self):
+        self.sales = DailyTable(('day', 'item_id'), STATE_SALES_COLUMNS)
+        self.refunds = DailyTable(('day', 'item_id', 'reason'), STATE_REFUND_COLUMNS)
+        self.orders = DailyTable(('day', 'is_refund'), STATE_ORDER_COLUMNS)
+        # Lý do refund gốc, index dùng trong cột reason của bảng refunds
+        self.reasons = []
+        self._reason_pos = {}
+        # Mốc dữ liệu nguồn đã được tổng hợp: id và updated_at lớn nhất của orders/order_items
+        self.watermark = None
+
+    def _reason_indices(self, reasons: Iterable[Optional[str]]) -> np.ndarray:
+        indices = []
+        for reason in reasons:
+            index = self._reason_pos.get(reason)
+            if index is None:
+                index = self._reason_pos[reason] = len(self.reasons)
+                self.reasons.append(reason)
+            indices.append(index)
+        return np.array(indices, dtype=np.int64)
+
+    @staticmethod
+    def _days(dates: np.ndarray) -> np.ndarray:
+        return dates.astype('datetime64[D]').astype(np.int64)
+
+    def add_lines(self, fact: SalesFact):
+        """Cộng dồn một chunk order lines (fact chunk từ SalesFact.lines_chunk)"""
+        valid = ~fact.is_refund
+        self.sales.add({'day': self._days(fact.order_date[valid]), 'item_id': fact.item_id[valid]}, {
+            'line_count': np.ones(np.count_nonzero(valid), dtype=np.int64),
+            'quantity': fact.quantity[valid],
+            'revenue': fact.revenue[valid],
+        })
+
+        refunded = fact.is_refund
+        fact_reasons, reason_inverse = np.unique(fact.reason_idx[refunded], return_inverse=True)
+        reasons = self._reason_indices(fact.refund_reasons[index] for index in fact_reasons.tolist())
+        self.refunds.add({
+            'day': self._days(fact.order_date[refunded]),
+            'item_id': fact.item_id[refunded],
+            'reason': reasons[reason_inverse],
+        }, {
+            'refund_count': np.ones(np.count_nonzero(refunded), dtype=np.int64),
+            'refund_quantity': fact.quantity[refunded],
+        })
+
+    def add_orders(self, order_dates: np.ndarray, order_is_refund: np.ndarray):
+        """Cộng dồn một chunk orders"""
+        self.orders.add({'day': self._days(order_dates), 'is_refund': order_is_refund.astype(np.int64)}, {
+            'order_count': np.ones(len(order_dates), dtype=np.int64),
+        })
+
+    def finalize(self):
+        for table in (self.sales, self.refunds, self.orders):
+            table.finalize()
+
+    def replace_days(self, delta: 'DailyAggregateState', days: np.ndarray):
+        """Thay dữ liệu của các ngày bằng dữ liệu vừa đọc lại (delta đã finalize)"""
+        for table in (self.sales, self.refunds, self.orders):
+            table.drop_days(days)
+        self.sales.add(delta.sales.keys, delta.sales.values)
+        self.orders.add(delta.orders.keys, delta.orders.values)
+        if len(delta.refunds):
+            reasons = self._reason_indices(delta.reasons)
+            self.refunds.add({**delta.refunds.keys, 'reason': reasons[delta.refunds.keys['reason']]},
+                             delta.refunds.values)
+        self.finalize()
+
+    def apply_to(self, window_aggregates, fact: SalesFact):
+        """Nạp các dòng theo ngày (mốc 00:00 của ngày) vào WindowAggregates với dimension hiện tại"""
+        item_idx = fact.item_index(self.sales.keys['item_id'])
+        known = item_idx >= 0
+        quantity = self.sales.values['quantity'][known]
+        revenue = self.sales.values['revenue'][known]
+        window_aggregates.add_sales(self._dates(self.sales.keys['day'][known]), item_idx[known], {
+            'line_count': self.sales.values['line_count'][known],
+            'quantity': quantity,
+            'revenue': revenue,
+            'profit': revenue - fact.item_cost_price[item_idx[known]] * quantity,
+        })
+
+        item_idx = fact.item_index(self.refunds.keys['item_id'])
+        known = item_idx >= 0
+        reason_idx = fact.register_reasons(self.reasons)
+        window_aggregates.add_refunds(self._dates(self.refunds.keys['day'][known]), item_idx[known],
+                                      reason_idx[self.refunds.keys['reason'][known]], {
+            'refund_count': self.refunds.values['refund_count'][known],
+            'refund_quantity': self.refunds.values['refund_quantity'][known],
+        })
+
+        window_aggregates.add_orders(self._dates(self.orders.keys['day']), self.orders.keys['is_refund'].astype(bool),
+                                     self.orders.values['order_count'])
+
+    @staticmethod
+    def _dates(days: np.ndarray) -> np.ndarray:
+        return days.astype('datetime64[D]').astype('datetime64[us]')
+
+    def save(self, path: str):
+        """Ghi state ra file .npz (ghi file tạm rồi đổi tên để không để lại file dở dang)"""
+        arrays = {**self.sales.arrays('sales'), **self.refunds.arrays('refunds'), **self.orders.arrays('orders')}
+        watermark = {key: value.isoformat() if isinstance(value, datetime) else value
+                     for key, value in (self.watermark or {}).items()}
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as state_file:
+            np.savez_compressed(state_file, format=np.array(STATE_FORMAT), reasons=np.array(json.dumps(self.reasons)),
+                                watermark=np.array(json.dumps(watermark)), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'DailyAggregateState':
+        """State đã lưu; state rỗng (không có watermark) nếu file thuộc format cũ"""
+        state = cls()
+        with np.load(path) as data:
+            if 'format' not in data or int(data['format']) != STATE_FORMAT:
+                return state
+            state.sales.load_arrays('sales', data)
+            state.refunds.load_arrays('refunds', data)
+            state.orders.load_arrays('orders', data)
+            state._reason_indices(json.loads(str(data['reasons'])))
+            watermark = json.loads(str(data['watermark']))
+        state.watermark = {key: datetime.fromisoformat(value) if key.endswith('updated_at') and value else value
+                           for key, value in watermark.items()} or None
+        return state
+
+
+def day_ranges(days: np.ndarray) -> List[Tuple[datetime, datetime]]:
+    """Gộp các ngày (số ngày kể từ epoch) thành các khoảng liên tiếp [start, end)"""
+    ranges = []
+    for day in np.unique(days).tolist():
+        start = datetime.combine(np.datetime64(day, 'D').astype(datetime), datetime.min.time())
+        end = datetime.combine(np.datetime64(day + 1, 'D').astype(datetime), datetime.min.time())
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Window Aggregation Engine
+Tổng hợp order lines cho tất cả các khoảng thời gian (data_range) trong một lượt duyệt
+"""
+
+import numpy as np
+from datetime import date, datetime
+from typing import Dict, Optional, Tuple
+
+from ranking import RankingTable
+from sales_fact import SalesFact, sum_by_index, to_datetime64
+
+# Cột tổng hợp bán hàng hợp lệ theo item (revenue, profit theo đơn vị tiền nhỏ nhất)
+SALES_COLUMNS = {'line_count': np.int64, 'quantity': np.int64, 'revenue': np.int64, 'profit': np.int64}
+# Cột tổng hợp refund theo (item, nhóm lý do)
+REFUND_COLUMNS = {'refund_count': np.int64, 'refund_quantity': np.int64}
+# Cột đếm đơn hàng theo trạng thái refund
+ORDER_COLUMNS = {'order_count': np.int64}
+# Cột doanh thu hợp lệ theo ngày
+DAILY_COLUMNS = {'revenue': np.int64}
+
+
+class SegmentTotals:
+    """Cộng dồn các cột theo (segment thời gian, key) dưới dạng thưa, sau finalize sắp xếp theo segment"""
+
+    def __init__(self, cuts: np.ndarray, columns: Dict[str, type]):
+        self.cuts = cuts
+        self.columns = columns
+        self._chunks = []
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.segments = np.zeros(0, dtype=np.int64)
+        self.sums = {column: np.zeros(0, dtype=dtype) for column, dtype in columns.items()}
+        # Vị trí dòng đầu tiên của từng segment (segment s chiếm các dòng [starts[s], starts[s + 1]))
+        self.segment_starts = np.zeros(len(cuts) + 2, dtype=np.int64)
+
+    def add(self, dates: np.ndarray, keys: np.ndarray, weights: Dict[str, np.ndarray]):
+        """Gán segment cho từng dòng và cộng dồn theo (key, segment)"""
+        if len(keys) == 0:
+            return
+        segments = np.searchsorted(self.cuts, dates, side='right')
+        combined = keys.astype(np.int64) * (len(self.cuts) + 1) + segments
+        unique, inverse = np.unique(combined, return_inverse=True)
+        sums = {column: self._reduce(inverse, weights[column], len(unique), dtype)
+                for column, dtype in self.columns.items()}
+        self._chunks.append((unique, sums))
+
+    def finalize(self):
+        """Gộp các chunk đã cộng dồn thành một bảng (key, segment) duy nhất"""
+        if not self._chunks:
+            return
+        combined = np.concatenate([unique for unique, _ in self._chunks])
+        unique, inverse = np.unique(combined, return_inverse=True)
+        keys, segments = unique // (len(self.cuts) + 1), unique % (len(self.cuts) + 1)
+        order = np.lexsort((keys, segments))
+        for column, dtype in self.columns.items():
+            values = np.concatenate([sums[column] for _, sums in self._chunks])
+            self.sums[column] = self._reduce(inverse, values, len(unique), dtype)[order]
+        self.keys, self.segments = keys[order], segments[order]
+        self.segment_starts = np.searchsorted(self.segments, np.arange(len(self.cuts) + 2))
+        self._chunks = []
+
+    def _rows(self, segment_range: Tuple[int, int]) -> slice:
+        lo, hi = segment_range
+        return slice(self.segment_starts[lo], self.segment_starts[max(hi, lo)])
+
+    def window(self, segment_range: Tuple[int, int]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Tổng theo key cho các segment trong [lo, hi)"""
+        rows = self._rows(segment_range)
+        unique, inverse = np.unique(self.keys[rows], return_inverse=True)
+        sums = {column: self._reduce(inverse, self.sums[column][rows], len(unique), dtype)
+                for column, dtype in self.columns.items()}
+        return unique, sums
+
+    def dense_window(self, segment_range: Tuple[int, int], n_keys: int) -> Dict[str, np.ndarray]:
+        """Tổng theo key (mảng dày 0..n_keys-1) cho các segment trong [lo, hi)"""
+        rows = self._rows(segment_range)
+        return {column: self._reduce(self.keys[rows], self.sums[column][rows], n_keys, dtype)
+                for column, dtype in self.columns.items()}
+
+    def slide(self, dense: Dict[str, np.ndarray], previous: Tuple[int, int], segment_range: Tuple[int, int],
+              n_keys: int) -> Dict[str, np.ndarray]:
+        """
+        Tổng của cửa sổ [lo, hi) suy ra từ tổng dày của cửa sổ trước đó [prev_lo, prev_hi) giao với nó
+        (prev_lo <= lo <= prev_hi <= hi): cộng các segment mới vào, trừ các segment đã trượt ra
+        """
+        (prev_lo, prev_hi), (lo, hi) = previous, segment_range
+        added = self.dense_window((prev_hi, hi), n_keys)
+        removed = self.dense_window((prev_lo, lo), n_keys)
+        return {column: dense[column] + added[column] - removed[column] for column in self.columns}
+
+    @staticmethod
+    def _reduce(inverse: np.ndarray, values: np.ndarray, size: int, dtype) -> np.ndarray:
+        return sum_by_index(inverse, np.asarray(values, dtype=dtype), size)
+
+
+class WindowAggregates:
+    """
+    Tổng hợp theo item/category/brand cho nhiều cửa sổ thời gian, tính một lần cho mỗi lần chạy
+    Có thể chứa cửa sổ của nhiều ngày phân tích (backfill): dữ liệu chỉ cộng dồn một lần theo
+    các điểm cắt của tất cả các ngày, use_date() chọn bộ cửa sổ của ngày đang phân tích
+    """
+
+    def __init__(self, windows: Dict[date, Dict[str, Tuple[datetime, Optional[datetime]]]], fact: SalesFact,
+                 day_level: bool = False):
+        """
+        windows: {ngày phân tích: {tên: (start, end)}} với start <= order_date <= end,
+                 end=None nghĩa là không giới hạn trên; ngày đầu tiên được chọn sẵn
+        fact: fact gốc chứa các dimension (items, brands, categories) và index lý do refund
+        day_level: dữ liệu đã gộp theo ngày (mốc 00:00), cửa sổ lấy các ngày có start <= ngày < end
+        """
+        self.fact = fact
+        self.n_items = fact.n_items
+        self.reason_group = np.zeros(0, dtype=np.int64)
+        self.n_reason_groups = 1
+
+        # Mỗi cửa sổ [start, end] tạo ra 2 điểm cắt: start và end + 1 micro giây
+        end_offset = np.timedelta64(0 if day_level else 1, 'us')
+        bounds = {}
+        for analysis_date, date_windows in windows.items():
+            bounds[analysis_date] = {name: (to_datetime64(start), to_datetime64(end) + end_offset if end is not None else None)
+                                     for name, (start, end) in date_windows.items()}
+        self.cuts = np.unique(np.array([value for date_bounds in bounds.values() for pair in date_bounds.values()
+                                        for value in pair if value is not None], dtype='datetime64[us]'))
+        # Cửa sổ của từng ngày phân tích ứng với dải segment [lo, hi)
+        self.segments_by_date = {}
+        for analysis_date, date_bounds in bounds.items():
+            self.segments_by_date[analysis_date] = {}
+            for name, (start, end) in date_bounds.items():
+                lo = int(np.searchsorted(self.cuts, start, side='right'))
+                hi = int(np.searchsorted(self.cuts, end, side='right')) if end is not None else len(self.cuts) + 1
+                self.segments_by_date[analysis_date][name] = (lo, hi)
+        self.analysis_date = next(iter(self.segments_by_date))
+        self.window_segments = self.segments_by_date[self.analysis_date]
+
+        self.sales = SegmentTotals(self.cuts, SALES_COLUMNS)
+        # Refund cộng dồn theo (lý do gốc, item); gộp lý do thành nhóm khi truy vấn
+        self.refunds = SegmentTotals(self.cuts, REFUND_COLUMNS)
+        self.orders = SegmentTotals(self.cuts, ORDER_COLUMNS)
+        # Doanh thu hợp lệ theo ngày (key là số ngày, một segment duy nhất)
+        self.daily = SegmentTotals(np.zeros(0, dtype='datetime64[us]'), DAILY_COLUMNS)
+        self._cache = {}
+        # Tổng theo item gần nhất của từng cửa sổ: (dải segment, tổng dày), dùng để trượt sang ngày kế tiếp
+        self._item_totals_by_window = {}
+
+    def add_lines(self, fact: SalesFact):
+        """Cộng dồn một chunk order lines"""
+        valid = ~fact.is_refund
+        self.add_sales(fact.order_date[valid], fact.item_idx[valid], {
+            'line_count': np.ones(np.count_nonzero(valid), dtype=np.int64),
+            'quantity': fact.quantity[valid],
+            'revenue': fact.revenue[valid],
+            'profit': fact.profit[valid],
+        })
+
+        refunded = fact.is_refund
+        self.add_refunds(fact.order_date[refunded], fact.item_idx[refunded], fact.reason_idx[refunded], {
+            'refund_count': np.ones(np.count_nonzero(refunded), dtype=np.int64),
+            'refund_quantity': fact.quantity[refunded],
+        })
+
+    def add_sales(self, dates: np.ndarray, item_idx: np.ndarray, sums: Dict[str, np.ndarray], daily: bool = True):
+        """
+        Cộng dồn tổng bán hàng hợp lệ (các cột SALES_COLUMNS) theo item
+        daily: cộng cả vào doanh thu theo ngày (False khi dates không phải ngày bán thật, ví dụ tổng đã gộp)
+        """
+        self.sales.add(dates, item_idx, sums)
+        if daily:
+            self.add_daily_revenue(dates.astype('datetime64[D]'), sums['revenue'])
+
+    def add_daily_revenue(self, days: np.ndarray, revenue: np.ndarray):
+        """Cộng dồn doanh thu hợp lệ theo ngày (days: datetime64[D])"""
+        self.daily.add(days.astype('datetime64[us]'), days.astype('datetime64[D]').astype(np.int64), {'revenue': revenue})
+
+    def add_refunds(self, dates: np.ndarray, item_idx: np.ndarray, reason_idx: np.ndarray, sums: Dict[str, np.ndarray]):
+        """Cộng dồn tổng refund (các cột REFUND_COLUMNS) theo (lý do gốc, item)"""
+        self.refunds.add(dates, reason_idx * self.n_items + item_idx, sums)
+
+    def add_orders(self, order_dates: np.ndarray, order_is_refund: np.ndarray, order_count: np.ndarray = None):
+        """Cộng dồn một chunk orders (để đếm số đơn hàng, kể cả đơn không có order_items)"""
+        self.orders.add(order_dates, order_is_refund.astype(np.int64), {
+            'order_count': order_count if order_count is not None else np.ones(len(order_dates), dtype=np.int64),
+        })
+
+    def finalize(self, reason_group: np.ndarray, n_reason_groups: int):
+        """
+        Kết thúc giai đoạn cộng dồn
+        reason_group: nhóm lý do refund tương ứng với từng lý do gốc trong fact.refund_reasons
+        """
+        for totals in (self.sales, self.refunds, self.orders, self.daily):
+            totals.finalize()
+        self.reason_group = reason_group
+        self.n_reason_groups = max(n_reason_groups, 1)
+        self._cache = {}
+        self._item_totals_by_window = {}
+
+    def use_date(self, analysis_date: date):
+        """
+        Chọn bộ cửa sổ của một ngày phân tích. Tổng theo item của các cửa sổ được trượt từ ngày trước đó
+        (chỉ cộng/trừ các segment thay đổi) và tính sẵn ngay tại đây để dùng chung cho mọi worker
+        """
+        if analysis_date not in self.segments_by_date:
+            raise ValueError(f"Ngày phân tích không được tổng hợp sẵn: {analysis_date}")
+        self.analysis_date = analysis_date
+        self.window_segments = self.segments_by_date[analysis_date]
+        self._cache = {}
+        for window in self.window_segments:
+            self.item_totals(window)
+
+    def _cached(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def item_totals(self, window: str) -> Dict[str, np.ndarray]:
+        """Tổng bán hàng hợp lệ theo item (mảng dày theo vị trí item) trong cửa sổ"""
+        def compute():
+            segment_range = self.window_segments[window]
+            previous = self._item_totals_by_window.get(window)
+            if previous is not None and previous[0] == segment_range:
+                dense = previous[1]
+            elif previous is not None and previous[0][0] <= segment_range[0] <= previous[0][1] <= segment_range[1]:
+                dense = self.sales.slide(previous[1], previous[0], segment_range, self.n_items)
+            else:
+                dense = self.sales.dense_window(segment_range, self.n_items)
+            self._item_totals_by_window[window] = (segment_range, dense)
+            return dense
+        return self._cached(('items', window), compute)
+
+    def sales_velocity(self, window: str, days: int) -> np.ndarray:
+        """Số lượng bán hợp lệ trung bình mỗi ngày theo item (mảng dày theo vị trí item) trong cửa sổ"""
+        return self._cached(('velocity', window), lambda: self.item_totals(window)['quantity'] / days)
+
+    def group_totals(self, window: str, group: str) -> Dict[str, np.ndarray]:
+        """Tổng bán hàng hợp lệ theo category hoặc brand trong cửa sổ"""
+        def compute():
+            if group == 'category':
+                group_idx, n_groups = self.fact.item_category_idx, len(self.fact.category_ids)
+            else:
+                group_idx, n_groups = self.fact.item_brand_idx, len(self.fact.brand_ids)
+            return self.fact.group_totals(self.item_totals(window), group_idx, n_groups)
+        return self._cached((group, window), compute)
+
+    def item_ranking(self, window: str) -> RankingTable:
+        """Bảng xếp hạng các item có phát sinh bán trong cửa sổ (chỉ số SALES_COLUMNS, hòa thì theo item_id)"""
+        def compute():
+            totals = self.item_totals(window)
+            return RankingTable(totals, self.fact.item_ids, np.flatnonzero(totals['line_count']))
+        return self._cached(('item_ranking', window), compute)
+
+    def group_ranking(self, window: str, group: str) -> RankingTable:
+        """Bảng xếp hạng các category/brand có phát sinh bán trong cửa sổ (hòa thì theo id nhóm)"""
+        def compute():
+            totals = self.group_totals(window, group)
+            group_ids = self.fact.category_ids if group == 'category' else self.fact.brand_ids
+            return RankingTable(totals, group_ids, np.flatnonzero(totals['line_count']))
+        return self._cached((f'{group}_ranking', window), compute)
+
+    def refund_totals(self, window: str) -> Dict[str, np.ndarray]:
+        """Tổng refund theo (item, nhóm lý do) trong cửa sổ"""
+        def compute():
+            keys, sums = self.refunds.window(self.window_segments[window])
+            groups = self.reason_group[keys // self.n_items]
+            unique, inverse = np.unique((keys % self.n_items) * self.n_reason_groups + groups, return_inverse=True)
+            return {
+                'key': unique,
+                'item_idx': unique // self.n_reason_groups,
+                'reason_group': unique % self.n_reason_groups,
+                'refund_count': SegmentTotals._reduce(inverse, sums['refund_count'], len(unique), np.int64),
+                'refund_quantity': SegmentTotals._reduce(inverse, sums['refund_quantity'], len(unique), np.int64),
+            }
+        return self._cached(('refunds', window), compute)
+
+    def order_counts(self, window: str) -> Tuple[int, int]:
+        """Số đơn hàng hợp lệ và số đơn refund trong cửa sổ"""
+        keys, sums = self.orders.window(self.window_segments[window])
+        counts = dict(zip(keys.tolist(), sums['order_count'].tolist()))
+        return counts.get(0, 0), counts.get(1, 0)
+
+    def daily_revenue(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Doanh thu hợp lệ theo ngày: (ngày datetime64[D] tăng dần, doanh thu theo đơn vị tiền nhỏ nhất)"""
+        days, sums = self.daily.window((0, 1))
+        return days.astype('datetime64[D]'), sums['revenue']
@@ -8,25 +8,41 @@ import pandas as pd
 import numpy as np
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import logging
+import threading
+import time
 from typing import Dict, List, Tuple
+from collections import defaultdict
 import re
 from decimal import Decimal
-from sqlalchemy import func, and_, desc, asc, text, Enum, PrimaryKeyConstraint, Column, Date, String, Integer, DateTime
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import select, func, case, and_, or_, desc, asc, text, Enum, PrimaryKeyConstraint, Column, Date, String, Integer, DateTime
 import sys
 import os
 
 # Thêm đường dẫn đến thư mục cha để có thể import package
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+from sales_fact import SalesFact, to_datetime64
+from ranking import RankingTable
+from aggregate_state import DailyAggregateState, day_ranges
+from aggregation import WindowAggregates
+from sql_backend import SqlAnalyticsBackend
+from rollup import ItemDailyRollup
+from snapshot import SnapshotCache
+from money import to_decimal, to_float, to_minor, to_minor_array, margin_percent
+from records import ItemRecord, BrandRecord, CategoryRecord, BatchRecord, load_records
+from summary_writer import SummaryWriter
+from stage_runner import StageRunner
+from refund_classifier import RefundReasonClassifier
 from package.models.models import (
-    create_db_engine, create_session, 
+    get_engine, get_session_factory,
     Brand, Category, Item, Batch, Order, OrderItem, Base,
     DailySalesSummary, TopSellingItem, CategorySummary, 
-    BrandSummary, RefundAnalysis, LowStockAlert, SlowMovingItem, RevenuePrediction
+    BrandSummary, RefundAnalysis, LowStockAlert, SlowMovingItem, RevenuePrediction, ItemDailySales,
+    AnalysisVersion, ApiDocument
 )
+from package.models.api_documents import build_documents, document_keys
 
 # Cấu hình logging
 logging.basicConfig(
@@ -38,81 +54,458 @@ logging.basicConfig(
     ]
 )
 
+# Backend thực thi phân tích: memory (load dữ liệu vào RAM) hoặc sql (GROUP BY trong database)
+ANALYTICS_BACKENDS = ('memory', 'sql')
+
+# Các sort_type được chạy trong run_all_analysis
+SLOW_MOVING_TYPES = ['no_sales', 'low_sales', 'high_stock_low_sales', 'aging_stock']
+# Tiêu chí xếp hạng (giảm dần) của từng sort_type hàng bán ế
+SLOW_MOVING_SORT_KEYS = {
+    'no_sales': 'stock_value',
+    'low_sales': ('stock_to_sales_ratio', 'least_sold'),
+    'high_stock_low_sales': 'stock_to_sales_ratio',
+    'aging_stock': 'days_in_stock',
+}
+TOP_SELLING_TYPES = ['revenue', 'profit', 'quantity']
+GROUP_TYPES = ['revenue', 'quantity']
+REFUND_TYPES = ['refund_count', 'refund_rate', 'refund_quantity', 'refund_reason']
+
+# Các nhóm bước phân tích có thể chạy và lưu riêng (mỗi nhóm là một job của scheduler)
+ANALYSIS_GROUPS = ('daily_sales', 'low_stock', 'slow_moving', 'rankings', 'revenue_prediction')
+RANKING_STAGES = ('top_items', 'category', 'brand', 'refunds')
+
+# Các khoảng lookback (ngày) được tính sẵn tốc độ bán theo item
+VELOCITY_LOOKBACKS = (7, 14, 30, 90)
+
 class AnalyticsDataEngine:
-    def __init__(self):
-        """Khởi tạo Analytics Engine với Simple Models"""
-        self.engine = create_db_engine()
-        self.Session = sessionmaker(bind=self.engine)
-        # self.today = datetime.now()
-        self.today = datetime(2024, 6, 30)
-        self.analysis_date = self.today.date()
+    def __init__(self, backend: str = None, analysis_dates: List[date] = None, today: datetime = None):
+        """
+        Khởi tạo Analytics Engine với Simple Models
+        analysis_dates: các ngày phân tích dùng chung một lần load dữ liệu (backfill), mặc định chỉ ngày hôm nay
+        today: mốc phân tích, mặc định mốc cố định của lần chạy một lần (scheduler truyền thời điểm hiện tại)
+        """
+        self.backend = (backend or os.getenv('ANALYTICS_BACKEND', 'memory')).strip().lower()
+        if self.backend not in ANALYTICS_BACKENDS:
+            raise ValueError(f"Analytics backend không hợp lệ: {self.backend}. Chỉ hỗ trợ: {', '.join(ANALYTICS_BACKENDS)}")
+        
+        # Số dòng mỗi chunk khi stream orders/order_items
+        self.chunk_size = int(os.getenv('ANALYTICS_CHUNK_SIZE', '50000'))
+        # Số ngày lookback dùng để tính tốc độ bán cho cảnh báo tồn kho
+        self.low_stock_lookback = int(os.getenv('ANALYTICS_LOW_STOCK_LOOKBACK', '30'))
+        if self.low_stock_lookback <= 0:
+            raise ValueError(f"ANALYTICS_LOW_STOCK_LOOKBACK phải lớn hơn 0: {self.low_stock_lookback}")
+        self.velocity_lookbacks = sorted(set(VELOCITY_LOOKBACKS) | {self.low_stock_lookback})
+        
+        # Incremental: giữ tổng hợp theo ngày giữa các lần chạy, chỉ đọc lại các ngày có orders mới/thay đổi
+        self.incremental = os.getenv('ANALYTICS_INCREMENTAL', 'false').strip().lower() in ('1', 'true', 'yes')
+        self.state_path = os.getenv('ANALYTICS_STATE_PATH', 'analytics_state.npz')
+        self.aggregate_state = None
+        # Rollup: tổng bán hàng theo cửa sổ đọc từ bảng item_daily_sales (được làm mới trước khi load)
+        self.use_rollup = os.getenv('ANALYTICS_ROLLUP', 'false').strip().lower() in ('1', 'true', 'yes')
+        # Snapshot các bảng nguồn trên đĩa (rỗng: luôn đọc từ database)
+        self.snapshot_dir = os.getenv('ANALYTICS_SNAPSHOT_DIR', '').strip()
+        # Chỉ stream order lines trong cửa sổ có giới hạn rộng nhất, phần lịch sử trước đó đọc dạng đã GROUP BY
+        self.bounded_load = os.getenv('ANALYTICS_BOUNDED_LOAD', 'true').strip().lower() in ('1', 'true', 'yes')
+        # Tính sẵn JSON response của các endpoint chuẩn cho API sau mỗi lần ghi summary
+        self.api_documents = os.getenv('ANALYTICS_API_DOCUMENTS', 'true').strip().lower() in ('1', 'true', 'yes')
+        
+        self.engine = get_engine()
+        self.Session = get_session_factory()
+        self.snapshots = SnapshotCache(self.snapshot_dir, self.engine) if self.snapshot_dir else None
+        self._set_today(today or datetime(2024, 6, 30))
+        if analysis_dates:
+            self.analysis_dates = sorted(set(analysis_dates))
+            self.today = datetime.combine(self.analysis_dates[0], datetime.min.time())
+            self.analysis_date = self.analysis_dates[0]
         self.logger = logging.getLogger(__name__)
+        self.sql_backend = SqlAnalyticsBackend(self.engine, self.use_rollup) if self.backend == 'sql' else None
+        self.refund_classifier = RefundReasonClassifier.from_env()
+        # Writer gom dòng summary trong run_all_analysis (None: mỗi save_* ghi ngay)
+        self._summary_writer = None
+        # Các job của scheduler chạy song song trên cùng engine nhưng ghi summary lần lượt
+        self._save_lock = threading.Lock()
+        
+        self._load_source_data()
+        
+    def _load_source_data(self):
+        """Làm mới rollup (nếu bật) rồi load dữ liệu nguồn từ database"""
+        if self.use_rollup:
+            ItemDailyRollup(self.engine, self.logger).refresh()
         
         # Load data từ database
-        self._load_data_from_db()
+        if self.sql_backend:
+            self._load_dimensions_from_db()
+        else:
+            self._load_data_from_db()
+        
+    def _set_today(self, today: datetime):
+        """Đặt mốc phân tích, chỉ phân tích một ngày (ngày của mốc)"""
+        self.today = today
+        self.analysis_date = today.date()
+        self.analysis_dates = [self.analysis_date]
+        
+    def refresh_data(self, today: datetime = None):
+        """
+        Chuyển mốc phân tích sang today (mặc định thời điểm hiện tại) rồi đọc lại dữ liệu nguồn
+        cho các lần phân tích tiếp theo (job load_data của scheduler)
+        """
+        self._set_today(today or datetime.now())
+        self._load_source_data()
+        if not self.sql_backend:
+            self.window_aggregates.use_date(self.analysis_date)
+        self._save_incremental_state()
         
     def _load_data_from_db(self):
-        """Load dữ liệu từ database vào memory"""
+        """Load dimension vào memory và stream orders/order_items theo chunk vào các bảng tổng hợp"""
         self.logger.info("Loading data from database...")
-        session = self.get_session()
-        try:
-            # Load tất cả dữ liệu cần thiết với relationships
-            from sqlalchemy.orm import joinedload
-            
-            # Load orders với order_items
-            self.orders = session.query(Order).options(
-                joinedload(Order.order_items)
-            ).all()
-            
-            # Load order_items
-            self.order_items = session.query(OrderItem).all()
-            
-            # Load items với relationships
-            self.items = session.query(Item).options(
-                joinedload(Item.brand),
-                joinedload(Item.category)
-            ).all()
-            
-            # Load categories
-            self.categories = session.query(Category).all()
-            
-            # Load brands
-            self.brands = session.query(Brand).all()
-            
-            # Load batches
-            self.batches = session.query(Batch).all()
-            
-            self.logger.info(f"Loaded {len(self.orders)} orders, {len(self.order_items)} order items, "
-                           f"{len(self.items)} items, {len(self.categories)} categories, "
-                           f"{len(self.brands)} brands, {len(self.batches)} batches")
-        finally:
-            session.close()
+        # Dimension được giữ dưới dạng record gọn nhẹ (không phải ORM object)
+        with self.engine.connect() as connection:
+            self.items = self._load_table(connection, Item, ItemRecord)
+            self.categories = self._load_table(connection, Category, CategoryRecord)
+            self.brands = self._load_table(connection, Brand, BrandRecord)
+            self.batches = self._load_table(connection, Batch, BatchRecord)
+        
+        self.logger.info(f"Loaded {len(self.items)} items, {len(self.categories)} categories, "
+                         f"{len(self.brands)} brands, {len(self.batches)} batches")
+        
+        self._build_indexes()
+        
+        # Fact table dạng cột: giữ dimension, order lines được cộng dồn theo chunk
+        self.sales_fact = SalesFact(self.items, self.brands, self.categories)
+        self._refund_groups = None
+        self._slow_moving_cache = None
+        windows = {analysis_date: self._get_analysis_windows(self.today + timedelta(days=(analysis_date - self.analysis_date).days))
+                   for analysis_date in self.analysis_dates}
+        self.window_aggregates = WindowAggregates(windows, self.sales_fact, day_level=self.incremental or self.use_rollup)
+        
+        if self.use_rollup:
+            self._load_from_rollup()
+        elif self.incremental:
+            self._load_incremental_state()
+        elif self.snapshots:
+            n_lines, n_orders = self._feed_order_lines_snapshot(), self._feed_orders_snapshot()
+            self.logger.info(f"Đã nạp {n_orders} orders, {n_lines} order items từ snapshot (chunk {self.chunk_size} dòng)")
+        elif self.bounded_load:
+            # Cửa sổ có giới hạn rộng nhất (1_year_ago của ngày phân tích sớm nhất); all_time, lifetime
+            # và doanh thu theo ngày phía trước mốc này lấy từ các truy vấn GROUP BY
+            history_end = min(start for date_windows in windows.values() for start, _ in date_windows.values()
+                              if start != datetime.min)
+            in_window = Order.order_date >= history_end
+            n_lines, n_orders = (self._stream_order_lines(self.window_aggregates, in_window),
+                                 self._stream_orders(self.window_aggregates, in_window))
+            n_history = self._load_history_totals(history_end)
+            self.logger.info(f"Đã stream {n_orders} orders, {n_lines} order items từ {history_end} "
+                             f"(chunk {self.chunk_size} dòng), {n_history} dòng tổng hợp trước đó")
+        else:
+            n_lines, n_orders = self._stream_order_lines(self.window_aggregates), self._stream_orders(self.window_aggregates)
+            self.logger.info(f"Đã stream {n_orders} orders, {n_lines} order items (chunk {self.chunk_size} dòng)")
+        
+        labels, reason_group = self._refund_reason_groups()
+        self.window_aggregates.finalize(reason_group, len(labels))
+        
+    def _stream(self, statement):
+        """Đọc kết quả truy vấn theo từng chunk bằng server-side cursor"""
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=self.chunk_size).execute(statement)
+            for rows in result.partitions():
+                yield rows
+        
+    @staticmethod
+    def _order_lines_statement(*conditions):
+        """Order lines kèm ngày, trạng thái, lý do refund của order"""
+        return (select(OrderItem.order_id, Order.order_date, Order.status, Order.refund_reason,
+                       OrderItem.item_id, OrderItem.quantity, OrderItem.price_per_unit)
+                .join(Order, Order.id == OrderItem.order_id)
+                .where(*conditions))
+        
+    def _stream_order_lines(self, sink, *conditions) -> int:
+        """Stream order lines (kèm ngày, trạng thái, lý do refund của order) vào sink (add_lines)"""
+        n_lines = 0
+        for rows in self._stream(self._order_lines_statement(*conditions)):
+            sink.add_lines(self.sales_fact.lines_chunk(rows))
+            n_lines += len(rows)
+        return n_lines
+        
+    def _stream_orders(self, sink, *conditions) -> int:
+        """Stream ngày và trạng thái của orders vào sink (add_orders) để đếm số đơn hàng"""
+        n_orders = 0
+        for rows in self._stream(select(Order.order_date, Order.status).where(*conditions)):
+            order_dates, statuses = zip(*rows)
+            sink.add_orders(np.array(order_dates, dtype='datetime64[us]'),
+                            np.array(statuses, dtype=object) == 'refunded')
+            n_orders += len(rows)
+        return n_orders
+        
+    def _load_history_totals(self, history_end: datetime) -> int:
+        """
+        Nạp dữ liệu trước history_end ở dạng đã GROUP BY trong database: tổng bán hàng theo item,
+        tổng refund theo (item, lý do gốc), số đơn theo trạng thái (đặt ngay trước history_end, chỉ rơi
+        vào các cửa sổ không giới hạn cận dưới) và doanh thu hợp lệ theo ngày. Trả về số dòng đã đọc
+        """
+        before = Order.order_date < history_end
+        is_valid = Order.status != 'refunded'
+        line_revenue = OrderItem.quantity * OrderItem.price_per_unit
+        sales_date = self._history_date(history_end)
+        
+        with self.engine.connect() as connection:
+            sales = connection.execute(
+                select(OrderItem.item_id, func.count(), func.sum(OrderItem.quantity), func.sum(line_revenue))
+                .join(Order, Order.id == OrderItem.order_id)
+                .where(before, is_valid)
+                .group_by(OrderItem.item_id)).all()
+            refunds = connection.execute(
+                select(OrderItem.item_id, Order.refund_reason, func.count(), func.sum(OrderItem.quantity))
+                .join(Order, Order.id == OrderItem.order_id)
+                .where(before, Order.status == 'refunded')
+                .group_by(OrderItem.item_id, Order.refund_reason)).all()
+            is_refund = case((Order.status == 'refunded', 1), else_=0)
+            orders = connection.execute(select(is_refund, func.count(Order.id)).where(before).group_by(is_refund)).all()
+            day = func.date(Order.order_date)
+            daily = connection.execute(
+                select(day, func.sum(line_revenue))
+                .join(OrderItem, OrderItem.order_id == Order.id)
+                .where(before, is_valid)
+                .group_by(day)).all()
+        
+        if sales:
+            item_ids, line_counts, quantities, revenues = zip(*sales)
+            item_idx = self.sales_fact.item_index(item_ids)
+            known = item_idx >= 0
+            quantity = np.array(quantities, dtype=np.int64)[known]
+            revenue = np.array([to_minor(value) for value in revenues], dtype=np.int64)[known]
+            self.window_aggregates.add_sales(np.full(np.count_nonzero(known), sales_date), item_idx[known], {
+                'line_count': np.array(line_counts, dtype=np.int64)[known],
+                'quantity': quantity,
+                'revenue': revenue,
+                'profit': revenue - self.sales_fact.item_cost_price[item_idx[known]] * quantity,
+            }, daily=False)
+        if refunds:
+            item_ids, reasons, refund_counts, refund_quantities = zip(*refunds)
+            item_idx = self.sales_fact.item_index(item_ids)
+            known = item_idx >= 0
+            reason_idx = self.sales_fact.register_reasons(list(reasons))
+            self.window_aggregates.add_refunds(np.full(np.count_nonzero(known), sales_date), item_idx[known],
+                                               reason_idx[known], {
+                'refund_count': np.array(refund_counts, dtype=np.int64)[known],
+                'refund_quantity': np.array(refund_quantities, dtype=np.int64)[known],
+            })
+        if orders:
+            refund_flags, counts = zip(*orders)
+            self.window_aggregates.add_orders(np.full(len(orders), sales_date), np.array(refund_flags, dtype=np.int64).astype(bool),
+                                              np.array(counts, dtype=np.int64))
+        if daily:
+            days, revenues = zip(*daily)
+            self.window_aggregates.add_daily_revenue(np.array(days, dtype='datetime64[D]'),
+                                                     np.array([to_minor(value) for value in revenues], dtype=np.int64))
+        return len(sales) + len(refunds) + len(orders) + len(daily)
+        
+    @staticmethod
+    def _history_date(history_end: datetime) -> np.datetime64:
+        """Mốc gán cho các tổng đã gộp trước history_end (micro giây cuối cùng trước mốc)"""
+        return to_datetime64(history_end) - np.timedelta64(1, 'us')
+        
+    def _load_table(self, connection, model, record_cls) -> List:
+        """Các record của bảng dimension, lấy từ snapshot nếu bảng không thay đổi"""
+        if self.snapshots is None:
+            return load_records(connection, model, record_cls)
+        return self.snapshots.load_records(model, record_cls, self.snapshots.table_signature(model),
+                                           lambda: load_records(connection, model, record_cls))
+        
+    def _feed_order_lines_snapshot(self) -> int:
+        """Nạp order lines từ snapshot (làm mới nếu orders/order_items thay đổi) vào các bảng tổng hợp theo chunk"""
+        signature = self.snapshots.table_signature(Order) + self.snapshots.table_signature(OrderItem)
+        columns, reasons = self.snapshots.load_columns('order_lines', signature, self._build_order_lines_snapshot)
+        n_lines = len(columns['order_id'])
+        for start in range(0, n_lines, self.chunk_size):
+            part = {column: values[start:start + self.chunk_size] for column, values in columns.items()}
+            self.window_aggregates.add_lines(self.sales_fact.columns_chunk(
+                part['order_id'], part['order_date'], part['is_refund'], part['reason_idx'], reasons,
+                part['item_id'], part['quantity'], part['price_per_unit']))
+        return n_lines
+        
+    def _build_order_lines_snapshot(self) -> Tuple[Dict[str, np.ndarray], List]:
+        """Đọc toàn bộ order lines thành các cột; lý do refund gốc lưu riêng, mỗi dòng refund giữ vị trí lý do"""
+        parts = defaultdict(list)
+        reason_pos = {}
+        for rows in self._stream(self._order_lines_statement()):
+            order_ids, order_dates, statuses, reasons, item_ids, quantities, prices = zip(*rows)
+            is_refund = np.array(statuses, dtype=object) == 'refunded'
+            parts['order_id'].append(np.array(order_ids, dtype=np.int64))
+            parts['order_date'].append(np.array(order_dates, dtype='datetime64[us]'))
+            parts['is_refund'].append(is_refund)
+            parts['reason_idx'].append(np.array([reason_pos.setdefault(reason, len(reason_pos)) if refund else -1
+                                                 for reason, refund in zip(reasons, is_refund)], dtype=np.int64))
+            parts['item_id'].append(np.array(item_ids, dtype=np.int64))
+            parts['quantity'].append(np.array(quantities, dtype=np.int64))
+            parts['price_per_unit'].append(to_minor_array(prices))
+        
+        dtypes = {'order_id': np.int64, 'order_date': 'datetime64[us]', 'is_refund': bool, 'reason_idx': np.int64,
+                  'item_id': np.int64, 'quantity': np.int64, 'price_per_unit': np.int64}
+        columns = {column: np.concatenate(parts[column]) if parts[column] else np.zeros(0, dtype=dtype)
+                   for column, dtype in dtypes.items()}
+        return columns, list(reason_pos)
+        
+    def _feed_orders_snapshot(self) -> int:
+        """Nạp ngày và trạng thái orders từ snapshot (làm mới nếu orders thay đổi) để đếm số đơn hàng"""
+        def build():
+            parts = defaultdict(list)
+            for rows in self._stream(select(Order.order_date, Order.status)):
+                order_dates, statuses = zip(*rows)
+                parts['order_date'].append(np.array(order_dates, dtype='datetime64[us]'))
+                parts['is_refund'].append(np.array(statuses, dtype=object) == 'refunded')
+            return {'order_date': np.concatenate(parts['order_date']) if parts else np.zeros(0, dtype='datetime64[us]'),
+                    'is_refund': np.concatenate(parts['is_refund']) if parts else np.zeros(0, dtype=bool)}, None
+        
+        columns, _ = self.snapshots.load_columns('orders', self.snapshots.table_signature(Order), build)
+        n_orders = len(columns['order_date'])
+        for start in range(0, n_orders, self.chunk_size):
+            self.window_aggregates.add_orders(np.asarray(columns['order_date'][start:start + self.chunk_size]),
+                                              np.asarray(columns['is_refund'][start:start + self.chunk_size]))
+        return n_orders
+        
+    def _load_from_rollup(self):
+        """Tổng bán hàng theo ngày từ item_daily_sales; chỉ stream các dòng refund (cần lý do gốc) và đếm orders theo ngày"""
+        n_rows = 0
+        statement = (select(ItemDailySales.sale_date, ItemDailySales.item_id, ItemDailySales.quantity, ItemDailySales.revenue)
+                     .where(ItemDailySales.quantity > 0))
+        for rows in self._stream(statement):
+            sale_dates, item_ids, quantities, revenues = zip(*rows)
+            item_idx = self.sales_fact.item_index(item_ids)
+            known = item_idx >= 0
+            quantity = np.array(quantities, dtype=np.int64)[known]
+            revenue = to_minor_array(revenues)[known]
+            # Mỗi dòng rollup tính là một lần bán (chỉ dùng để biết item có phát sinh bán trong cửa sổ)
+            self.window_aggregates.add_sales(np.array(sale_dates, dtype='datetime64[D]').astype('datetime64[us]')[known],
+                                             item_idx[known], {
+                'line_count': np.ones(len(quantity), dtype=np.int64),
+                'quantity': quantity,
+                'revenue': revenue,
+                'profit': revenue - self.sales_fact.item_cost_price[item_idx[known]] * quantity,
+            })
+            n_rows += len(rows)
+        
+        n_refund_lines = self._stream_order_lines(self.window_aggregates, Order.status == 'refunded')
+        
+        day = func.date(Order.order_date)
+        is_refund = case((Order.status == 'refunded', 1), else_=0)
+        with self.engine.connect() as connection:
+            order_counts = connection.execute(select(day, is_refund, func.count(Order.id)).group_by(day, is_refund)).all()
+        if order_counts:
+            days, refund_flags, counts = zip(*order_counts)
+            self.window_aggregates.add_orders(np.array(days, dtype='datetime64[D]').astype('datetime64[us]'),
+                                              np.array(refund_flags, dtype=np.int64).astype(bool),
+                                              np.array(counts, dtype=np.int64))
+        self.logger.info(f"Đã đọc {n_rows} dòng item_daily_sales, {n_refund_lines} order items bị refund")
+        
+    def _load_incremental_state(self):
+        """Nạp tổng hợp theo ngày đã lưu, đọc lại các ngày thay đổi từ sau watermark rồi đưa vào các cửa sổ"""
+        # Lấy watermark trước khi đọc để dữ liệu ghi trong lúc đọc được xử lý lại ở lần chạy sau
+        watermark = self._current_watermark()
+        state = DailyAggregateState.load(self.state_path) if os.path.exists(self.state_path) else None
+        
+        if state is None or not state.watermark:
+            state = DailyAggregateState()
+            n_lines, n_orders = self._stream_order_lines(state), self._stream_orders(state)
+            state.finalize()
+            self.logger.info(f"Tạo mới aggregate state: {n_orders} orders, {n_lines} order items")
+        else:
+            days = self._changed_days(state.watermark)
+            delta = DailyAggregateState()
+            n_lines = n_orders = 0
+            if len(days):
+                in_days = or_(*[and_(Order.order_date >= start, Order.order_date < end) for start, end in day_ranges(days)])
+                n_lines, n_orders = self._stream_order_lines(delta, in_days), self._stream_orders(delta, in_days)
+                delta.finalize()
+            state.replace_days(delta, days)
+            self.logger.info(f"Cập nhật aggregate state: {len(days)} ngày thay đổi, "
+                             f"{n_orders} orders, {n_lines} order items")
+        
+        state.watermark = watermark
+        state.apply_to(self.window_aggregates, self.sales_fact)
+        self.aggregate_state = state
+        
+    def _current_watermark(self) -> Dict:
+        """id và updated_at lớn nhất hiện tại của orders và order_items"""
+        with self.engine.connect() as connection:
+            order_id, order_updated_at = connection.execute(select(func.max(Order.id), func.max(Order.updated_at))).one()
+            item_id, item_updated_at = connection.execute(select(func.max(OrderItem.id), func.max(OrderItem.updated_at))).one()
+        return {'order_id': order_id or 0, 'order_updated_at': order_updated_at,
+                'order_item_id': item_id or 0, 'order_item_updated_at': item_updated_at}
+        
+    def _changed_days(self, watermark: Dict) -> np.ndarray:
+        """Các ngày (số ngày kể từ epoch) có order hoặc order item mới/được sửa sau watermark"""
+        order_changed = [Order.id > watermark['order_id']]
+        if watermark.get('order_updated_at'):
+            order_changed.append(Order.updated_at >= watermark['order_updated_at'])
+        item_changed = [OrderItem.id > watermark['order_item_id']]
+        if watermark.get('order_item_updated_at'):
+            item_changed.append(OrderItem.updated_at >= watermark['order_item_updated_at'])
+        
+        with self.engine.connect() as connection:
+            dates = connection.execute(select(Order.order_date).where(or_(*order_changed))).scalars().all()
+            dates += connection.execute(select(Order.order_date)
+                                        .join(OrderItem, OrderItem.order_id == Order.id)
+                                        .where(or_(*item_changed))).scalars().all()
+        return np.unique(np.array(dates, dtype='datetime64[us]').astype('datetime64[D]').astype(np.int64))
+        
+    def _save_incremental_state(self):
+        """Lưu aggregate state và watermark (một lần) để lần chạy sau chỉ đọc phần thay đổi"""
+        if self.aggregate_state is None:
+            return
+        self.aggregate_state.save(self.state_path)
+        self.aggregate_state = None
+        self.logger.info(f"Đã lưu aggregate state vào {self.state_path}")
+        
+    def _load_dimensions_from_db(self):
+        """Chỉ load items, categories, brands (SQL backend tổng hợp orders ngay trong database)"""
+        self.logger.info("Loading dimensions from database (SQL backend)...")
+        with self.engine.connect() as connection:
+            self.items = load_records(connection, Item, ItemRecord)
+            self.categories = load_records(connection, Category, CategoryRecord)
+            self.brands = load_records(connection, Brand, BrandRecord)
+        self.logger.info(f"Loaded {len(self.items)} items, {len(self.categories)} categories, "
+                         f"{len(self.brands)} brands")
+        
+        self.batches = []
+        self._build_indexes()
+        self._refund_groups = None
+        self._slow_moving_cache = None
+        
+    def _get_analysis_windows(self, today: datetime = None) -> Dict[str, Tuple[datetime, datetime]]:
+        """Các cửa sổ thời gian cần tổng hợp: các data_range, hôm nay, các lookback tốc độ bán và toàn bộ lịch sử"""
+        today = today or self.today
+        windows = dict(self._get_time_periods(today))
+        windows['today'] = (datetime.combine(today, datetime.min.time()),
+                            datetime.combine(today, datetime.max.time()))
+        # Tốc độ bán và hàng bán ế không giới hạn cận trên
+        for days in self.velocity_lookbacks:
+            windows[self._velocity_window(days)] = (today - timedelta(days=days), None)
+        windows['lifetime'] = (datetime.min, None)
+        return windows
+        
+    @staticmethod
+    def _velocity_window(days: int) -> str:
+        return f'velocity_{days}d'
+        
+    def _build_indexes(self):
+        """Tạo các dict index để tra cứu item, brand, category, order, batch trong O(1)"""
+        self.items_by_id = {item.id: item for item in self.items}
+        self.items_by_sku = {item.sku: item for item in self.items}
+        self.brands_by_id = {brand.id: brand for brand in self.brands}
+        self.categories_by_id = {category.id: category for category in self.categories}
+        
+        # Gom batches theo sku
+        self.batches_by_sku = defaultdict(list)
+        for batch in self.batches:
+            self.batches_by_sku[batch.sku].append(batch)
         
     def get_session(self):
         """Tạo session mới"""
         return self.Session()
         
-    def _filter_data_by_date_range(self, start_date: datetime, end_date: datetime = None):
-        """Filter dữ liệu theo khoảng thời gian"""
-        if end_date is None:
-            end_date = self.today
-            
-        # Filter orders theo ngày
-        filtered_orders = [order for order in self.orders 
-                         if start_date <= order.order_date <= end_date]
-        
-        # Lấy order_ids từ filtered orders
-        filtered_order_ids = {order.id for order in filtered_orders}
-        
-        # Filter order_items
-        filtered_order_items = [item for item in self.order_items 
-                              if item.order_id in filtered_order_ids]
-        
-        return filtered_orders, filtered_order_items
-    
-    def _get_time_periods(self):
+    def _get_time_periods(self, today: datetime = None):
         """Lấy các khoảng thời gian phân tích"""
-        now = self.today
+        now = today or self.today
         return {
             '1_day_ago': (now - timedelta(days=1), now),
             '7_days_ago': (now - timedelta(days=7), now),
@@ -123,43 +516,20 @@ class AnalyticsDataEngine:
             'all_time': (datetime.min, now)
         }
         
+    def set_analysis_date(self, analysis_date: date):
+        """Chuyển sang một ngày phân tích khác trong analysis_dates (dùng lại dữ liệu đã load)"""
+        if analysis_date not in self.analysis_dates:
+            raise ValueError(f"Ngày phân tích không có trong analysis_dates: {analysis_date}")
+        self.today += timedelta(days=(analysis_date - self.analysis_date).days)
+        self.analysis_date = analysis_date
+        # Chỉ số hàng bán ế phụ thuộc ngày phân tích (số ngày tồn kho)
+        self._slow_moving_cache = None
+        if not self.sql_backend:
+            self.window_aggregates.use_date(analysis_date)
+        
     def group_refund_reasons(self, reason: str) -> str:
         """Gộp các lý do refund gần giống nhau"""
-        if not reason:
-            return 'Không xác định'
-        
-        reason = str(reason).lower().strip()
-        
-        # Nhóm "khách đổi ý"
-        if any(keyword in reason for keyword in ['khách đổi ý', 'khách không cần', 'khách hủy', 'khách thay đổi']):
-            return 'Khách đổi ý'
-        
-        # Nhóm "không đúng mô tả"
-        if any(keyword in reason for keyword in ['không đúng mô tả', 'sai mô tả', 'không giống mô tả', 'khác mô tả']):
-            return 'Không đúng mô tả'
-        
-        # Nhóm "hư hỏng"
-        if any(keyword in reason for keyword in ['hư hỏng', 'bị hỏng', 'lỗi', 'defect', 'damaged']):
-            return 'Hư hỏng'
-        
-        # Nhóm "giao hàng"
-        if any(keyword in reason for keyword in ['giao hàng', 'vận chuyển', 'shipping', 'delivery']):
-            return 'Vấn đề giao hàng'
-        
-        # Nhóm "chất lượng"
-        if any(keyword in reason for keyword in ['chất lượng', 'quality', 'kém chất lượng']):
-            return 'Chất lượng kém'
-        
-        # Nhóm "kích thước"
-        if any(keyword in reason for keyword in ['kích thước', 'size', 'to nhỏ']):
-            return 'Kích thước không phù hợp'
-        
-        # Nhóm "màu sắc"
-        if any(keyword in reason for keyword in ['màu sắc', 'color', 'màu']):
-            return 'Màu sắc không đúng'
-        
-        # Trả về lý do gốc nếu không match với nhóm nào
-        return reason.title()
+        return self.refund_classifier.classify(reason)
 
     def _calculate_date_range(self, data_range: str) -> Tuple[datetime, datetime]:
         """Tính toán start_date và end_date dựa trên data_range"""
@@ -188,46 +558,24 @@ class AnalyticsDataEngine:
         """Phân tích doanh số hàng ngày - chỉ lấy ngày hôm nay"""
         self.logger.info("Phân tích doanh số hàng ngày...")
         
-        # Chỉ lấy dữ liệu của ngày hôm nay
-        today = self.today
-        today_start = datetime.combine(today, datetime.min.time())
-        today_end = datetime.combine(today, datetime.max.time())
-        
-        # Filter orders theo ngày hôm nay
-        filtered_orders = [order for order in self.orders 
-                         if today_start <= order.order_date <= today_end]
-        
-        # Lấy dữ liệu đơn hàng hợp lệ (không refund)
-        valid_orders = [order for order in filtered_orders if order.status != 'refunded']
-        
-        total_orders = len(valid_orders)
-        total_revenue = 0
-        
-        # Tính lợi nhuận
-        total_profit = 0
-        for order in valid_orders:
-            for item in order.order_items:
-                # Lấy thông tin item
-                item_info = next((i for i in self.items if i.id == item.item_id), None)
-                if item_info:
-                    revenue = float(item.price_per_unit) * item.quantity
-                    total_revenue += revenue
-                    profit_per_unit = float(item.price_per_unit) - float(item_info.cost_price)
-                    total_profit += profit_per_unit * item.quantity
-        
-        # Tính tỉ lệ lợi nhuận
-        profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
-        
-        # Phân tích refund
-        refund_orders = [order for order in filtered_orders if order.status == 'refunded']
-        total_refunds = len(refund_orders)
-        refund_rate = (total_refunds / (total_orders + total_refunds) * 100) if (total_orders + total_refunds) > 0 else 0
+        if self.sql_backend:
+            total_orders, total_refunds, total_revenue, total_profit = self.sql_backend.daily_sales(
+                datetime.combine(self.today, datetime.min.time()),
+                datetime.combine(self.today, datetime.max.time()))
+        else:
+            # Chỉ lấy dữ liệu của ngày hôm nay (cửa sổ 'today')
+            total_orders, total_refunds = self.window_aggregates.order_counts('today')
+            
+            # Tính doanh thu và lợi nhuận từ order lines hợp lệ (không refund)
+            item_sales = self.window_aggregates.item_totals('today')
+            total_revenue = int(item_sales['revenue'].sum())
+            total_profit = int(item_sales['profit'].sum())
         
         return {
             'analysis_date': self.analysis_date,
             'total_orders': total_orders,
-            'total_revenue': float(total_revenue),
-            'total_profit': float(total_profit),
+            'total_revenue': to_decimal(total_revenue),
+            'total_profit': to_decimal(total_profit),
             'total_refunds': total_refunds
         }
 
@@ -235,131 +583,89 @@ class AnalyticsDataEngine:
         """Phân tích top selling items theo khoảng thời gian và loại sắp xếp"""
         self.logger.info(f"Phân tích top {limit} selling items cho {data_range} theo {sort_type}...")
         
-        # Tính toán start_date và end_date dựa trên data_range
+        sort_columns = {'revenue': 'revenue', 'profit': 'profit', 'quantity': 'quantity'}
+        if sort_type not in sort_columns:
+            raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: revenue, profit, quantity")
+        
+        # Kiểm tra data_range hợp lệ
         start_date, end_date = self._calculate_date_range(data_range)
         
-        # Filter dữ liệu theo khoảng thời gian
-        filtered_orders, filtered_order_items = self._filter_data_by_date_range(start_date, end_date)
-        
-        # Lấy dữ liệu bán hàng hợp lệ
-        valid_order_items = [item for item in filtered_order_items 
-                           if next((order for order in filtered_orders if order.id == item.order_id), None).status != 'refunded']
-        
-        # Nhóm theo item_id
-        item_sales = {}
-        for order_item in valid_order_items:
-            item_id = order_item.item_id
-            if item_id not in item_sales:
-                item_sales[item_id] = {
-                    'total_sold': 0,
-                    'total_revenue': 0,
-                    'total_profit': 0
-                }
+        if self.sql_backend:
+            ranked = self.sql_backend.top_items(start_date, end_date, sort_columns[sort_type], limit)
+        else:
+            # Tổng hợp bán hàng hợp lệ theo item (đã tính sẵn cho mọi data_range)
+            fact = self.sales_fact
+            item_sales = self.window_aggregates.item_totals(data_range)
             
-            item_sales[item_id]['total_sold'] += order_item.quantity
-            revenue = float(order_item.price_per_unit) * order_item.quantity
-            item_sales[item_id]['total_revenue'] += revenue
+            # Chỉ xếp hạng các item có phát sinh bán trong khoảng thời gian (bảng xếp hạng dùng chung mọi sort_type)
+            ranking = self.window_aggregates.item_ranking(data_range)
+            ranked = [(fact.item_ids[idx], item_sales['quantity'][idx], item_sales['revenue'][idx], item_sales['profit'][idx])
+                      for idx in ranking.top(sort_columns[sort_type], limit)]
+        
+        results = []
+        for rank, (item_id, total_sold, total_revenue, total_profit) in enumerate(ranked, 1):
+            item_info = self.items_by_id[int(item_id)]
             
-            # Tính lợi nhuận
-            item_info = next((i for i in self.items if i.id == item_id), None)
-            if item_info:
-                profit_per_unit = float(order_item.price_per_unit) - float(item_info.cost_price)
-                item_sales[item_id]['total_profit'] += profit_per_unit * order_item.quantity
-        
-        # Sắp xếp theo loại được chọn
-        if sort_type == 'revenue':
-            sorted_items = sorted(item_sales.items(), key=lambda x: x[1]['total_revenue'], reverse=True)[:limit]
-        elif sort_type == 'profit':
-            sorted_items = sorted(item_sales.items(), key=lambda x: x[1]['total_profit'], reverse=True)[:limit]
-        elif sort_type == 'quantity':
-            sorted_items = sorted(item_sales.items(), key=lambda x: x[1]['total_sold'], reverse=True)[:limit]
+            results.append({
+                'analysis_date': self.analysis_date,
+                'data_range': data_range,
+                'sort_type': sort_type,
+                'sku': item_info.sku,
+                'item_name': item_info.name,
+                'total_sold': int(total_sold),
+                'total_revenue': to_decimal(total_revenue),
+                'total_profit': to_decimal(total_profit),
+                'profit_margin': margin_percent(total_profit, total_revenue),
+                'rank': rank
+            })
+        
+        return results
+
+    def _analyze_group_performance(self, group: str, data_range: str, sort_type: str, limit: int) -> List[Tuple[int, Dict]]:
+        """Xếp hạng bán hàng hợp lệ theo nhóm (category/brand) từ tổng đã tính sẵn"""
+        start_date, end_date = self._calculate_date_range(data_range)
+        sort_column = 'revenue' if sort_type == 'revenue' else 'quantity'
+        
+        if self.sql_backend:
+            ranked = self.sql_backend.top_groups(group, start_date, end_date, sort_column, limit)
         else:
-            raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: revenue, profit, quantity")
+            group_ids = self.sales_fact.category_ids if group == 'category' else self.sales_fact.brand_ids
+            group_sales = self.window_aggregates.group_totals(data_range, group)
+            ranking = self.window_aggregates.group_ranking(data_range, group)
+            ranked = [(group_ids[idx], group_sales['quantity'][idx], group_sales['revenue'][idx], group_sales['profit'][idx])
+                      for idx in ranking.top(sort_column, limit)]
         
         results = []
-        for rank, (item_id, data) in enumerate(sorted_items, 1):
-            item_info = next((i for i in self.items if i.id == item_id), None)
-            if item_info:
-                profit_margin = (data['total_profit'] / data['total_revenue'] * 100) if data['total_revenue'] > 0 else 0
-                
-                results.append({
-                    'analysis_date': self.analysis_date,
-                    'data_range': data_range,
-                    'sort_type': sort_type,
-                    'sku': item_info.sku,
-                    'item_name': item_info.name,
-                    'total_sold': data['total_sold'],
-                    'total_revenue': data['total_revenue'],
-                    'total_profit': data['total_profit'],
-                    'profit_margin': profit_margin,
-                    'rank': rank
-                })
-        
+        for group_id, total_sold, total_revenue, total_profit in ranked:
+            results.append((int(group_id), {
+                'total_sold': int(total_sold),
+                'total_revenue': to_decimal(total_revenue),
+                'total_profit': to_decimal(total_profit),
+                'profit_margin': margin_percent(total_profit, total_revenue)
+            }))
         return results
 
     def analyze_top_category(self,limit: int = 10, data_range: str = 'all_time', sort_type: str = 'revenue') -> List[Dict]:
         """Phân tích hiệu suất theo category"""
         self.logger.info(f"Phân tích hiệu suất category cho {data_range} theo {sort_type} (top {limit})...")
         
-        # Tính toán start_date và end_date dựa trên data_range
-        start_date, end_date = self._calculate_date_range(data_range)
-        
-        # Filter dữ liệu theo khoảng thời gian
-        filtered_orders, filtered_order_items = self._filter_data_by_date_range(start_date, end_date)
-        
-        # Lấy dữ liệu bán hàng hợp lệ với thông tin category
-        valid_sales = []
-        for order_item in filtered_order_items:
-            order = next((o for o in filtered_orders if o.id == order_item.order_id), None)
-            if order and order.status != 'refunded':
-                item = next((i for i in self.items if i.id == order_item.item_id), None)
-                if item:
-                    category = next((c for c in self.categories if c.id == item.category_id), None)
-                    if category:
-                        valid_sales.append((order_item, item, category))
-        
-        # Nhóm theo category
-        category_sales = {}
-        for order_item, item, category in valid_sales:
-            category_id = category.id
-            if category_id not in category_sales:
-                category_sales[category_id] = {
-                    'category_name': category.name,
-                    'total_sold': 0,
-                    'total_revenue': 0,
-                    'total_profit': 0
-                }
-            
-            category_sales[category_id]['total_sold'] += order_item.quantity
-            revenue = float(order_item.price_per_unit) * order_item.quantity
-            category_sales[category_id]['total_revenue'] += revenue
-            
-            # Tính lợi nhuận
-            profit_per_unit = float(order_item.price_per_unit) - float(item.cost_price)
-            category_sales[category_id]['total_profit'] += profit_per_unit * order_item.quantity
-        
-        # Sắp xếp theo loại được chọn và lấy top categories
-        if sort_type == 'revenue':
-            sorted_categories = sorted(category_sales.items(), key=lambda x: x[1]['total_revenue'], reverse=True)[:limit]
-        elif sort_type == 'quantity':
-            sorted_categories = sorted(category_sales.items(), key=lambda x: x[1]['total_sold'], reverse=True)[:limit]
-        else:
+        if sort_type not in ('revenue', 'quantity'):
             raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: revenue, quantity")
         
+        ranked = self._analyze_group_performance('category', data_range, sort_type, limit)
+        
         results = []
-        for rank, (category_id, data) in enumerate(sorted_categories, 1):
-            profit_margin = (data['total_profit'] / data['total_revenue'] * 100) if data['total_revenue'] > 0 else 0
-            
+        for rank, (category_id, data) in enumerate(ranked, 1):
             results.append({
                 'analysis_date': self.analysis_date,
                 'data_range': data_range,
                 'sort_type': sort_type,
                 'category_id': category_id,
-                'category_name': data['category_name'],
+                'category_name': self.categories_by_id[category_id].name,
                 'total_sold': data['total_sold'],
                 'total_revenue': data['total_revenue'],
                 'total_profit': data['total_profit'],
-                'profit_margin': profit_margin,
+                'profit_margin': data['profit_margin'],
                 'rank': rank
             })
         
@@ -369,344 +675,325 @@ class AnalyticsDataEngine:
         """Phân tích hiệu suất theo brand"""
         self.logger.info(f"Phân tích hiệu suất brand cho {data_range} theo {sort_type} (top {limit})...")
         
-        # Tính toán start_date và end_date dựa trên data_range
-        start_date, end_date = self._calculate_date_range(data_range)
-        
-        # Filter dữ liệu theo khoảng thời gian
-        filtered_orders, filtered_order_items = self._filter_data_by_date_range(start_date, end_date)
-        
-        # Lấy dữ liệu bán hàng hợp lệ với thông tin brand
-        valid_sales = []
-        for order_item in filtered_order_items:
-            order = next((o for o in filtered_orders if o.id == order_item.order_id), None)
-            if order and order.status != 'refunded':
-                item = next((i for i in self.items if i.id == order_item.item_id), None)
-                if item:
-                    brand = next((b for b in self.brands if b.id == item.brand_id), None)
-                    if brand:
-                        valid_sales.append((order_item, item, brand))
-        
-        # Nhóm theo brand
-        brand_sales = {}
-        for order_item, item, brand in valid_sales:
-            brand_id = brand.id
-            if brand_id not in brand_sales:
-                brand_sales[brand_id] = {
-                    'brand_name': brand.name,
-                    'total_sold': 0,
-                    'total_revenue': 0,
-                    'total_profit': 0
-                }
-            
-            brand_sales[brand_id]['total_sold'] += order_item.quantity
-            revenue = float(order_item.price_per_unit) * order_item.quantity
-            brand_sales[brand_id]['total_revenue'] += revenue
-            
-            # Tính lợi nhuận
-            profit_per_unit = float(order_item.price_per_unit) - float(item.cost_price)
-            brand_sales[brand_id]['total_profit'] += profit_per_unit * order_item.quantity
-        
-        # Sắp xếp theo loại được chọn và lấy top brands
-        if sort_type == 'revenue':
-            sorted_brands = sorted(brand_sales.items(), key=lambda x: x[1]['total_revenue'], reverse=True)[:limit]
-        elif sort_type == 'quantity':
-            sorted_brands = sorted(brand_sales.items(), key=lambda x: x[1]['total_sold'], reverse=True)[:limit]
-        else:
+        if sort_type not in ('revenue', 'quantity'):
             raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: revenue, quantity")
         
+        ranked = self._analyze_group_performance('brand', data_range, sort_type, limit)
+        
         results = []
-        for rank, (brand_id, data) in enumerate(sorted_brands, 1):
-            profit_margin = (data['total_profit'] / data['total_revenue'] * 100) if data['total_revenue'] > 0 else 0
-            
+        for rank, (brand_id, data) in enumerate(ranked, 1):
             results.append({
                 'analysis_date': self.analysis_date,
                 'data_range': data_range,
                 'sort_type': sort_type,
                 'brand_id': brand_id,
-                'brand_name': data['brand_name'],
+                'brand_name': self.brands_by_id[brand_id].name,
                 'total_sold': data['total_sold'],
                 'total_revenue': data['total_revenue'],
                 'total_profit': data['total_profit'],
-                'profit_margin': profit_margin,
+                'profit_margin': data['profit_margin'],
                 'rank': rank
             })
         
         return results
 
+    def _refund_reason_groups(self) -> Tuple[List[str], np.ndarray]:
+        """Nhóm lý do refund cho từng lý do gốc (trong fact table hoặc database, tính một lần mỗi lần chạy)"""
+        if self._refund_groups is None:
+            reasons = self.sql_backend.refund_reasons() if self.sql_backend else self.sales_fact.refund_reasons
+            grouped = self.refund_classifier.classify_many(reasons)
+            labels = sorted(set(grouped))
+            label_pos = {label: pos for pos, label in enumerate(labels)}
+            self._refund_groups = (labels, np.array([label_pos[label] for label in grouped], dtype=np.int64))
+        return self._refund_groups
+
     def analyze_refunds(self, limit: int = 10, data_range: str = 'all_time', sort_type: str = 'refund_count') -> List[Dict]:
         """Phân tích refund theo các tiêu chí khác nhau"""
         self.logger.info(f"Phân tích refund cho {data_range} theo {sort_type} (top {limit})...")
         
-        # Tính toán start_date và end_date dựa trên data_range
+        if sort_type not in ('refund_count', 'refund_rate', 'refund_quantity', 'refund_reason'):
+            raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: refund_count, refund_rate, refund_quantity, refund_reason")
+        
+        # Kiểm tra data_range hợp lệ
         start_date, end_date = self._calculate_date_range(data_range)
         
-        # Filter dữ liệu theo khoảng thời gian
-        filtered_orders, filtered_order_items = self._filter_data_by_date_range(start_date, end_date)
+        if self.sql_backend:
+            return self._analyze_refunds_sql(limit, data_range, sort_type, start_date, end_date)
         
-        # Lấy tất cả đơn hàng refund
-        refund_orders = [order for order in filtered_orders if order.status == 'refunded']
+        # Tổng refund theo (item, nhóm lý do) đã tính sẵn cho data_range
+        labels, _ = self._refund_reason_groups()
+        refunds = self.window_aggregates.refund_totals(data_range)
         
-        # Nhóm theo item_id và lý do
-        refund_analysis = {}
-        for order in refund_orders:
-            for order_item in order.order_items:
-                item_id = order_item.item_id
-                refund_reason = self.group_refund_reasons(order.refund_reason)
-                
-                key = (item_id, refund_reason)
-                if key not in refund_analysis:
-                    refund_analysis[key] = {
-                        'total_orders': 0,
-                        'refund_count': 0,
-                        'refund_quantity': 0
-                    }
-                
-                refund_analysis[key]['refund_count'] += 1
-                refund_analysis[key]['refund_quantity'] += order_item.quantity
-        
-        # Tính tổng đơn hàng cho mỗi item_id trong khoảng thời gian
-        total_orders_by_item = {}
-        for order_item in filtered_order_items:
-            order = next((o for o in filtered_orders if o.id == order_item.order_id), None)
-            if order and order.status != 'refunded':
-                item_id = order_item.item_id
-                if item_id not in total_orders_by_item:
-                    total_orders_by_item[item_id] = 0
-                total_orders_by_item[item_id] += order_item.quantity
-        
-        # Tạo kết quả phân tích
-        results = []
-        for (item_id, refund_reason), data in refund_analysis.items():
-            item_info = next((i for i in self.items if i.id == item_id), None)
-            if item_info:
-                total_orders = total_orders_by_item.get(item_id, 0)
-                refund_rate = (data['refund_count'] / total_orders * 100) if total_orders > 0 else 0
-                
+        # Tổng số lượng bán hợp lệ của mỗi item trong khoảng thời gian
+        total_orders_by_item = self.window_aggregates.item_totals(data_range)['quantity'][refunds['item_idx']]
+        
+        return self._rank_refunds(limit, data_range, sort_type, labels, self.items_by_id,
+                                  self.sales_fact.item_ids[refunds['item_idx']], refunds['reason_group'],
+                                  refunds['refund_count'], refunds['refund_quantity'], total_orders_by_item)
+
+    def _analyze_refunds_sql(self, limit: int, data_range: str, sort_type: str,
+                             start_date: datetime, end_date: datetime) -> List[Dict]:
+        """Phân tích refund với tổng theo (item, lý do gốc) được GROUP BY trong database"""
+        labels, _ = self._refund_reason_groups()
+        label_pos = {label: pos for pos, label in enumerate(labels)}
+        
+        # Gộp các lý do gốc cùng nhóm của một item
+        totals = defaultdict(lambda: [0, 0])
+        for item_id, reason, refund_count, refund_quantity in self.sql_backend.refund_totals(start_date, end_date):
+            key = (item_id, label_pos[self.group_refund_reasons(reason)])
+            totals[key][0] += int(refund_count)
+            totals[key][1] += int(refund_quantity)
+        
+        item_quantities = self.sql_backend.item_quantities(start_date, end_date)
+        keys = list(totals.keys())
+        item_ids = np.array([item_id for item_id, _ in keys], dtype=np.int64)
+        return self._rank_refunds(limit, data_range, sort_type, labels, self.items_by_id, item_ids,
+                                  np.array([group for _, group in keys], dtype=np.int64),
+                                  np.array([totals[key][0] for key in keys], dtype=np.int64),
+                                  np.array([totals[key][1] for key in keys], dtype=np.int64),
+                                  np.array([item_quantities.get(item_id, 0) for item_id in item_ids.tolist()], dtype=np.int64))
+
+    def _rank_refunds(self, limit: int, data_range: str, sort_type: str, labels: List[str], items_by_id: Dict,
+                      item_ids: np.ndarray, reason_group: np.ndarray, refund_count: np.ndarray,
+                      refund_quantity: np.ndarray, total_orders_by_item: np.ndarray) -> List[Dict]:
+        """Xếp hạng kết quả refund từ các mảng tổng hợp theo (item, nhóm lý do)"""
+        refund_rate = np.divide(refund_count, total_orders_by_item,
+                                out=np.zeros(len(item_ids)), where=total_orders_by_item > 0) * 100
+        
+        if sort_type == 'refund_reason':
+            # Lý do bị refund nhiều nhất: gộp các (item, lý do) theo lý do
+            n_groups = max(len(labels), 1)
+            reason_count = np.bincount(reason_group, weights=refund_count, minlength=n_groups).astype(np.int64)
+            reason_quantity = np.bincount(reason_group, weights=refund_quantity, minlength=n_groups).astype(np.int64)
+            reason_orders = np.bincount(reason_group, weights=total_orders_by_item, minlength=n_groups).astype(np.int64)
+            items_affected = np.bincount(reason_group, minlength=n_groups)
+            
+            ranking = RankingTable({'refund_count': reason_count}, np.arange(n_groups), np.flatnonzero(items_affected))
+            ranked = ranking.top('refund_count', limit)
+            
+            results = []
+            for rank, group in enumerate(ranked, 1):
+                total_orders = int(reason_orders[group])
                 results.append({
                     'analysis_date': self.analysis_date,
                     'data_range': data_range,
                     'sort_type': sort_type,
-                    'sku': item_info.sku,
-                    'item_name': item_info.name,
+                    'refund_reason': labels[group],
+                    'refund_count': int(reason_count[group]),
+                    'refund_quantity': int(reason_quantity[group]),
                     'total_orders': total_orders,
-                    'refund_count': data['refund_count'],
-                    'refund_quantity': data['refund_quantity'],
-                    'refund_rate': refund_rate,
-                    'refund_reason': refund_reason
+                    'refund_rate': (int(reason_count[group]) / total_orders * 100) if total_orders > 0 else 0,
+                    'items_affected': int(items_affected[group]),
+                    'rank': rank
                 })
+            return results
+        
+        # Sắp xếp theo loại được chọn, hòa thì theo (item_id, lý do)
+        tie_breaker = np.empty(len(item_ids), dtype=np.int64)
+        tie_breaker[np.lexsort((reason_group, item_ids))] = np.arange(len(item_ids))
+        ranking = RankingTable({
+            'refund_count': refund_count,        # Hàng có số lượng bị refund nhiều nhất
+            'refund_rate': refund_rate,          # Hàng có tỉ lệ refund cao nhất
+            'refund_quantity': refund_quantity   # Hàng có số lượng sản phẩm bị refund nhiều nhất
+        }, tie_breaker)
+        ranked = ranking.top(sort_type, limit)
         
-        # Sắp xếp theo loại được chọn và lấy top results
-        if sort_type == 'refund_count':
-            # Hàng có số lượng bị refund nhiều nhất
-            sorted_results = sorted(results, key=lambda x: x['refund_count'], reverse=True)[:limit]
-        elif sort_type == 'refund_rate':
-            # Hàng có tỉ lệ refund cao nhất
-            sorted_results = sorted(results, key=lambda x: x['refund_rate'], reverse=True)[:limit]
-        elif sort_type == 'refund_quantity':
-            # Hàng có số lượng sản phẩm bị refund nhiều nhất
-            sorted_results = sorted(results, key=lambda x: x['refund_quantity'], reverse=True)[:limit]
-        elif sort_type == 'refund_reason':
-            # Lý do bị refund nhiều nhất
-            # Nhóm theo lý do refund
-            reason_analysis = {}
-            for result in results:
-                reason = result['refund_reason']
-                if reason not in reason_analysis:
-                    reason_analysis[reason] = {
-                        'refund_count': 0,
-                        'refund_quantity': 0,
-                        'total_orders': 0,
-                        'items_affected': 0
-                    }
-                reason_analysis[reason]['refund_count'] += result['refund_count']
-                reason_analysis[reason]['refund_quantity'] += result['refund_quantity']
-                reason_analysis[reason]['total_orders'] += result['total_orders']
-                reason_analysis[reason]['items_affected'] += 1
-            
-            # Tạo kết quả theo lý do
-            reason_results = []
-            for reason, data in reason_analysis.items():
-                refund_rate = (data['refund_count'] / data['total_orders'] * 100) if data['total_orders'] > 0 else 0
-                reason_results.append({
-                    'analysis_date': self.analysis_date,
-                    'data_range': data_range,
-                    'sort_type': sort_type,
-                    'refund_reason': reason,
-                    'refund_count': data['refund_count'],
-                    'refund_quantity': data['refund_quantity'],
-                    'total_orders': data['total_orders'],
-                    'refund_rate': refund_rate,
-                    'items_affected': data['items_affected']
-                })
-            
-            sorted_results = sorted(reason_results, key=lambda x: x['refund_count'], reverse=True)[:limit]
-        else:
-            raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: refund_count, refund_rate, refund_quantity, refund_reason")
-        
-        # Thêm rank cho kết quả
-        for rank, result in enumerate(sorted_results, 1):
-            result['rank'] = rank
+        results = []
+        for rank, pos in enumerate(ranked, 1):
+            item_info = items_by_id[int(item_ids[pos])]
+            results.append({
+                'analysis_date': self.analysis_date,
+                'data_range': data_range,
+                'sort_type': sort_type,
+                'sku': item_info.sku,
+                'item_name': item_info.name,
+                'total_orders': int(total_orders_by_item[pos]),
+                'refund_count': int(refund_count[pos]),
+                'refund_quantity': int(refund_quantity[pos]),
+                'refund_rate': float(refund_rate[pos]),
+                'refund_reason': labels[reason_group[pos]],
+                'rank': rank
+            })
         
-        return sorted_results
+        return results
+
+    def sales_velocity(self, days: int) -> Dict[int, float]:
+        """Số lượng bán hợp lệ trung bình mỗi ngày theo item_id trong `days` ngày gần nhất"""
+        if self.sql_backend:
+            recent_sales = self.sql_backend.item_quantities(self.today - timedelta(days=days), None)
+            return {item_id: quantity / days for item_id, quantity in recent_sales.items()}
+        
+        if days not in self.velocity_lookbacks:
+            raise ValueError(f"Lookback không được tính sẵn: {days}. Chỉ hỗ trợ: {self.velocity_lookbacks}")
+        velocity = self.window_aggregates.sales_velocity(self._velocity_window(days), days)
+        return dict(zip(self.sales_fact.item_ids.tolist(), velocity.tolist()))
 
     def analyze_low_stock_alerts(self) -> List[Dict]:
         """Phân tích cảnh báo tồn kho thấp"""
-        self.logger.info("Phân tích cảnh báo tồn kho thấp...")
+        self.logger.info(f"Phân tích cảnh báo tồn kho thấp (lookback {self.low_stock_lookback} ngày)...")
         
         # Lấy tất cả items có tồn kho
         items_with_stock = [item for item in self.items if item.stock_quantity > 0]
         
+        # Tốc độ bán trung bình mỗi ngày theo item trong khoảng lookback
+        velocity_by_item = self.sales_velocity(self.low_stock_lookback)
+        
         results = []
         for item in items_with_stock:
-            # Tính tốc độ bán trung bình trong 30 ngày gần nhất
-            thirty_days_ago = self.today - timedelta(days=30)
-            
-            # Filter orders trong 30 ngày gần nhất
-            recent_orders = [order for order in self.orders 
-                           if order.order_date >= thirty_days_ago and order.status != 'refunded']
-            
-            # Tính tổng số lượng bán
-            recent_sales = 0
-            for order in recent_orders:
-                for order_item in order.order_items:
-                    if order_item.item_id == item.id:
-                        recent_sales += order_item.quantity
-            
-            # Tính số ngày tồn kho còn lại
-            avg_daily_sales = recent_sales / 30 if recent_sales > 0 else 0
-            days_of_stock_left = int(item.stock_quantity / avg_daily_sales) if avg_daily_sales > 0 else 999
-            
-            # Xác định mức độ cảnh báo
-            if days_of_stock_left <= 3:
-                alert_level = 'URGENT'
-            elif days_of_stock_left <= 7:
-                alert_level = 'CRITICAL'
-            elif days_of_stock_left <= 14:
-                alert_level = 'WARNING'
-            else:
-                continue  # Không cảnh báo nếu còn nhiều hàng
-            
-            results.append({
-                'analysis_date': self.analysis_date,
-                'sku': item.sku,
-                'item_name': item.name,
-                'current_stock': item.stock_quantity,
-                'days_of_stock_left': days_of_stock_left,
-                'alert_level': alert_level,
-                'avg_daily_sales': avg_daily_sales
-            })
+            alert = self._low_stock_alert(item, velocity_by_item.get(item.id, 0))
+            if alert:
+                results.append(alert)
         
         return results
 
+    def _low_stock_alert(self, item, avg_daily_sales: float) -> Dict:
+        """Tạo cảnh báo tồn kho cho item từ tốc độ bán trung bình mỗi ngày (None nếu còn nhiều hàng)"""
+        # Tính số ngày tồn kho còn lại
+        days_of_stock_left = int(item.stock_quantity / avg_daily_sales) if avg_daily_sales > 0 else 999
+        
+        # Xác định mức độ cảnh báo
+        if days_of_stock_left <= 3:
+            alert_level = 'URGENT'
+        elif days_of_stock_left <= 7:
+            alert_level = 'CRITICAL'
+        elif days_of_stock_left <= 14:
+            alert_level = 'WARNING'
+        else:
+            return None  # Không cảnh báo nếu còn nhiều hàng
+        
+        return {
+            'analysis_date': self.analysis_date,
+            'sku': item.sku,
+            'item_name': item.name,
+            'current_stock': item.stock_quantity,
+            'days_of_stock_left': days_of_stock_left,
+            'alert_level': alert_level,
+            'avg_daily_sales': avg_daily_sales
+        }
+
     def analyze_slow_moving_items(self, limit: int = 10, sort_type: str = 'no_sales') -> List[Dict]:
         """Phân tích hàng bán ế theo logic SQL query"""
         self.logger.info(f"Phân tích hàng bán ế theo {sort_type} (top {limit})...")
         
-        # Lấy tất cả dữ liệu bán hàng hợp lệ (không refund)
-        valid_order_items = []
-        for order in self.orders:
-            if order.status != 'refunded':
-                for order_item in order.order_items:
-                    valid_order_items.append(order_item)
+        return self._select_slow_moving(self._slow_moving_records(), limit, sort_type)
+
+    def _slow_moving_records(self) -> Tuple[List[Dict], RankingTable]:
+        """
+        Chỉ số hàng bán ế của mọi item active và bảng xếp hạng của chúng,
+        tính một lần cho mỗi ngày phân tích và dùng chung cho các sort_type
+        """
+        if self._slow_moving_cache is not None:
+            return self._slow_moving_cache
+        
+        # Tổng số lượng, doanh thu, lợi nhuận hợp lệ toàn thời gian và lô hàng cũ nhất còn tồn kho
+        if self.sql_backend:
+            lifetime_sales = self.sql_backend.lifetime_sales()
+            oldest_batches = self.sql_backend.oldest_live_batches()
+        else:
+            item_sales = self.window_aggregates.item_totals('lifetime')
+            lifetime_sales = dict(zip(self.sales_fact.item_ids.tolist(),
+                                      zip(item_sales['quantity'].tolist(), item_sales['revenue'].tolist(),
+                                          item_sales['profit'].tolist())))
+            oldest_batches = {}
+            for sku, batches in self.batches_by_sku.items():
+                live_batch_dates = [batch.import_date for batch in batches if batch.remain_quantity > 0]
+                if live_batch_dates:
+                    oldest_batches[sku] = min(live_batch_dates)
         
         # Phân tích từng item theo logic SQL query
-        slow_moving_analysis = {}
+        slow_moving_analysis = []
         
         for item in self.items:
             if not item.is_active:
                 continue  # Bỏ qua items không active
-                
-            # Tính tổng số lượng bán trong toàn bộ thời gian
-            total_sold = sum(oi.quantity for oi in valid_order_items if oi.item_id == item.id)
-            
-            # Tính tổng doanh thu
-            total_revenue = sum(oi.quantity * float(oi.price_per_unit) for oi in valid_order_items if oi.item_id == item.id)
             
-            # Tính tổng lợi nhuận
-            total_profit = sum(oi.quantity * (float(oi.price_per_unit) - float(item.cost_price)) for oi in valid_order_items if oi.item_id == item.id)
-            
-            # Tính tỷ lệ tồn kho / bán hàng (stock_to_sales_ratio)
-            if total_sold > 0:
-                stock_to_sales_ratio = item.stock_quantity / total_sold
-            else:
-                stock_to_sales_ratio = 999999  # Nếu chưa bán được gì
-            
-            # Tính giá trị tồn kho
-            stock_value = float(item.cost_price) * item.stock_quantity
-            
-            # Tính tiềm năng mất mát
-            potential_loss = stock_value if total_sold == 0 else stock_value * 0.5
+            total_sold, total_revenue, total_profit = lifetime_sales.get(item.id, (0, 0, 0))
             
             # Lấy thông tin brand và category
-            brand_name = next((b.name for b in self.brands if b.id == item.brand_id), 'Unknown')
-            category_name = next((c.name for c in self.categories if c.id == item.category_id), 'Unknown')
-            
-            # Tính profit margin
-            profit_margin = (total_profit / total_revenue * 100) if total_revenue > 0 else 0
-            
-            # Tính thời gian tồn kho dựa trên batches
-            item_batches = [batch for batch in self.batches if batch.sku == item.sku]
-            if item_batches:
-                # Lấy ngày nhập lô hàng cũ nhất còn tồn kho
-                oldest_batch_date = min(batch.import_date for batch in item_batches if batch.remain_quantity > 0)
-                days_in_stock = (self.today - oldest_batch_date).days
-            else:
-                days_in_stock = 0
+            brand = self.brands_by_id.get(item.brand_id)
+            category = self.categories_by_id.get(item.category_id)
             
-            slow_moving_analysis[item.id] = {
-                'sku': item.sku,
-                'item_name': item.name,
-                'brand_name': brand_name,
-                'category_name': category_name,
-                'current_stock': item.stock_quantity,
-                'total_quantity_sold': total_sold,
-                'total_revenue': total_revenue,
-                'total_profit': total_profit,
-                'profit_margin': profit_margin,
-                'stock_to_sales_ratio': stock_to_sales_ratio,
-                'stock_value': stock_value,
-                'potential_loss': potential_loss,
-                'cost_price': float(item.cost_price),
-                'sale_price': float(item.sale_price),
-                'days_in_stock': days_in_stock
-            }
-        
-        # Lọc và sắp xếp theo logic SQL query
-        results = []
+            slow_moving_analysis.append(self._slow_moving_record(
+                item, brand.name if brand else 'Unknown', category.name if category else 'Unknown',
+                total_sold, total_revenue, total_profit, oldest_batches.get(item.sku)
+            ))
         
-        if sort_type == 'no_sales':
+        self._slow_moving_cache = (slow_moving_analysis, self._slow_moving_ranking(slow_moving_analysis))
+        return self._slow_moving_cache
+
+    @staticmethod
+    def _slow_moving_ranking(slow_moving_analysis: List[Dict]) -> RankingTable:
+        """Chỉ số xếp hạng và bộ lọc của từng sort_type hàng bán ế (hòa thì giữ thứ tự items)"""
+        ratio = np.array([data['stock_to_sales_ratio'] for data in slow_moving_analysis], dtype=np.float64)
+        sold = np.array([data['total_quantity_sold'] for data in slow_moving_analysis], dtype=np.int64)
+        stock = np.array([data['current_stock'] for data in slow_moving_analysis], dtype=np.int64)
+        days_in_stock = np.array([data['days_in_stock'] for data in slow_moving_analysis], dtype=np.int64)
+        return RankingTable({
+            'stock_value': np.array([to_minor(data['stock_value']) for data in slow_moving_analysis], dtype=np.int64),
+            'stock_to_sales_ratio': ratio,
+            'least_sold': -sold,
+            'days_in_stock': days_in_stock,
             # Hàng không bán được (total_quantity_sold = 0)
-            no_sales_items = {item_id: data for item_id, data in slow_moving_analysis.items() 
-                             if data['total_quantity_sold'] == 0}
-            sorted_items = sorted(no_sales_items.items(), 
-                                key=lambda x: x[1]['stock_value'], reverse=True)[:limit]
-            
-        elif sort_type == 'low_sales':
+            'no_sales': sold == 0,
             # Hàng bán ít (stock_to_sales_ratio > 5 hoặc total_quantity_sold thấp)
-            low_sales_items = {item_id: data for item_id, data in slow_moving_analysis.items() 
-                              if data['stock_to_sales_ratio'] > 5 or data['total_quantity_sold'] < 10}
-            sorted_items = sorted(low_sales_items.items(), 
-                                key=lambda x: (x[1]['stock_to_sales_ratio'], -x[1]['total_quantity_sold']), reverse=True)[:limit]
-            
-        elif sort_type == 'high_stock_low_sales':
+            'low_sales': (ratio > 5) | (sold < 10),
             # Hàng có tồn kho cao nhưng bán ít (stock_to_sales_ratio > 10)
-            high_stock_items = {item_id: data for item_id, data in slow_moving_analysis.items() 
-                               if data['stock_to_sales_ratio'] > 10 and data['current_stock'] > 20}
-            sorted_items = sorted(high_stock_items.items(), 
-                                key=lambda x: x[1]['stock_to_sales_ratio'], reverse=True)[:limit]
-            
-        elif sort_type == 'aging_stock':
-            # Hàng tồn kho lâu (dựa trên ngày nhập lô hàng cũ nhất)
-            aging_items = {item_id: data for item_id, data in slow_moving_analysis.items() 
-                          if data['days_in_stock'] > 30}  # Tồn kho hơn 30 ngày
-            sorted_items = sorted(aging_items.items(), 
-                                key=lambda x: x[1]['days_in_stock'], reverse=True)[:limit]
-            
+            'high_stock_low_sales': (ratio > 10) & (stock > 20),
+            # Hàng tồn kho lâu (dựa trên ngày nhập lô hàng cũ nhất, hơn 30 ngày)
+            'aging_stock': days_in_stock > 30,
+        }, np.arange(len(slow_moving_analysis)))
+
+    def _slow_moving_record(self, item, brand_name: str, category_name: str, total_sold: int,
+                            total_revenue: int, total_profit: int, oldest_batch_date) -> Dict:
+        """Tính các chỉ số hàng bán ế cho một item từ tổng bán hàng toàn thời gian (tiền theo đơn vị nhỏ nhất)"""
+        # Tính tỷ lệ tồn kho / bán hàng (stock_to_sales_ratio)
+        if total_sold > 0:
+            stock_to_sales_ratio = item.stock_quantity / total_sold
         else:
+            stock_to_sales_ratio = 999999  # Nếu chưa bán được gì
+        
+        # Tính giá trị tồn kho
+        stock_value = to_decimal(item.cost_price * item.stock_quantity)
+        
+        # Tính tiềm năng mất mát
+        potential_loss = stock_value if total_sold == 0 else stock_value / 2
+        
+        # Tính profit margin
+        profit_margin = margin_percent(total_profit, total_revenue)
+        
+        # Tính thời gian tồn kho dựa trên lô hàng cũ nhất còn tồn kho
+        days_in_stock = (self.analysis_date - oldest_batch_date).days if oldest_batch_date else 0
+        
+        return {
+            'sku': item.sku,
+            'item_name': item.name,
+            'brand_name': brand_name,
+            'category_name': category_name,
+            'current_stock': item.stock_quantity,
+            'total_quantity_sold': total_sold,
+            'total_revenue': to_decimal(total_revenue),
+            'total_profit': to_decimal(total_profit),
+            'profit_margin': profit_margin,
+            'stock_to_sales_ratio': stock_to_sales_ratio,
+            'stock_value': stock_value,
+            'potential_loss': potential_loss,
+            'cost_price': to_decimal(item.cost_price),
+            'sale_price': to_decimal(item.sale_price),
+            'days_in_stock': days_in_stock
+        }
+
+    def _select_slow_moving(self, slow_moving_records: Tuple[List[Dict], RankingTable], limit: int, sort_type: str) -> List[Dict]:
+        """Lọc và xếp hạng hàng bán ế theo sort_type"""
+        if sort_type not in SLOW_MOVING_SORT_KEYS:
             raise ValueError(f"Sort type không hợp lệ: {sort_type}. Chỉ hỗ trợ: no_sales, low_sales, high_stock_low_sales, aging_stock")
         
+        # Lọc theo cột bool cùng tên sort_type, sắp xếp theo logic SQL query
+        slow_moving_analysis, ranking = slow_moving_records
+        results = []
+        
         # Tạo kết quả
-        for rank, (item_id, data) in enumerate(sorted_items, 1):
+        for rank, pos in enumerate(ranking.top(SLOW_MOVING_SORT_KEYS[sort_type], limit, where=sort_type), 1):
+            data = slow_moving_analysis[pos]
             results.append({
                 'analysis_date': self.analysis_date,
                 'sort_type': sort_type,
@@ -730,39 +1017,30 @@ class AnalyticsDataEngine:
         
         return results
 
+    def _daily_revenue(self) -> pd.DataFrame:
+        """Tổng doanh thu hợp lệ theo ngày đến hết ngày phân tích (cột date, revenue), sắp xếp theo ngày"""
+        if self.sql_backend:
+            return self.sql_backend.daily_revenue(self.analysis_date)
+        
+        days, revenue = self.window_aggregates.daily_revenue()
+        # Backfill: dự đoán cho một ngày trong quá khứ không được dùng doanh thu của các ngày sau đó
+        until = days <= np.datetime64(self.analysis_date, 'D')
+        days, revenue = days[until], revenue[until]
+        return pd.DataFrame({'date': pd.to_datetime(days), 'revenue': to_float(revenue)})
+
     def predict_next_month_revenue(self) -> Dict:
         """Dự đoán doanh thu tháng tới sử dụng machine learning"""
         self.logger.info("Dự đoán doanh thu tháng tới với ML...")
         
-        # Lấy dữ liệu bán hàng hợp lệ (không refund)
-        valid_orders = []
-        for order in self.orders:
-            if order.status != 'refunded':
-                for order_item in order.order_items:
-                    revenue = float(order_item.price_per_unit) * order_item.quantity
-                    valid_orders.append({
-                        'date': order.order_date.date(),
-                        'revenue': revenue,
-                        'quantity': order_item.quantity,
-                        'weekday': order.order_date.weekday(),
-                        'month': order.order_date.month,
-                        'day': order.order_date.day
-                    })
-        
-        if not valid_orders:
+        # Doanh thu bán hàng hợp lệ (không refund) theo ngày
+        daily_revenue = self._daily_revenue()
+        
+        if daily_revenue.empty:
             return {
                 'success': False,
                 'message': 'Không có đủ dữ liệu để dự đoán'
             }
         
-        # Tạo DataFrame
-        df = pd.DataFrame(valid_orders)
-        
-        # Nhóm theo ngày và tính tổng doanh thu
-        daily_revenue = df.groupby('date')['revenue'].sum().reset_index()
-        daily_revenue['date'] = pd.to_datetime(daily_revenue['date'])
-        daily_revenue = daily_revenue.sort_values('date')
-        
         # Tính các features cho ML
         daily_revenue['weekday'] = daily_revenue['date'].dt.weekday
         daily_revenue['month'] = daily_revenue['date'].dt.month
@@ -914,93 +1192,105 @@ class AnalyticsDataEngine:
 
     def save_revenue_prediction(self, prediction_data: Dict):
         """Lưu dự đoán doanh thu vào database"""
-        session = self.get_session()
-        try:
-            import json
-            
-            # Xóa dữ liệu cũ cho ngày này và period này
-            session.query(RevenuePrediction).filter(
-                and_(
-                    RevenuePrediction.analysis_date == self.analysis_date,
-                    RevenuePrediction.prediction_period == prediction_data['prediction_period']
-                )
-            ).delete()
-            
-            # Tạo bản ghi mới
-            prediction = RevenuePrediction(
-                analysis_date=self.analysis_date,
-                prediction_period=prediction_data['prediction_period'],
-                prediction_days=prediction_data['prediction_days'],
-                
-                # Historical data
-                total_historical_revenue=Decimal(str(prediction_data['historical_analysis']['total_revenue'])),
-                avg_daily_revenue=Decimal(str(prediction_data['historical_analysis']['avg_daily_revenue'])),
-                std_daily_revenue=Decimal(str(prediction_data['historical_analysis']['std_daily_revenue'])),
-                data_days=prediction_data['historical_analysis']['data_days'],
-                trend_percentage=Decimal(str(prediction_data['historical_analysis']['trend_percentage'])),
-                r2_score=Decimal(str(prediction_data['historical_analysis']['r2_score'])),
-                mape=Decimal(str(prediction_data['historical_analysis']['mape'])) if prediction_data['historical_analysis']['mape'] is not None else Decimal('0'),
-                
-                # Predictions
-                total_predicted_revenue=Decimal(str(prediction_data['predictions']['total_predicted_revenue'])),
-                avg_daily_prediction=Decimal(str(prediction_data['predictions']['avg_daily_prediction'])),
-                confidence_interval=Decimal(str(prediction_data['predictions']['confidence_interval'])),
-                lower_bound=Decimal(str(prediction_data['predictions']['lower_bound'])),
-                upper_bound=Decimal(str(prediction_data['predictions']['upper_bound'])),
-                
-                # Model info
-                algorithm=prediction_data['model_info']['algorithm'],
-                features_used=json.dumps(prediction_data['model_info']['features_used']),
-                data_points=prediction_data['model_info']['data_points'],
-                confidence_level=Decimal(str(prediction_data['model_info']['confidence_level'])),
-                
-                # Risk assessment
-                high_volatility=prediction_data['risk_assessment']['high_volatility'],
-                negative_trend=prediction_data['risk_assessment']['negative_trend'],
-                low_confidence=prediction_data['risk_assessment']['low_confidence'],
-                insufficient_data=prediction_data['risk_assessment']['insufficient_data'],
-                
-                # JSON data
-                daily_predictions=json.dumps(prediction_data['daily_predictions']),
-                weekday_analysis=json.dumps(prediction_data['weekday_analysis'])
-            )
-            
-            session.add(prediction)
-            session.commit()
-            
-            self.logger.info(f"Đã lưu dự đoán doanh thu cho {prediction_data['prediction_period']}")
-            
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu dự đoán doanh thu: {e}")
-            raise
-        finally:
-            session.close()
+        import json
+        
+        # Tạo bản ghi mới
+        row = dict(
+            analysis_date=self.analysis_date,
+            prediction_period=prediction_data['prediction_period'],
+            prediction_days=prediction_data['prediction_days'],
+            
+            # Historical data
+            total_historical_revenue=Decimal(str(prediction_data['historical_analysis']['total_revenue'])),
+            avg_daily_revenue=Decimal(str(prediction_data['historical_analysis']['avg_daily_revenue'])),
+            std_daily_revenue=Decimal(str(prediction_data['historical_analysis']['std_daily_revenue'])),
+            data_days=prediction_data['historical_analysis']['data_days'],
+            trend_percentage=Decimal(str(prediction_data['historical_analysis']['trend_percentage'])),
+            r2_score=Decimal(str(prediction_data['historical_analysis']['r2_score'])),
+            mape=Decimal(str(prediction_data['historical_analysis']['mape'])) if prediction_data['historical_analysis']['mape'] is not None else Decimal('0'),
+            
+            # Predictions
+            total_predicted_revenue=Decimal(str(prediction_data['predictions']['total_predicted_revenue'])),
+            avg_daily_prediction=Decimal(str(prediction_data['predictions']['avg_daily_prediction'])),
+            confidence_interval=Decimal(str(prediction_data['predictions']['confidence_interval'])),
+            lower_bound=Decimal(str(prediction_data['predictions']['lower_bound'])),
+            upper_bound=Decimal(str(prediction_data['predictions']['upper_bound'])),
+            
+            # Model info
+            algorithm=prediction_data['model_info']['algorithm'],
+            features_used=json.dumps(prediction_data['model_info']['features_used']),
+            data_points=prediction_data['model_info']['data_points'],
+            confidence_level=Decimal(str(prediction_data['model_info']['confidence_level'])),
+            
+            # Risk assessment
+            high_volatility=prediction_data['risk_assessment']['high_volatility'],
+            negative_trend=prediction_data['risk_assessment']['negative_trend'],
+            low_confidence=prediction_data['risk_assessment']['low_confidence'],
+            insufficient_data=prediction_data['risk_assessment']['insufficient_data'],
+            
+            # JSON data
+            daily_predictions=json.dumps(prediction_data['daily_predictions']),
+            weekday_analysis=json.dumps(prediction_data['weekday_analysis'])
+        )
+        
+        # Thay thế dữ liệu cũ cho ngày này và period này
+        self._save_summary(RevenuePrediction, {
+            'analysis_date': self.analysis_date,
+            'prediction_period': prediction_data['prediction_period']
+        }, [row])
 
-    def run_all_analysis(self):
-        """Chạy phân tích cho tất cả các khoảng thời gian"""
+    def _analysis_stages(self) -> List[Tuple]:
+        """Các bước phân tích độc lập của run_all_analysis: (key, tên method, tham số)"""
+        stages = [
+            ('daily_sales', 'analyze_daily_sales', ()),
+            ('low_stock', 'analyze_low_stock_alerts', ()),
+        ]
+        for slow_moving_type in SLOW_MOVING_TYPES:
+            stages.append((('slow_moving', slow_moving_type), 'analyze_slow_moving_items', (20, slow_moving_type)))
+        
+        for period_name in self._get_time_periods():
+            for sort_type in TOP_SELLING_TYPES:
+                stages.append((('top_items', period_name, sort_type), 'analyze_top_selling_items', (10, period_name, sort_type)))
+            for sort_type in GROUP_TYPES:
+                stages.append((('category', period_name, sort_type), 'analyze_top_category', (10, period_name, sort_type)))
+            for sort_type in GROUP_TYPES:
+                stages.append((('brand', period_name, sort_type), 'analyze_top_brand', (10, period_name, sort_type)))
+            for sort_type in REFUND_TYPES:
+                stages.append((('refunds', period_name, sort_type), 'analyze_refunds', (10, period_name, sort_type)))
+        
+        stages.append(('revenue_prediction', 'predict_next_month_revenue', ()))
+        return stages
+
+    def run_all_analysis(self, runner: StageRunner = None):
+        """Chạy phân tích cho tất cả các khoảng thời gian (song song nếu runner được cấu hình)"""
         self.logger.info("Bắt đầu chạy analysis cho tất cả các khoảng thời gian...")
         print("\n🚀 BẮT ĐẦU PHÂN TÍCH DỮ LIỆU CỦA NGÀY", self.analysis_date)
         print("="*60)
         
+        # Chạy toàn bộ các bước phân tích trên dữ liệu đã load, sau đó mới lưu kết quả
+        runner = runner or StageRunner.from_env(self.logger)
+        print(f"\n⚙️ Chế độ chạy: {runner.mode} ({runner.workers} workers)")
+        results, timings, wall_time = runner.run(self, self._analysis_stages())
+        
+        # Gom kết quả của tất cả các save_* và ghi một lần cho mỗi bảng ở cuối
+        self._summary_writer = SummaryWriter(self.engine, self.logger)
+        
         # Phân tích doanh số
         print("\n🔍 Phân tích doanh số hàng ngày...")
-        daily_sales = self.analyze_daily_sales()
+        daily_sales = self._stage_result(results, 'daily_sales')
         self.save_daily_sales_summary(daily_sales)
         print(f"   ✅ Đã lưu doanh số: {daily_sales['total_orders']} đơn hàng, {daily_sales['total_revenue']:,.0f} VNĐ")
 
         # Cảnh báo tồn kho thấp
         print("\n🔍 Phân tích cảnh báo tồn kho thấp...")
-        low_stock_alerts = self.analyze_low_stock_alerts()
+        low_stock_alerts = self._stage_result(results, 'low_stock')
         self.save_low_stock_alerts(low_stock_alerts)
         print(f"   ✅ Đã lưu {len(low_stock_alerts)} cảnh báo tồn kho")
 
         # Phân tích hàng bán ế
         print(f"   📦 Phân tích hàng bán ế...")
-        slow_moving_limit = 20
-        slow_moving_types = ['no_sales', 'low_sales', 'high_stock_low_sales', 'aging_stock']
-        for slow_moving_type in slow_moving_types:
-            slow_moving_analysis = self.analyze_slow_moving_items(slow_moving_limit, slow_moving_type)
+        for slow_moving_type in SLOW_MOVING_TYPES:
+            slow_moving_analysis = self._stage_result(results, ('slow_moving', slow_moving_type))
             self.save_slow_moving_items(slow_moving_analysis, slow_moving_type)
             print(f"      ✅ {slow_moving_type.replace('_', ' ').title()}: {len(slow_moving_analysis)} items")
         
@@ -1013,37 +1303,29 @@ class AnalyticsDataEngine:
             try:
                 # Phân tích top selling items
                 print(f"   🏆 Phân tích top selling items...")
-                top_selling_items_limit = 10;
-                top_selling_items_types = ['revenue', 'profit', 'quantity'];
-                for top_selling_items_type in top_selling_items_types:
-                    top_items = self.analyze_top_selling_items(top_selling_items_limit, period_name, top_selling_items_type)
+                for top_selling_items_type in TOP_SELLING_TYPES:
+                    top_items = self._stage_result(results, ('top_items', period_name, top_selling_items_type))
                     self.save_top_selling_items(top_items, period_name, top_selling_items_type)
                     print(f"      ✅ {top_selling_items_type.title()}: {len(top_items)} items")
                 
                 # Phân tích category
                 print(f"   📂 Phân tích hiệu suất category...")
-                category_limit = 10
-                category_types = ['revenue', 'quantity']
-                for category_type in category_types:
-                    category_summary = self.analyze_top_category(category_limit, period_name, category_type)
+                for category_type in GROUP_TYPES:
+                    category_summary = self._stage_result(results, ('category', period_name, category_type))
                     self.save_category_summary(category_summary, period_name, category_type)
                     print(f"      ✅ {category_type.title()}: {len(category_summary)} categories")
                 
                 # Phân tích brand
                 print(f"   💾 Phân tích hiệu suất brand...")
-                brand_limit = 10
-                brand_types = ['revenue', 'quantity']
-                for brand_type in brand_types:
-                    brand_summary = self.analyze_top_brand(brand_limit, period_name, brand_type)
+                for brand_type in GROUP_TYPES:
+                    brand_summary = self._stage_result(results, ('brand', period_name, brand_type))
                     self.save_brand_summary(brand_summary, period_name, brand_type)
                     print(f"      ✅ {brand_type.title()}: {len(brand_summary)} brands")
                 
                 # Phân tích refund
                 print(f"   ⚠️ Phân tích refund...")
-                refund_limit = 10
-                refund_types = ['refund_count', 'refund_rate', 'refund_quantity', 'refund_reason']
-                for refund_type in refund_types:
-                    refund_analysis = self.analyze_refunds(refund_limit, period_name, refund_type)
+                for refund_type in REFUND_TYPES:
+                    refund_analysis = self._stage_result(results, ('refunds', period_name, refund_type))
                     self.save_refund_analysis(refund_analysis, period_name, refund_type)
                     print(f"      ✅ {refund_type.replace('_', ' ').title()}: {len(refund_analysis)} items")
 
@@ -1060,7 +1342,7 @@ class AnalyticsDataEngine:
         # Dự đoán doanh thu tháng tới
         print("\n🔮 Dự đoán doanh thu tháng tới...")
         try:
-            revenue_prediction = self.predict_next_month_revenue()
+            revenue_prediction = self._stage_result(results, 'revenue_prediction')
             if revenue_prediction.get('success', True):
                 self.save_revenue_prediction(revenue_prediction)
                 print(f"   ✅ Đã lưu dự đoán doanh thu: {revenue_prediction['predictions']['total_predicted_revenue']:,.0f} VNĐ")
@@ -1070,315 +1352,359 @@ class AnalyticsDataEngine:
             self.logger.error(f"Lỗi khi dự đoán doanh thu: {e}")
             print(f"   ❌ Lỗi dự đoán doanh thu: {e}")
         
+        self._report_stage_timings(runner, timings, wall_time)
+        self._flush_summaries()
+        self._save_incremental_state()
+        
         print("\n" + "="*60)
         print("🎉 HOÀN THÀNH TẤT CẢ PHÂN TÍCH VÀ DỰ ĐOÁN!")
         print("="*60)
 
+    @staticmethod
+    def stage_group(key) -> str:
+        """Nhóm phân tích (ANALYSIS_GROUPS) của một bước"""
+        name = key if isinstance(key, str) else key[0]
+        return 'rankings' if name in RANKING_STAGES else name
+
+    def run_analysis_group(self, group: str, runner: StageRunner = None) -> Dict:
+        """
+        Chạy và lưu riêng các bước phân tích thuộc một nhóm (dùng làm thân job của scheduler)
+        Trả về {key: kết quả hoặc exception} của các bước
+        """
+        if group not in ANALYSIS_GROUPS:
+            raise ValueError(f"Nhóm phân tích không hợp lệ: {group}. Chỉ hỗ trợ: {', '.join(ANALYSIS_GROUPS)}")
+        stages = [stage for stage in self._analysis_stages() if self.stage_group(stage[0]) == group]
+        runner = runner or StageRunner.from_env(self.logger)
+        results, timings, wall_time = runner.run(self, stages)
+        self.logger.info(f"Nhóm {group}: {len(stages)} bước phân tích trong {wall_time:.2f}s")
+        
+        with self._save_lock:
+            self._summary_writer = SummaryWriter(self.engine, self.logger)
+            try:
+                for key, _, _ in stages:
+                    result = results[key]
+                    if isinstance(result, Exception):
+                        self.logger.error(f"Lỗi khi phân tích {key}: {result}")
+                        continue
+                    self._save_stage_result(key, result)
+            except Exception:
+                self._summary_writer = None
+                raise
+            self._flush_summaries()
+        return results
+
+    def _save_stage_result(self, key, result):
+        """Lưu kết quả của một bước vào bảng summary tương ứng"""
+        name = key if isinstance(key, str) else key[0]
+        if name == 'daily_sales':
+            self.save_daily_sales_summary(result)
+        elif name == 'low_stock':
+            self.save_low_stock_alerts(result)
+        elif name == 'slow_moving':
+            self.save_slow_moving_items(result, key[1])
+        elif name == 'top_items':
+            self.save_top_selling_items(result, key[1], key[2])
+        elif name == 'category':
+            self.save_category_summary(result, key[1], key[2])
+        elif name == 'brand':
+            self.save_brand_summary(result, key[1], key[2])
+        elif name == 'refunds':
+            self.save_refund_analysis(result, key[1], key[2])
+        elif name == 'revenue_prediction':
+            if result.get('success', True):
+                self.save_revenue_prediction(result)
+            else:
+                self.logger.error(f"Lỗi dự đoán: {result.get('message', 'Unknown error')}")
+
+    def run_backfill(self, runner: StageRunner = None):
+        """Chạy và lưu toàn bộ phân tích cho từng ngày trong analysis_dates với cùng một lần load dữ liệu"""
+        self.logger.info(f"Backfill {len(self.analysis_dates)} ngày: {self.analysis_dates[0]} → {self.analysis_dates[-1]}")
+        runner = runner or StageRunner.from_env(self.logger)
+        started = time.perf_counter()
+        for analysis_date in self.analysis_dates:
+            self.set_analysis_date(analysis_date)
+            self.run_all_analysis(runner)
+        elapsed = time.perf_counter() - started
+        print(f"\n📅 Backfill {len(self.analysis_dates)} ngày ({self.analysis_dates[0]} → {self.analysis_dates[-1]}) "
+              f"trong {elapsed:.2f}s")
+
+    @staticmethod
+    def _stage_result(results: Dict, key):
+        """Kết quả của một bước, raise lại lỗi nếu bước đó thất bại"""
+        result = results[key]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _report_stage_timings(self, runner: StageRunner, timings: Dict, wall_time: float):
+        """In thời gian từng bước (chậm nhất trước) và mức tăng tốc so với chạy tuần tự"""
+        print(f"\n⏱️ Thời gian các bước phân tích ({runner.mode}, {runner.workers} workers):")
+        for key, elapsed in sorted(timings.items(), key=lambda entry: entry[1], reverse=True):
+            label = key if isinstance(key, str) else '/'.join(key)
+            print(f"   {label}: {elapsed:.3f}s")
+        stage_seconds = sum(timings.values())
+        speedup = stage_seconds / wall_time if wall_time > 0 else 1
+        print(f"   📊 Tổng {stage_seconds:.2f}s thời gian các bước, {wall_time:.2f}s thực tế (tăng tốc {speedup:.2f}x)")
+        self.logger.info(f"Chạy {len(timings)} bước phân tích trong {wall_time:.2f}s ({runner.mode}, tăng tốc {speedup:.2f}x)")
+
     # Save methods
-    def save_daily_sales_summary(self, data: Dict):
-        """Lưu daily sales summary"""
-        session = self.get_session()
+    def _flush_summaries(self):
+        """Ghi phần thay đổi của toàn bộ kết quả đã gom vào các bảng summary và báo cáo số dòng thay đổi"""
+        writer, self._summary_writer = self._summary_writer, None
+        print("\n💾 Ghi kết quả vào các bảng summary...")
         try:
-            # Kiểm tra xem đã có dữ liệu cho ngày này chưa
-            existing = session.query(DailySalesSummary).filter(
-                DailySalesSummary.analysis_date == data['analysis_date']
-            ).first()
-            
-            if existing:
-                # Cập nhật
-                existing.total_orders = data['total_orders']
-                existing.total_revenue = Decimal(str(data['total_revenue']))
-                existing.total_profit = Decimal(str(data['total_profit']))
-                existing.total_refunds = data['total_refunds']
-            else:
-                # Tạo mới
-                summary = DailySalesSummary(
-                    analysis_date=data['analysis_date'],
-                    total_orders=data['total_orders'],
-                    total_revenue=Decimal(str(data['total_revenue'])),
-                    total_profit=Decimal(str(data['total_profit'])),
-                    total_refunds=data['total_refunds']
-                )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu daily sales summary cho ngày {data['analysis_date']}")
-            
+            stats = writer.flush()
         except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu daily sales summary: {e}")
+            self.logger.error(f"Lỗi khi ghi các bảng summary: {e}")
+            print(f"   ❌ Lỗi ghi summary: {e}")
             raise
+        
+        for table_name, table_stats in stats.items():
+            print(f"   ✅ {table_name}: {table_stats.rows} dòng (+{table_stats.inserted} ~{table_stats.updated} "
+                  f"-{table_stats.deleted}, giữ nguyên {table_stats.unchanged}, "
+                  f"{writer.rows_per_second(table_stats.rows, table_stats.seconds):,.0f} dòng/s)")
+        total_rows = sum(table_stats.rows for table_stats in stats.values())
+        total_changes = sum(table_stats.inserted + table_stats.updated + table_stats.deleted for table_stats in stats.values())
+        total_seconds = sum(table_stats.seconds for table_stats in stats.values())
+        print(f"   📊 Tổng: {total_rows} dòng, {total_changes} thay đổi trong {total_seconds:.2f}s "
+              f"({writer.rows_per_second(total_rows, total_seconds):,.0f} dòng/s)")
+        self._publish_analysis_versions(stats.keys())
+
+    def _publish_analysis_versions(self, table_names):
+        """
+        Ghi marker cho các bảng vừa ghi xong của ngày phân tích (API dùng để làm mới cache)
+        API documents được dựng lại trước để khi marker xuất hiện thì document đã khớp với các bảng
+        """
+        table_names = list(table_names)
+        if self.api_documents and table_names:
+            table_names.append(self._write_api_documents(table_names))
+        published_at = datetime.now()
+        writer = SummaryWriter(self.engine, self.logger)
+        for table_name in table_names:
+            writer.add(AnalysisVersion, {'analysis_date': self.analysis_date, 'table_name': table_name},
+                       [{'analysis_date': self.analysis_date, 'table_name': table_name, 'published_at': published_at}])
+        writer.flush()
+
+    def _write_api_documents(self, table_names: List[str]) -> str:
+        """
+        Tính sẵn JSON response của các endpoint chuẩn đọc từ các bảng summary vừa ghi của ngày phân tích
+        (chỉ ghi document thay đổi, document không còn response thành công bị xóa)
+        """
+        session = self.Session()
+        try:
+            documents = build_documents(session, self.analysis_date, table_names)
         finally:
-            session.close()
+            self.Session.remove()
+        
+        writer = SummaryWriter(self.engine, self.logger)
+        # Mỗi document được dựng lại là một lát dữ liệu, các document khác của ngày phân tích giữ nguyên
+        for key in document_keys(table_names):
+            body = documents.get(key)
+            writer.add(ApiDocument, {'analysis_date': self.analysis_date, 'document_key': key},
+                       [] if body is None else [{'analysis_date': self.analysis_date, 'document_key': key, 'body': body}])
+        table_stats = writer.flush()[ApiDocument.__tablename__]
+        print(f"   📄 {ApiDocument.__tablename__}: {len(documents)} documents (+{table_stats.inserted} "
+              f"~{table_stats.updated} -{table_stats.deleted})")
+        return ApiDocument.__tablename__
 
-    def save_top_selling_items(self, data: List[Dict], data_range: str = 'all_time', sort_type: str = 'revenue'):
-        """Lưu top selling items"""
-        session = self.get_session()
+    def _save_summary(self, model, slice_values: Dict, rows: List[Dict]):
+        """Thay thế một lát dữ liệu của bảng summary (gom lại nếu đang chạy run_all_analysis)"""
+        if self._summary_writer is not None:
+            self._summary_writer.add(model, slice_values, rows)
+            return
+        
+        writer = SummaryWriter(self.engine, self.logger)
+        writer.add(model, slice_values, rows)
         try:
-            # Xóa dữ liệu cũ cho ngày này, data_range và sort_type này
-            session.query(TopSellingItem).filter(
-                and_(
-                    TopSellingItem.analysis_date == self.analysis_date,
-                    TopSellingItem.data_range == data_range,
-                    TopSellingItem.sort_type == sort_type
-                )
-            ).delete()
-            
-            # Thêm dữ liệu mới
-            for item_data in data:
-                summary = TopSellingItem(
-                    analysis_date=item_data['analysis_date'],
-                    data_range=item_data.get('data_range', data_range),
-                    sort_type=item_data.get('sort_type', sort_type),
-                    sku=item_data['sku'],
-                    item_name=item_data['item_name'],
-                    total_quantity_sold=item_data['total_sold'],
-                    total_revenue=Decimal(str(item_data['total_revenue'])),
-                    total_profit=Decimal(str(item_data['total_profit'])),
-                    rank_position=item_data['rank']
-                )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu {len(data)} top selling items với data_range {data_range} và sort_type {sort_type}")
-            
+            writer.flush()
         except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu top selling items: {e}")
+            self.logger.error(f"Lỗi lưu {model.__tablename__}: {e}")
             raise
-        finally:
-            session.close()
+        self._publish_analysis_versions([model.__tablename__])
+
+    def save_daily_sales_summary(self, data: Dict):
+        """Lưu daily sales summary"""
+        self._save_summary(DailySalesSummary, {'analysis_date': data['analysis_date']}, [{
+            'analysis_date': data['analysis_date'],
+            'total_orders': data['total_orders'],
+            'total_revenue': data['total_revenue'],
+            'total_profit': data['total_profit'],
+            'total_refunds': data['total_refunds']
+        }])
+
+    def save_top_selling_items(self, data: List[Dict], data_range: str = 'all_time', sort_type: str = 'revenue'):
+        """Lưu top selling items"""
+        rows = []
+        for item_data in data:
+            rows.append({
+                'analysis_date': item_data['analysis_date'],
+                'data_range': item_data.get('data_range', data_range),
+                'sort_type': item_data.get('sort_type', sort_type),
+                'sku': item_data['sku'],
+                'item_name': item_data['item_name'],
+                'total_quantity_sold': item_data['total_sold'],
+                'total_revenue': item_data['total_revenue'],
+                'total_profit': item_data['total_profit'],
+                'rank_position': item_data['rank']
+            })
+        
+        # Thay thế dữ liệu cũ cho ngày này, data_range và sort_type này
+        self._save_summary(TopSellingItem, {
+            'analysis_date': self.analysis_date, 'data_range': data_range, 'sort_type': sort_type
+        }, rows)
 
     def save_category_summary(self, data: List[Dict], data_range: str = 'all_time', sort_type: str = 'revenue'):
         """Lưu category summary"""
-        session = self.get_session()
-        try:
-            # Xóa dữ liệu cũ cho ngày này, data_range và sort_type này
-            session.query(CategorySummary).filter(
-                and_(
-                    CategorySummary.analysis_date == self.analysis_date,
-                    CategorySummary.data_range == data_range,
-                    CategorySummary.sort_type == sort_type
-                )
-            ).delete()
-            
-            # Thêm dữ liệu mới
-            for category_data in data:
-                summary = CategorySummary(
-                    analysis_date=category_data['analysis_date'],
-                    data_range=category_data.get('data_range', data_range),
-                    sort_type=category_data.get('sort_type', sort_type),
-                    category_id=category_data['category_id'],
-                    category_name=category_data['category_name'],
-                    total_quantity_sold=category_data['total_sold'],
-                    total_revenue=Decimal(str(category_data['total_revenue'])),
-                    total_profit=Decimal(str(category_data['total_profit'])),
-                    profit_margin=Decimal(str(category_data['profit_margin'])),
-                    rank_position=category_data['rank']
-                )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu {len(data)} category summaries với data_range {data_range} và sort_type {sort_type}")
-            
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu category summary: {e}")
-            raise
-        finally:
-            session.close()
+        rows = []
+        for category_data in data:
+            rows.append({
+                'analysis_date': category_data['analysis_date'],
+                'data_range': category_data.get('data_range', data_range),
+                'sort_type': category_data.get('sort_type', sort_type),
+                'category_id': category_data['category_id'],
+                'category_name': category_data['category_name'],
+                'total_quantity_sold': category_data['total_sold'],
+                'total_revenue': category_data['total_revenue'],
+                'total_profit': category_data['total_profit'],
+                'profit_margin': Decimal(str(category_data['profit_margin'])),
+                'rank_position': category_data['rank']
+            })
+        
+        # Thay thế dữ liệu cũ cho ngày này, data_range và sort_type này
+        self._save_summary(CategorySummary, {
+            'analysis_date': self.analysis_date, 'data_range': data_range, 'sort_type': sort_type
+        }, rows)
 
     def save_brand_summary(self, data: List[Dict], data_range: str = 'all_time', sort_type: str = 'revenue'):
         """Lưu brand summary"""
-        session = self.get_session()
-        try:
-            # Xóa dữ liệu cũ cho ngày này, data_range và sort_type này
-            session.query(BrandSummary).filter(
-                and_(
-                    BrandSummary.analysis_date == self.analysis_date,
-                    BrandSummary.data_range == data_range,
-                    BrandSummary.sort_type == sort_type
-                )
-            ).delete()
-            
-            # Thêm dữ liệu mới
-            for brand_data in data:
-                summary = BrandSummary(
-                    analysis_date=brand_data['analysis_date'],
-                    data_range=brand_data.get('data_range', data_range),
-                    sort_type=brand_data.get('sort_type', sort_type),
-                    brand_id=brand_data['brand_id'],
-                    brand_name=brand_data['brand_name'],
-                    total_quantity_sold=brand_data['total_sold'],
-                    total_revenue=Decimal(str(brand_data['total_revenue'])),
-                    total_profit=Decimal(str(brand_data['total_profit'])),
-                    profit_margin=Decimal(str(brand_data['profit_margin'])),
-                    rank_position=brand_data['rank']
-                )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu {len(data)} brand summaries với data_range {data_range} và sort_type {sort_type}")
-            
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu brand summary: {e}")
-            raise
-        finally:
-            session.close()
+        rows = []
+        for brand_data in data:
+            rows.append({
+                'analysis_date': brand_data['analysis_date'],
+                'data_range': brand_data.get('data_range', data_range),
+                'sort_type': brand_data.get('sort_type', sort_type),
+                'brand_id': brand_data['brand_id'],
+                'brand_name': brand_data['brand_name'],
+                'total_quantity_sold': brand_data['total_sold'],
+                'total_revenue': brand_data['total_revenue'],
+                'total_profit': brand_data['total_profit'],
+                'profit_margin': Decimal(str(brand_data['profit_margin'])),
+                'rank_position': brand_data['rank']
+            })
+        
+        # Thay thế dữ liệu cũ cho ngày này, data_range và sort_type này
+        self._save_summary(BrandSummary, {
+            'analysis_date': self.analysis_date, 'data_range': data_range, 'sort_type': sort_type
+        }, rows)
 
     def save_refund_analysis(self, data: List[Dict], data_range: str = 'all_time', sort_type: str = 'refund_count'):
         """Lưu refund analysis"""
-        session = self.get_session()
-        try:
-            # Xóa dữ liệu cũ cho ngày này, data_range và sort_type này
-            session.query(RefundAnalysis).filter(
-                and_(
-                    RefundAnalysis.analysis_date == self.analysis_date,
-                    RefundAnalysis.data_range == data_range,
-                    RefundAnalysis.sort_type == sort_type
-                )
-            ).delete()
-            
-            # Thêm dữ liệu mới
-            for refund_data in data:
-                # Xử lý dữ liệu khác nhau cho refund_reason sort type
-                if sort_type == 'refund_reason':
-                    summary = RefundAnalysis(
-                        analysis_date=refund_data['analysis_date'],
-                        data_range=data_range,
-                        sort_type=sort_type,
-                        sku='',  # Không có SKU cho refund_reason analysis
-                        item_name='',  # Không có item_name cho refund_reason analysis
-                        total_orders=refund_data['total_orders'],
-                        refund_orders=refund_data['refund_count'],
-                        refund_rate=Decimal(str(refund_data['refund_rate'])),
-                        refund_reason=refund_data['refund_reason'],
-                        refund_quantity=refund_data.get('refund_quantity', 0),
-                        items_affected=refund_data.get('items_affected', 0),
-                        rank_position=refund_data.get('rank', 0)
-                    )
-                else:
-                    summary = RefundAnalysis(
-                        analysis_date=refund_data['analysis_date'],
-                        data_range=data_range,
-                        sort_type=sort_type,
-                        sku=refund_data['sku'],
-                        item_name=refund_data['item_name'],
-                        total_orders=refund_data['total_orders'],
-                        refund_orders=refund_data['refund_count'],
-                        refund_rate=Decimal(str(refund_data['refund_rate'])),
-                        refund_reason=refund_data['refund_reason'],
-                        refund_quantity=refund_data.get('refund_quantity', 0),
-                        rank_position=refund_data.get('rank', 0)
-                    )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu {len(data)} refund analyses với data_range {data_range} và sort_type {sort_type}")
-            
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu refund analysis: {e}")
-            raise
-        finally:
-            session.close()
+        rows = []
+        for refund_data in data:
+            row = {
+                'analysis_date': refund_data['analysis_date'],
+                'data_range': data_range,
+                'sort_type': sort_type,
+                'total_orders': refund_data['total_orders'],
+                'refund_orders': refund_data['refund_count'],
+                'refund_rate': Decimal(str(refund_data['refund_rate'])),
+                'refund_reason': refund_data['refund_reason'],
+                'refund_quantity': refund_data.get('refund_quantity', 0),
+                'items_affected': refund_data.get('items_affected', 0),
+                'rank_position': refund_data.get('rank', 0)
+            }
+            # Xử lý dữ liệu khác nhau cho refund_reason sort type
+            if sort_type == 'refund_reason':
+                row['sku'] = ''  # Không có SKU cho refund_reason analysis
+                row['item_name'] = ''  # Không có item_name cho refund_reason analysis
+            else:
+                row['sku'] = refund_data['sku']
+                row['item_name'] = refund_data['item_name']
+            rows.append(row)
+        
+        # Thay thế dữ liệu cũ cho ngày này, data_range và sort_type này
+        self._save_summary(RefundAnalysis, {
+            'analysis_date': self.analysis_date, 'data_range': data_range, 'sort_type': sort_type
+        }, rows)
 
     def save_low_stock_alerts(self, data: List[Dict]):
         """Lưu low stock alerts"""
-        session = self.get_session()
-        try:
-            # Xóa dữ liệu cũ cho ngày này
-            session.query(LowStockAlert).filter(
-                LowStockAlert.analysis_date == self.analysis_date
-            ).delete()
-            
-            # Thêm dữ liệu mới
-            for alert_data in data:
-                # Xác định alert_type dựa trên days_of_stock_left
-                days_left = alert_data['days_of_stock_left']
-                if days_left <= 0:
-                    alert_type = 'out_of_stock'
-                elif days_left <= 3:
-                    alert_type = 'low_stock'
-                else:
-                    alert_type = 'expiring_soon'
-                
-                summary = LowStockAlert(
-                    analysis_date=alert_data['analysis_date'],
-                    sku=alert_data['sku'],
-                    item_name=alert_data['item_name'],
-                    current_stock=alert_data['current_stock'],
-                    avg_daily_sales=Decimal(str(alert_data.get('avg_daily_sales', 0))),
-                    days_left=Decimal(str(days_left)),
-                    alert_type=alert_type
-                )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu {len(data)} low stock alerts")
-            
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu low stock alerts: {e}")
-            raise
-        finally:
-            session.close()
+        rows = []
+        for alert_data in data:
+            # Xác định alert_type dựa trên days_of_stock_left
+            days_left = alert_data['days_of_stock_left']
+            if days_left <= 0:
+                alert_type = 'out_of_stock'
+            elif days_left <= 3:
+                alert_type = 'low_stock'
+            else:
+                alert_type = 'expiring_soon'
+            
+            rows.append({
+                'analysis_date': alert_data['analysis_date'],
+                'sku': alert_data['sku'],
+                'item_name': alert_data['item_name'],
+                'current_stock': alert_data['current_stock'],
+                'avg_daily_sales': Decimal(str(alert_data.get('avg_daily_sales', 0))),
+                'days_left': Decimal(str(days_left)),
+                'alert_type': alert_type
+            })
+        
+        # Thay thế dữ liệu cũ cho ngày này
+        self._save_summary(LowStockAlert, {'analysis_date': self.analysis_date}, rows)
 
     def save_slow_moving_items(self, data: List[Dict], sort_type: str = 'no_sales'):
         """Lưu slow moving items analysis"""
-        session = self.get_session()
-        try:
-            # Xóa dữ liệu cũ cho ngày này và sort_type này
-            session.query(SlowMovingItem).filter(
-                and_(
-                    SlowMovingItem.analysis_date == self.analysis_date,
-                    SlowMovingItem.sort_type == sort_type
-                )
-            ).delete()
-            
-            # Thêm dữ liệu mới
-            for item_data in data:
-                summary = SlowMovingItem(
-                    analysis_date=item_data['analysis_date'],
-                    sort_type=item_data.get('sort_type', sort_type),
-                    sku=item_data['sku'],
-                    item_name=item_data['item_name'],
-                    brand_name=item_data.get('brand_name', ''),
-                    category_name=item_data.get('category_name', ''),
-                    current_stock=item_data['current_stock'],
-                    total_quantity_sold=item_data['total_quantity_sold'],
-                    total_revenue=Decimal(str(item_data['total_revenue'])),
-                    total_profit=Decimal(str(item_data['total_profit'])),
-                    profit_margin=Decimal(str(item_data['profit_margin'])),
-                    stock_to_sales_ratio=Decimal(str(item_data['stock_to_sales_ratio'])),
-                    stock_value=Decimal(str(item_data['stock_value'])),
-                    potential_loss=Decimal(str(item_data['potential_loss'])),
-                    cost_price=Decimal(str(item_data['cost_price'])),
-                    sale_price=Decimal(str(item_data['sale_price'])),
-                    days_in_stock=item_data.get('days_in_stock', 0),
-                    rank_position=item_data['rank']
-                )
-                session.add(summary)
-            
-            session.commit()
-            self.logger.info(f"Đã lưu {len(data)} slow moving items với sort_type {sort_type}")
-            
-        except Exception as e:
-            session.rollback()
-            self.logger.error(f"Lỗi lưu slow moving items: {e}")
-            raise
-        finally:
-            session.close()
+        rows = []
+        for item_data in data:
+            rows.append({
+                'analysis_date': item_data['analysis_date'],
+                'sort_type': item_data.get('sort_type', sort_type),
+                'sku': item_data['sku'],
+                'item_name': item_data['item_name'],
+                'brand_name': item_data.get('brand_name', ''),
+                'category_name': item_data.get('category_name', ''),
+                'current_stock': item_data['current_stock'],
+                'total_quantity_sold': item_data['total_quantity_sold'],
+                'total_revenue': item_data['total_revenue'],
+                'total_profit': item_data['total_profit'],
+                'profit_margin': Decimal(str(item_data['profit_margin'])),
+                'stock_to_sales_ratio': Decimal(str(item_data['stock_to_sales_ratio'])),
+                'stock_value': item_data['stock_value'],
+                'potential_loss': item_data['potential_loss'],
+                'cost_price': item_data['cost_price'],
+                'sale_price': item_data['sale_price'],
+                'days_in_stock': item_data.get('days_in_stock', 0),
+                'rank_position': item_data['rank']
+            })
+        
+        # Thay thế dữ liệu cũ cho ngày này và sort_type này
+        self._save_summary(SlowMovingItem, {'analysis_date': self.analysis_date, 'sort_type': sort_type}, rows)
 
     def get_available_periods(self):
         """Lấy danh sách các khoảng thời gian có sẵn"""
         return list(self._get_time_periods().keys())
 
+def backfill_dates(start_date: date, end_date: date) -> List[date]:
+    """Các ngày từ start_date đến end_date (bao gồm cả hai đầu)"""
+    if end_date < start_date:
+        raise ValueError(f"Khoảng backfill không hợp lệ: {start_date} > {end_date}")
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
 if __name__ == "__main__":
-    engine = AnalyticsDataEngine()
+    backfill_start = os.getenv('ANALYTICS_BACKFILL_START', '').strip()
+    backfill_end = os.getenv('ANALYTICS_BACKFILL_END', '').strip()
     
-    # Demo phân tích và lưu dữ liệu theo khoảng thời gian
-    engine.run_all_analysis();
+    if backfill_start:
+        # Backfill: load dữ liệu một lần, phân tích và lưu cho từng ngày trong khoảng
+        start_date = date.fromisoformat(backfill_start)
+        end_date = date.fromisoformat(backfill_end) if backfill_end else start_date
+        engine = AnalyticsDataEngine(analysis_dates=backfill_dates(start_date, end_date))
+        engine.run_backfill()
+    else:
+        engine = AnalyticsDataEngine()
+        
+        # Demo phân tích và lưu dữ liệu theo khoảng thời gian
+        engine.run_all_analysis();
     
     print("\n🎉 HOÀN THÀNH TẤT CẢ PHÂN TÍCH!")
\ No newline at end of file
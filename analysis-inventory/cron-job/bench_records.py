@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark bộ nhớ giữ dữ liệu nguồn
+So sánh số byte mỗi dòng (tracemalloc) khi giữ dữ liệu dưới dạng ORM object với record gọn nhẹ
+(records.py) và chunk order lines dạng cột (sales_fact.py) trên database đang cấu hình (DB_*)
+
+    python bench_records.py
+BENCH_ROWS: số dòng tối đa đọc cho mỗi bảng (mặc định 50000)
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy.orm import Session
+
+from analysis import AnalyticsDataEngine
+from package.models.models import Batch, Item, Order, OrderItem, get_engine
+from records import BatchRecord, ItemRecord, load_records, records_statement, to_record
+from sales_fact import SalesFact
+
+
+def measure(label: str, load, count) -> object:
+    """Số byte còn giữ sau khi load (đã gc) chia cho số dòng"""
+    gc.collect()
+    tracemalloc.start()
+    loaded = load()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rows = count(loaded)
+    per_row = current / rows if rows else 0
+    print(f"   {label:32s} {per_row:8,.0f} bytes/dòng ({rows:,} dòng)")
+    return loaded
+
+
+if __name__ == "__main__":
+    limit = int(os.getenv('BENCH_ROWS', '50000'))
+    engine = get_engine()
+    print(f"📏 Bộ nhớ mỗi dòng (tối đa {limit:,} dòng mỗi bảng)")
+
+    # ORM: mỗi order line là OrderItem kèm Order (như khi load orders/order_items bằng session.query)
+    for label, load in (
+        ('ORM OrderItem + Order', lambda session: (session.query(OrderItem).limit(limit).all(),
+                                                   session.query(Order).limit(limit).all())),
+        ('ORM Item', lambda session: (session.query(Item).limit(limit).all(),)),
+        ('ORM Batch', lambda session: (session.query(Batch).limit(limit).all(),)),
+    ):
+        with Session(engine) as session:
+            measure(label, lambda: load(session), lambda loaded: len(loaded[0]))
+
+    with engine.connect() as connection:
+        for label, model, record_cls in (('ItemRecord', Item, ItemRecord), ('BatchRecord', Batch, BatchRecord)):
+            measure(label, lambda: [to_record(record_cls, row) for row in
+                                    connection.execute(records_statement(model, record_cls).limit(limit))], len)
+
+        items = load_records(connection, Item, ItemRecord)
+        rows = connection.execute(AnalyticsDataEngine._order_lines_statement().limit(limit)).all()
+    fact = SalesFact(items, [], [])
+    measure('Chunk order lines dạng cột', lambda: fact.lines_chunk(rows), len)
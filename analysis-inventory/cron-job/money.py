@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Fixed-Point Money
+Tiền được xử lý dưới dạng số nguyên đơn vị nhỏ nhất (1/100) trong toàn bộ pipeline phân tích,
+chỉ chuyển sang Decimal khi trả kết quả
+"""
+
+import numpy as np
+from decimal import Decimal, ROUND_HALF_UP
+from typing import NewType
+
+# Các cột tiền trong database là DECIMAL(.., 2)
+MINOR_DIGITS = 2
+MINOR_UNITS = 10 ** MINOR_DIGITS
+
+# Số tiền tính bằng đơn vị nhỏ nhất (kiểu của các field tiền trong record)
+Money = NewType('Money', int)
+
+
+def to_minor(value) -> Money:
+    """Một giá trị tiền (Decimal, float, int hoặc None) thành số nguyên đơn vị nhỏ nhất"""
+    if value is None:
+        return Money(0)
+    if isinstance(value, Decimal):
+        return Money(int((value * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP)))
+    return Money(int(round(float(value) * MINOR_UNITS)))
+
+
+def to_minor_array(values) -> np.ndarray:
+    """
+    Cột tiền thành mảng int64 đơn vị nhỏ nhất
+    Chuyển từng giá trị bằng to_minor (Decimal đổi chính xác, không đi qua float64)
+    """
+    return np.fromiter((to_minor(value) for value in values), dtype=np.int64, count=len(values))
+
+
+def to_decimal(minor) -> Decimal:
+    """Số nguyên đơn vị nhỏ nhất thành Decimal (chính xác, 2 chữ số thập phân)"""
+    return Decimal(int(minor)).scaleb(-MINOR_DIGITS)
+
+
+def to_float(minor) -> float:
+    """Số nguyên (hoặc mảng) đơn vị nhỏ nhất thành số tiền float, dùng cho mô hình dự đoán"""
+    return minor / MINOR_UNITS
+
+
+def margin_percent(profit, revenue) -> float:
+    """Tỷ suất lợi nhuận (%) từ lợi nhuận và doanh thu cùng đơn vị"""
+    return int(profit) * 100 / int(revenue) if revenue > 0 else 0
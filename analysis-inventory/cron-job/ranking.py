@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Top-K Ranking
+Chọn top-K theo nhiều tiêu chí trên một bảng chỉ số dựng sẵn (argpartition thay vì sắp xếp toàn bộ)
+"""
+
+import numpy as np
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+# Tiêu chí xếp hạng: tên một cột hoặc tuple tên cột (cột đầu tiên ưu tiên nhất), tất cả giảm dần
+SortKey = Union[str, Tuple[str, ...]]
+
+
+def top_k(keys: Sequence[np.ndarray], tie_breaker: np.ndarray, limit: int) -> np.ndarray:
+    """
+    Vị trí của tối đa `limit` phần tử đứng đầu, xếp giảm dần theo từng key, hòa thì theo tie_breaker tăng dần
+    argpartition tìm ngưỡng của key đầu tiên, chỉ các phần tử từ ngưỡng trở lên (kể cả mọi phần tử hòa
+    ở ngưỡng) mới được sắp xếp
+    """
+    positions = np.arange(len(tie_breaker))
+    if limit <= 0:
+        return positions[:0]
+    if limit < len(positions):
+        primary = keys[0]
+        threshold = primary[np.argpartition(-primary, limit - 1)[limit - 1]]
+        positions = np.flatnonzero(primary >= threshold)
+    order = np.lexsort([tie_breaker[positions]] + [-key[positions] for key in reversed(keys)])
+    return positions[order[:limit]]
+
+
+class RankingTable:
+    """
+    Bảng chỉ số của các ứng viên (mỗi cột một mảng), dùng chung cho mọi yêu cầu top-K trên cùng dữ liệu
+    Kết quả của mỗi (tiêu chí, limit, bộ lọc) được giữ lại nên các lần hỏi lặp lại không phải chọn lại
+    """
+
+    def __init__(self, metrics: Dict[str, np.ndarray], tie_breaker: np.ndarray, candidates: np.ndarray = None):
+        """
+        metrics: {tên cột: mảng chỉ số}; cột bool có thể dùng làm bộ lọc `where`
+        tie_breaker: khóa phân định khi hòa (tăng dần, nên là duy nhất để thứ tự luôn xác định)
+        candidates: vị trí các ứng viên trong các mảng (mặc định tất cả)
+        """
+        self.candidates = np.arange(len(tie_breaker)) if candidates is None else np.asarray(candidates, dtype=np.int64)
+        self.metrics = {name: np.asarray(values)[self.candidates] for name, values in metrics.items()}
+        self.tie_breaker = np.asarray(tie_breaker)[self.candidates]
+        self._results = {}
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def top(self, sort_key: SortKey, limit: int, where: Optional[str] = None) -> List[int]:
+        """Vị trí (trong các mảng gốc) của top `limit` theo sort_key, chỉ xét các ứng viên có cột bool `where` đúng"""
+        request = (sort_key, limit, where)
+        if request not in self._results:
+            names = (sort_key,) if isinstance(sort_key, str) else tuple(sort_key)
+            subset = np.flatnonzero(self.metrics[where]) if where is not None else np.arange(len(self.candidates))
+            selected = subset[top_k([self.metrics[name][subset] for name in names], self.tie_breaker[subset], limit)]
+            self._results[request] = self.candidates[selected].tolist()
+        return self._results[request]
+
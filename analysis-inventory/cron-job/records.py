@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compact Records
+Bản ghi dimension gọn nhẹ (NamedTuple, giá là số nguyên đơn vị tiền nhỏ nhất) thay cho ORM object khi giữ trong memory
+"""
+
+from datetime import date
+from typing import List, NamedTuple, Optional
+from sqlalchemy import select
+
+from money import Money, to_minor
+
+
+class ItemRecord(NamedTuple):
+    id: int
+    sku: str
+    name: str
+    cost_price: Money
+    sale_price: Money
+    stock_quantity: int
+    brand_id: Optional[int]
+    category_id: Optional[int]
+    is_active: bool
+
+
+class BrandRecord(NamedTuple):
+    id: int
+    name: str
+
+
+class CategoryRecord(NamedTuple):
+    id: int
+    name: str
+
+
+class BatchRecord(NamedTuple):
+    id: int
+    sku: str
+    import_date: date
+    total_quantity: int
+    remain_quantity: int
+
+
+def records_statement(model, record_cls):
+    """SELECT đúng các cột của record từ bảng của model"""
+    table = model.__table__
+    return select(*[table.c[field] for field in record_cls._fields])
+
+
+def to_record(record_cls, row) -> NamedTuple:
+    """Dựng record từ một dòng kết quả, chuyển các cột tiền (Decimal) sang số nguyên đơn vị nhỏ nhất"""
+    return record_cls._make(to_minor(value) if record_cls.__annotations__[field] is Money else value
+                            for field, value in zip(record_cls._fields, row))
+
+
+def load_records(connection, model, record_cls) -> List[NamedTuple]:
+    """Đọc toàn bộ bảng thành danh sách record"""
+    return [to_record(record_cls, row) for row in connection.execute(records_statement(model, record_cls))]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Refund Reason Classifier
+Gộp các lý do refund gần giống nhau bằng một regex biên dịch sẵn cho tất cả các nhóm từ khóa
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+# Nhóm lý do và từ khóa, xét theo thứ tự: nhóm đầu tiên có từ khóa xuất hiện trong lý do được chọn
+DEFAULT_KEYWORD_GROUPS = {
+    'Khách đổi ý': ['khách đổi ý', 'khách không cần', 'khách hủy', 'khách thay đổi'],
+    'Không đúng mô tả': ['không đúng mô tả', 'sai mô tả', 'không giống mô tả', 'khác mô tả'],
+    'Hư hỏng': ['hư hỏng', 'bị hỏng', 'lỗi', 'defect', 'damaged'],
+    'Vấn đề giao hàng': ['giao hàng', 'vận chuyển', 'shipping', 'delivery'],
+    'Chất lượng kém': ['chất lượng', 'quality', 'kém chất lượng'],
+    'Kích thước không phù hợp': ['kích thước', 'size', 'to nhỏ'],
+    'Màu sắc không đúng': ['màu sắc', 'color', 'màu'],
+}
+
+# Nhóm cho lý do rỗng
+UNKNOWN_REASON = 'Không xác định'
+
+
+class RefundReasonClassifier:
+    """Phân loại lý do refund với một lần quét regex và cache theo lý do đã chuẩn hóa"""
+
+    def __init__(self, keyword_groups: Dict[str, List[str]] = None, cache_size: int = 4096):
+        self.keyword_groups = dict(keyword_groups or DEFAULT_KEYWORD_GROUPS)
+        self.labels = list(self.keyword_groups)
+        # Mỗi nhóm là một nhánh lookahead, regex thử các nhánh theo thứ tự nên giữ đúng độ ưu tiên của nhóm
+        branches = []
+        for pos, keywords in enumerate(self.keyword_groups.values()):
+            alternatives = '|'.join(re.escape(keyword.lower()) for keyword in keywords)
+            branches.append(f'(?=.*?(?:{alternatives}))(?P<g{pos}>)')
+        self._pattern = re.compile('|'.join(branches), re.DOTALL) if branches else None
+        self._classify_normalized = lru_cache(maxsize=cache_size)(self._match)
+
+    @classmethod
+    def from_env(cls) -> 'RefundReasonClassifier':
+        """Tạo classifier từ file JSON {nhóm: [từ khóa]} trong ANALYTICS_REFUND_KEYWORDS (mặc định: bảng có sẵn)"""
+        path = os.getenv('ANALYTICS_REFUND_KEYWORDS')
+        if not path:
+            return cls()
+        with open(path, encoding='utf-8') as config_file:
+            return cls(json.load(config_file))
+
+    def _match(self, reason: str) -> str:
+        match = self._pattern.match(reason) if self._pattern else None
+        if match is None:
+            # Trả về lý do gốc nếu không match với nhóm nào
+            return reason.title()
+        return self.labels[int(match.lastgroup[1:])]
+
+    def classify(self, reason: Optional[str]) -> str:
+        """Nhóm của một lý do refund"""
+        if not reason:
+            return UNKNOWN_REASON
+        return self._classify_normalized(str(reason).lower().strip())
+
+    def classify_many(self, reasons: Iterable[Optional[str]]) -> List[str]:
+        """Nhóm của cả một cột lý do refund (mỗi lý do phân biệt chỉ phân loại một lần)"""
+        groups = {}
+        return [groups[reason] if reason in groups else groups.setdefault(reason, self.classify(reason))
+                for reason in reasons]
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Item Daily Sales Rollup
+Duy trì bảng item_daily_sales: tổng bán hàng theo (ngày, item), chỉ làm mới các ngày có thay đổi
+kể từ watermark của lần làm mới trước (bảng rollup_watermarks)
+"""
+
+import logging
+import time
+import numpy as np
+from datetime import datetime
+from typing import Dict, Tuple
+from sqlalchemy import select, func, case, delete, insert, and_, or_
+
+from aggregate_state import day_ranges
+from package.models.models import Item, Order, OrderItem, ItemDailySales, RollupWatermark
+
+
+class ItemDailyRollup:
+    """Làm mới rollup ngay trong database bằng DELETE + INSERT ... SELECT GROUP BY cho các ngày thay đổi"""
+
+    def __init__(self, engine, logger: logging.Logger = None):
+        self.engine = engine
+        self.logger = logger or logging.getLogger(__name__)
+
+    def refresh(self) -> Tuple[int, float]:
+        """
+        Làm mới các ngày có order/order item mới hoặc được sửa kể từ lần làm mới trước. Watermark (id,
+        updated_at lớn nhất của orders/order_items) được đọc trước khi tìm các ngày thay đổi và lưu trong
+        rollup_watermarks, nên dòng commit trong lúc làm mới được xử lý lại ở lần sau. Trả về (số ngày, số giây)
+        Giới hạn: order/order item bị xóa và order bị đổi order_date (ngày cũ) không được phát hiện,
+        các ngày đó giữ dòng cũ cho đến khi xóa watermark để tổng hợp lại toàn bộ
+        """
+        started = time.perf_counter()
+        with self.engine.begin() as connection:
+            previous = connection.execute(
+                select(RollupWatermark).where(RollupWatermark.rollup_name == ItemDailySales.__tablename__)
+            ).mappings().first()
+            watermark = self._source_watermark(connection)
+            if previous is None:
+                # Chưa có watermark (lần đầu hoặc cần tổng hợp lại): tổng hợp lại toàn bộ lịch sử
+                connection.execute(delete(ItemDailySales))
+                connection.execute(self._insert_rollup())
+                n_days = connection.execute(select(func.count(func.distinct(ItemDailySales.sale_date)))).scalar()
+            else:
+                days = self._changed_days(connection, previous)
+                for start, end in day_ranges(days):
+                    connection.execute(delete(ItemDailySales).where(
+                        ItemDailySales.sale_date >= start.date(), ItemDailySales.sale_date < end.date()))
+                if len(days):
+                    connection.execute(self._insert_rollup(or_(*[and_(Order.order_date >= start, Order.order_date < end)
+                                                                 for start, end in day_ranges(days)])))
+                n_days = len(days)
+            connection.execute(delete(RollupWatermark).where(RollupWatermark.rollup_name == ItemDailySales.__tablename__))
+            connection.execute(insert(RollupWatermark).values(rollup_name=ItemDailySales.__tablename__,
+                                                              refreshed_at=datetime.now(), **watermark))
+        elapsed = time.perf_counter() - started
+        self.logger.info(f"Đã làm mới item_daily_sales cho {n_days} ngày trong {elapsed:.3f}s")
+        return n_days, elapsed
+
+    @staticmethod
+    def _source_watermark(connection) -> Dict:
+        """id và updated_at lớn nhất hiện tại của orders và order_items"""
+        order_id, order_updated_at = connection.execute(select(func.max(Order.id), func.max(Order.updated_at))).one()
+        item_id, item_updated_at = connection.execute(select(func.max(OrderItem.id), func.max(OrderItem.updated_at))).one()
+        return {'order_id': order_id or 0, 'order_updated_at': order_updated_at,
+                'order_item_id': item_id or 0, 'order_item_updated_at': item_updated_at}
+
+    @staticmethod
+    def _changed_days(connection, watermark) -> np.ndarray:
+        """Các ngày (số ngày kể từ epoch) có order hoặc order item mới/được sửa sau watermark"""
+        order_changed = [Order.id > watermark['order_id']]
+        if watermark['order_updated_at']:
+            order_changed.append(Order.updated_at >= watermark['order_updated_at'])
+        item_changed = [OrderItem.id > watermark['order_item_id']]
+        if watermark['order_item_updated_at']:
+            item_changed.append(OrderItem.updated_at >= watermark['order_item_updated_at'])
+        
+        dates = connection.execute(select(Order.order_date).where(or_(*order_changed))).scalars().all()
+        dates += connection.execute(select(Order.order_date)
+                                    .join(OrderItem, OrderItem.order_id == Order.id)
+                                    .where(or_(*item_changed))).scalars().all()
+        return np.unique(np.array(dates, dtype='datetime64[us]').astype('datetime64[D]').astype(np.int64))
+
+    @staticmethod
+    def _insert_rollup(*conditions):
+        """INSERT ... SELECT tổng theo (DATE(order_date), item_id) của các order lines thỏa điều kiện"""
+        sale_date = func.date(Order.order_date)
+        is_valid = Order.status != 'refunded'
+        line_revenue = OrderItem.quantity * OrderItem.price_per_unit
+        line_cost = OrderItem.quantity * Item.cost_price
+        rollup = (select(sale_date, OrderItem.item_id,
+                         func.sum(case((is_valid, OrderItem.quantity), else_=0)),
+                         func.sum(case((is_valid, line_revenue), else_=0)),
+                         func.sum(case((is_valid, line_cost), else_=0)),
+                         func.sum(case((is_valid, 0), else_=1)),
+                         func.sum(case((is_valid, 0), else_=OrderItem.quantity)),
+                         func.now(), func.now())
+                  .select_from(OrderItem)
+                  .join(Order, Order.id == OrderItem.order_id)
+                  .join(Item, Item.id == OrderItem.item_id)
+                  .where(*conditions)
+                  .group_by(sale_date, OrderItem.item_id))
+        return insert(ItemDailySales).from_select(
+            ['sale_date', 'item_id', 'quantity', 'revenue', 'cost', 'refund_count', 'refund_quantity',
+             'created_at', 'updated_at'], rollup)
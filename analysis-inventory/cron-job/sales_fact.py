@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Sales Fact Table dạng cột (NumPy)
+Biểu diễn order lines thành các mảng liên tục để phân tích vector hóa
+"""
+
+import copy
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from money import to_minor_array
+
+
+def to_datetime64(value: datetime) -> np.datetime64:
+    """Chuyển datetime sang numpy datetime64 (độ chính xác micro giây)"""
+    return np.datetime64(value, 'us')
+
+
+class SalesFact:
+    """Bảng fact bán hàng dạng cột: fact gốc chỉ giữ các dimension (items, brands, categories, lý do refund)
+
+    Order lines được nạp theo từng chunk qua lines_chunk()/columns_chunk(), mỗi chunk là một SalesFact
+    dùng chung dimension với mỗi vị trí là một order line (đã sắp xếp theo order_date)
+    """
+
+    def __init__(self, items, brands, categories):
+        """Khởi tạo bảng dimension cho items, brands, categories"""
+        self.brand_ids = np.array([brand.id for brand in brands], dtype=np.int64)
+        self.category_ids = np.array([category.id for category in categories], dtype=np.int64)
+        brand_pos = {brand_id: pos for pos, brand_id in enumerate(self.brand_ids.tolist())}
+        category_pos = {category_id: pos for pos, category_id in enumerate(self.category_ids.tolist())}
+
+        # Dimension items: -1 nếu item không có brand/category
+        self.item_ids = np.array([item.id for item in items], dtype=np.int64)
+        self.item_brand_idx = np.array([brand_pos.get(item.brand_id, -1) for item in items], dtype=np.int64)
+        self.item_category_idx = np.array([category_pos.get(item.category_id, -1) for item in items], dtype=np.int64)
+        # Giá vốn theo đơn vị tiền nhỏ nhất (record đã giữ tiền ở dạng số nguyên)
+        self.item_cost_price = np.array([item.cost_price for item in items], dtype=np.int64)
+        self._item_pos = {item_id: pos for pos, item_id in enumerate(self.item_ids.tolist())}
+
+        # Lý do refund gốc, index dùng chung cho mọi chunk order lines
+        self.refund_reasons = []
+        self._reason_pos = {}
+
+    def register_reasons(self, reasons: List) -> np.ndarray:
+        """Đánh index toàn cục cho các lý do refund gốc (giữ nguyên giữa các chunk)"""
+        indices = np.empty(len(reasons), dtype=np.int64)
+        for pos, reason in enumerate(reasons):
+            index = self._reason_pos.get(reason)
+            if index is None:
+                index = self._reason_pos[reason] = len(self.refund_reasons)
+                self.refund_reasons.append(reason)
+            indices[pos] = index
+        return indices
+
+    def item_index(self, item_ids) -> np.ndarray:
+        """Vị trí của các item_id trong dimension items (-1 nếu không có)"""
+        return np.array([self._item_pos.get(item_id, -1) for item_id in np.asarray(item_ids).tolist()], dtype=np.int64)
+
+    def lines_chunk(self, rows: List[Tuple]) -> 'SalesFact':
+        """
+        Tạo fact table cho một chunk order lines, dùng chung dimension với fact gốc
+        rows: (order_id, order_date, status, refund_reason, item_id, quantity, price_per_unit)
+        """
+        order_ids, order_dates, statuses, reasons, item_ids, quantities, prices = zip(*rows)
+        is_refund = np.array(statuses, dtype=object) == 'refunded'
+        refund_reasons = [reason for reason, refund in zip(reasons, is_refund) if refund]
+        reason_idx = np.full(len(rows), -1, dtype=np.int64)
+        reason_idx[is_refund] = np.arange(len(refund_reasons))
+        return self.columns_chunk(np.array(order_ids, dtype=np.int64), np.array(order_dates, dtype='datetime64[us]'),
+                                  is_refund, reason_idx, refund_reasons, np.array(item_ids, dtype=np.int64),
+                                  np.array(quantities, dtype=np.int64), to_minor_array(prices))
+
+    def columns_chunk(self, order_id: np.ndarray, order_date: np.ndarray, is_refund: np.ndarray,
+                      reason_idx: np.ndarray, reasons: List, item_id: np.ndarray, quantity: np.ndarray,
+                      price_per_unit: np.ndarray) -> 'SalesFact':
+        """
+        Tạo fact table cho một chunk order lines ở dạng cột
+        reason_idx: vị trí lý do refund gốc của dòng trong `reasons` (chỉ xét với dòng refund)
+        price_per_unit: đơn giá theo đơn vị tiền nhỏ nhất (int64)
+        """
+        chunk = copy.copy(self)
+
+        # order_items.item_id có FK tới items nên item không tồn tại chỉ xảy ra khi dữ liệu lỗi
+        item_idx = self.item_index(item_id)
+        known = item_idx >= 0
+
+        chunk.order_id = np.asarray(order_id, dtype=np.int64)[known]
+        chunk.order_date = np.asarray(order_date, dtype='datetime64[us]')[known]
+        chunk.is_refund = np.asarray(is_refund, dtype=bool)[known]
+        chunk.item_idx = item_idx[known]
+        chunk.quantity = np.asarray(quantity, dtype=np.int64)[known]
+        chunk.price_per_unit = np.asarray(price_per_unit, dtype=np.int64)[known]
+        chunk.reason_idx = np.zeros(len(chunk.item_idx), dtype=np.int64)
+        if len(reasons):
+            chunk.reason_idx[chunk.is_refund] = self.register_reasons(reasons)[np.asarray(reason_idx)[known][chunk.is_refund]]
+
+        chunk._finalize()
+        return chunk
+
+    def _finalize(self):
+        """Sắp xếp theo ngày và tính các cột dẫn xuất (tiền tính bằng số nguyên đơn vị nhỏ nhất)"""
+        line_sort = np.argsort(self.order_date, kind='stable')
+        for column in ('order_id', 'order_date', 'is_refund', 'item_idx', 'quantity', 'price_per_unit', 'reason_idx'):
+            setattr(self, column, getattr(self, column)[line_sort])
+
+        # Index -1 trỏ vào phần tử sentinel -1 ở cuối mảng
+        self.item_id = self.item_ids[self.item_idx]
+        self.brand_id = np.append(self.brand_ids, -1)[self.item_brand_idx[self.item_idx]]
+        self.category_id = np.append(self.category_ids, -1)[self.item_category_idx[self.item_idx]]
+        self.cost_price = self.item_cost_price[self.item_idx]
+        self.revenue = self.price_per_unit * self.quantity
+        self.profit = (self.price_per_unit - self.cost_price) * self.quantity
+
+    def __len__(self):
+        return len(getattr(self, 'order_date', ()))
+
+    @property
+    def n_items(self) -> int:
+        return len(self.item_ids)
+
+    def group_totals(self, item_totals: Dict[str, np.ndarray], group_idx: np.ndarray, n_groups: int) -> Dict[str, np.ndarray]:
+        """Gộp tổng theo item thành tổng theo nhóm (brand/category) dựa trên group_idx của từng item"""
+        has_group = group_idx >= 0
+        groups = group_idx[has_group]
+        totals = {}
+        for column, values in item_totals.items():
+            totals[column] = sum_by_index(groups, values[has_group], n_groups)
+        return totals
+
+
+def sum_by_index(index: np.ndarray, values: np.ndarray, size: int) -> np.ndarray:
+    """Tổng values theo index (0..size-1); cột số nguyên cộng bằng int64 để tổng tiền luôn chính xác"""
+    if values.dtype.kind in 'iub':
+        summed = np.zeros(size, dtype=np.int64)
+        np.add.at(summed, index, values.astype(np.int64, copy=False))
+        return summed
+    return np.bincount(index, weights=values, minlength=size)
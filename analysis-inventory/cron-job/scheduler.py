@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Analysis Job Scheduler
+Chạy các nhóm phân tích như các job độc lập trong cùng một process, mỗi job một chu kỳ riêng
+(vd cảnh báo tồn kho mỗi giờ, xếp hạng mỗi ngày, dự đoán doanh thu mỗi tuần) thay cho một lần chạy
+toàn bộ mỗi đêm
+- depends_on: job chỉ bắt đầu khi các job phụ thuộc đã chạy thành công và không còn đến hạn / đang chạy
+- giới hạn số job chạy đồng thời, một job không bao giờ chạy chồng lên lần chạy trước của chính nó
+- job exclusive (load_data) chỉ chạy khi không có job nào khác đang chạy và chặn các job khác trong lúc chạy
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence
+
+from analysis import ANALYSIS_GROUPS, AnalyticsDataEngine
+from stage_runner import StageRunner
+
+# Chu kỳ mặc định (phút) của các job, ghi đè bằng ANALYTICS_JOB_INTERVALS="low_stock=30,rankings=720"
+DEFAULT_JOB_INTERVALS = {
+    'load_data': 60,
+    'low_stock': 60,
+    'daily_sales': 60 * 24,
+    'slow_moving': 60 * 24,
+    'rankings': 60 * 24,
+    'revenue_prediction': 60 * 24 * 7,
+}
+
+
+class Job:
+    """Một job có tên, chu kỳ chạy, các job phụ thuộc và trạng thái của lần chạy gần nhất"""
+
+    def __init__(self, name: str, interval: timedelta, run: Callable[[], object],
+                 depends_on: Sequence[str] = (), exclusive: bool = False):
+        if interval <= timedelta(0):
+            raise ValueError(f"Chu kỳ của job {name} phải lớn hơn 0: {interval}")
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.depends_on = tuple(depends_on)
+        self.exclusive = exclusive
+        self.running = False
+        self.last_started: Optional[datetime] = None
+        self.last_succeeded: Optional[datetime] = None
+        self.last_error: Optional[Exception] = None
+        self.runs = 0
+
+    def is_due(self, now: datetime) -> bool:
+        """Đến hạn chạy: chưa chạy lần nào hoặc đã qua một chu kỳ kể từ lần bắt đầu trước"""
+        return self.last_started is None or now - self.last_started >= self.interval
+
+
+class JobScheduler:
+    """Lập lịch và chạy các job trên một thread pool giới hạn số job đồng thời"""
+
+    def __init__(self, jobs: List[Job], max_concurrent: int = 2, tick_seconds: float = 30,
+                 logger: logging.Logger = None):
+        if max_concurrent <= 0:
+            raise ValueError(f"Số job chạy đồng thời phải lớn hơn 0: {max_concurrent}")
+        self.jobs = self._ordered(jobs)
+        self.max_concurrent = max_concurrent
+        self.tick_seconds = tick_seconds
+        self.logger = logger or logging.getLogger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='analysis-job')
+        # Bảo vệ trạng thái các job; được notify mỗi khi một job kết thúc để lập lịch lại ngay
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    @staticmethod
+    def _ordered(jobs: List[Job]) -> Dict[str, Job]:
+        """Các job theo thứ tự topo của depends_on (kiểm tra tên trùng, phụ thuộc không tồn tại và vòng lặp)"""
+        by_name = {}
+        for job in jobs:
+            if job.name in by_name:
+                raise ValueError(f"Trùng tên job: {job.name}")
+            by_name[job.name] = job
+        for job in jobs:
+            missing = [name for name in job.depends_on if name not in by_name]
+            if missing:
+                raise ValueError(f"Job {job.name} phụ thuộc vào job không tồn tại: {', '.join(missing)}")
+
+        ordered, visiting = {}, set()
+
+        def visit(job: Job):
+            if job.name in ordered:
+                return
+            if job.name in visiting:
+                raise ValueError(f"Phụ thuộc vòng giữa các job tại: {job.name}")
+            visiting.add(job.name)
+            for name in job.depends_on:
+                visit(by_name[name])
+            visiting.discard(job.name)
+            ordered[job.name] = job
+
+        for job in jobs:
+            visit(job)
+        return ordered
+
+    def _can_start(self, job: Job, now: datetime, running: int) -> bool:
+        if job.running or not job.is_due(now) or running >= self.max_concurrent:
+            return False
+        if job.exclusive and running:
+            return False
+        for name in job.depends_on:
+            dependency = self.jobs[name]
+            # Chờ phụ thuộc chạy xong (kể cả lần đang đến hạn) để job dùng kết quả mới nhất
+            if dependency.running or dependency.last_succeeded is None or dependency.is_due(now):
+                return False
+        return True
+
+    def run_pending(self, now: datetime = None) -> List[str]:
+        """Một lượt lập lịch: khởi chạy các job đến hạn đủ điều kiện, trả về tên các job được khởi chạy"""
+        now = now or datetime.now()
+        started = []
+        with self._condition:
+            running = sum(job.running for job in self.jobs.values())
+            if any(job.running and job.exclusive for job in self.jobs.values()):
+                return started
+            for job in self.jobs.values():
+                if not self._can_start(job, now, running):
+                    continue
+                job.running = True
+                job.last_started = now
+                running += 1
+                started.append(job.name)
+                self._executor.submit(self._execute, job)
+                if job.exclusive:
+                    break
+        return started
+
+    def _execute(self, job: Job):
+        self.logger.info(f"Bắt đầu job {job.name}")
+        print(f"▶️ Job {job.name} bắt đầu lúc {datetime.now():%Y-%m-%d %H:%M:%S}")
+        started = time.perf_counter()
+        error = None
+        try:
+            job.run()
+        except Exception as e:
+            error = e
+            self.logger.error(f"Lỗi khi chạy job {job.name}: {e}")
+        elapsed = time.perf_counter() - started
+
+        with self._condition:
+            job.running = False
+            job.runs += 1
+            job.last_error = error
+            if error is None:
+                job.last_succeeded = datetime.now()
+            self._condition.notify_all()
+        if error is None:
+            print(f"✅ Job {job.name} hoàn thành trong {elapsed:.2f}s")
+        else:
+            print(f"❌ Job {job.name} lỗi sau {elapsed:.2f}s: {error}")
+
+    def run_forever(self):
+        """Lập lịch liên tục cho đến khi stop() được gọi"""
+        self.logger.info(f"Scheduler chạy {len(self.jobs)} job, tối đa {self.max_concurrent} job đồng thời")
+        while True:
+            with self._condition:
+                if self._stopped:
+                    break
+            self.run_pending()
+            with self._condition:
+                if not self._stopped:
+                    self._condition.wait(timeout=self.tick_seconds)
+
+    def stop(self, wait: bool = True):
+        """Dừng lập lịch; các job đang chạy được chạy nốt"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._executor.shutdown(wait=wait)
+
+
+def parse_job_intervals(value: str) -> Dict[str, timedelta]:
+    """Chu kỳ các job từ chuỗi "tên=phút,tên=phút" (các job không nêu dùng DEFAULT_JOB_INTERVALS)"""
+    minutes = dict(DEFAULT_JOB_INTERVALS)
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        name, _, amount = entry.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_JOB_INTERVALS:
+            raise ValueError(f"Job không hợp lệ trong ANALYTICS_JOB_INTERVALS: {name}. "
+                             f"Chỉ hỗ trợ: {', '.join(DEFAULT_JOB_INTERVALS)}")
+        try:
+            minutes[name] = int(amount)
+        except ValueError:
+            raise ValueError(f"Chu kỳ (phút) không hợp lệ của job {name}: {amount}")
+    return {name: timedelta(minutes=value) for name, value in minutes.items()}
+
+
+def build_analysis_jobs(engine, intervals: Dict[str, timedelta] = None, runner: StageRunner = None) -> List[Job]:
+    """
+    Các job phân tích trên một AnalyticsDataEngine đã load dữ liệu: load_data chuyển mốc phân tích sang
+    thời điểm hiện tại và đọc lại dữ liệu nguồn, mỗi nhóm phân tích (ANALYSIS_GROUPS) là một job phụ thuộc vào load_data
+    """
+    intervals = intervals or parse_job_intervals('')
+    # Các job đã chạy song song với nhau nên mặc định mỗi job chạy các bước của nó tuần tự
+    runner = runner or StageRunner('off', logger=engine.logger)
+    jobs = [Job('load_data', intervals['load_data'], engine.refresh_data, exclusive=True)]
+    for group in ANALYSIS_GROUPS:
+        jobs.append(Job(group, intervals[group],
+                        lambda group=group: engine.run_analysis_group(group, runner),
+                        depends_on=('load_data',)))
+    return jobs
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    intervals = parse_job_intervals(os.getenv('ANALYTICS_JOB_INTERVALS', ''))
+    max_concurrent = int(os.getenv('ANALYTICS_JOB_CONCURRENCY', '2'))
+    tick_seconds = float(os.getenv('ANALYTICS_SCHEDULER_TICK', '30'))
+
+    # Mốc phân tích là thời điểm hiện tại, mỗi lần load_data chạy lại được chuyển sang thời điểm mới
+    engine = AnalyticsDataEngine(today=datetime.now())
+    jobs = build_analysis_jobs(engine, intervals)
+    # Dữ liệu vừa được load khi khởi tạo engine nên lần load_data đầu tiên được bỏ qua
+    jobs[0].last_started = jobs[0].last_succeeded = datetime.now()
+
+    scheduler = JobScheduler(jobs, max_concurrent, tick_seconds)
+    print(f"⏰ Scheduler: {', '.join(f'{job.name} mỗi {job.interval}' for job in jobs)} "
+          f"(tối đa {max_concurrent} job đồng thời)")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Dừng scheduler, chờ các job đang chạy...")
+        scheduler.stop()
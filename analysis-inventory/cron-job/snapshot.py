@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Source Table Snapshot Cache
+Lưu snapshot các bảng nguồn ra đĩa, chỉ đọc lại từ database khi số dòng / updated_at của bảng thay đổi
+"""
+
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import select, func
+
+# Tăng khi cách lưu snapshot thay đổi để các snapshot cũ được làm mới
+SNAPSHOT_FORMAT = 3
+
+
+class SnapshotCache:
+    """
+    Mỗi snapshot là một thư mục gồm meta.json (signature của bảng nguồn) và dữ liệu:
+    - bảng lớn (order lines, orders): mỗi cột một file .npy, đọc lại bằng memory-map
+    - bảng dimension nhỏ (items, brands, categories, batches): records.json (dựng lại thành record)
+    """
+
+    def __init__(self, directory: str, engine, logger: logging.Logger = None):
+        self.directory = directory
+        self.engine = engine
+        self.logger = logger or logging.getLogger(__name__)
+        os.makedirs(directory, exist_ok=True)
+
+    def table_signature(self, model) -> List:
+        """Số dòng, id lớn nhất và updated_at lớn nhất (hoặc tổng số lượng nếu bảng không có updated_at)"""
+        table = model.__table__
+        columns = [func.count(), func.max(table.c.id)]
+        if 'updated_at' in table.c:
+            columns.append(func.max(table.c.updated_at))
+        else:
+            columns += [func.sum(table.c[name]) for name in ('total_quantity', 'remain_quantity') if name in table.c]
+        with self.engine.connect() as connection:
+            row = connection.execute(select(*columns)).one()
+        return [value.isoformat() if isinstance(value, datetime) else
+                str(value) if isinstance(value, Decimal) else value for value in row]
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _read_meta(self, name: str, signature: List):
+        """meta.json của snapshot nếu signature còn khớp, ngược lại None"""
+        try:
+            with open(os.path.join(self._path(name), 'meta.json'), encoding='utf-8') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta.get('format') != SNAPSHOT_FORMAT or meta.get('signature') != signature:
+            return None
+        return meta
+
+    def _write(self, name: str, meta: Dict, write_data: Callable[[str], None]):
+        """Ghi snapshot vào thư mục tạm rồi thay thế thư mục cũ"""
+        path, tmp_path = self._path(name), self._path(f'{name}.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        write_data(tmp_path)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as meta_file:
+            json.dump({**meta, 'format': SNAPSHOT_FORMAT}, meta_file, ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def load_columns(self, name: str, signature: List,
+                     build: Callable[[], Tuple[Dict[str, np.ndarray], Dict]]) -> Tuple[Dict[str, np.ndarray], Dict]:
+        """
+        Các cột (mảng NumPy memory-map) và thông tin kèm theo (extra) của snapshot `name`
+        build: đọc lại từ database, trả về ({cột: mảng}, extra có thể ghi ra JSON)
+        """
+        meta = self._read_meta(name, signature)
+        if meta is not None:
+            path = self._path(name)
+            columns = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r', allow_pickle=False)
+                       for column in meta['columns']}
+            self.logger.info(f"Snapshot {name}: dùng lại bản trên đĩa ({meta['rows']} dòng)")
+            return columns, meta['extra']
+
+        columns, extra = build()
+        rows = len(next(iter(columns.values()))) if columns else 0
+
+        def write_data(path):
+            for column, values in columns.items():
+                np.save(os.path.join(path, f'{column}.npy'), values, allow_pickle=False)
+
+        self._write(name, {'signature': signature, 'columns': list(columns), 'rows': rows, 'extra': extra}, write_data)
+        self.logger.info(f"Snapshot {name}: đã làm mới từ database ({rows} dòng)")
+        return columns, extra
+
+    def load_records(self, model, record_cls, signature: List, query: Callable[[], List]) -> List:
+        """Các record (NamedTuple) của bảng dimension; snapshot lưu dạng JSON"""
+        name = model.__tablename__
+        date_fields = {field for field, field_type in record_cls.__annotations__.items() if field_type is date}
+        meta = self._read_meta(name, signature)
+        if meta is not None:
+            with open(os.path.join(self._path(name), 'records.json'), encoding='utf-8') as records_file:
+                rows = json.load(records_file)
+            self.logger.info(f"Snapshot {name}: dùng lại bản trên đĩa ({len(rows)} dòng)")
+            return [record_cls._make(date.fromisoformat(value) if field in date_fields and value else value
+                                     for field, value in zip(record_cls._fields, row)) for row in rows]
+
+        records = query()
+        rows = [[value.isoformat() if isinstance(value, date) else value for value in record] for record in records]
+
+        def write_data(path):
+            with open(os.path.join(path, 'records.json'), 'w', encoding='utf-8') as records_file:
+                json.dump(rows, records_file, ensure_ascii=False)
+
+        self._write(name, {'signature': signature, 'rows': len(rows)}, write_data)
+        self.logger.info(f"Snapshot {name}: đã làm mới từ database ({len(rows)} dòng)")
+        return records
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+SQL Pushdown Backend
+Thực hiện các phép tổng hợp bằng GROUP BY ngay trong database, chỉ trả về kết quả đã gộp
+"""
+
+import pandas as pd
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, case, and_, desc, asc
+
+from money import Money, to_minor
+from package.models.models import Item, Batch, Order, OrderItem, ItemDailySales
+
+
+class SqlAnalyticsBackend:
+    """Các truy vấn tổng hợp chạy trong MySQL thay cho việc load toàn bộ orders vào memory"""
+
+    def __init__(self, engine, use_rollup: bool = False):
+        """use_rollup: tổng bán hàng đọc từ bảng item_daily_sales thay vì order_items (cửa sổ theo ngày)"""
+        self.engine = engine
+        self.use_rollup = use_rollup
+        self._item_id = ItemDailySales.item_id if use_rollup else OrderItem.item_id
+
+    def _execute(self, statement) -> List:
+        with self.engine.connect() as connection:
+            return connection.execute(statement).all()
+
+    @staticmethod
+    def _date_filter(start: datetime, end: Optional[datetime]) -> list:
+        """Điều kiện start <= order_date <= end (bỏ cận dưới với datetime.min, bỏ cận trên khi end=None)"""
+        conditions = []
+        if start != datetime.min:
+            conditions.append(Order.order_date >= start)
+        if end is not None:
+            conditions.append(Order.order_date <= end)
+        return conditions
+
+    @staticmethod
+    def _day_filter(column, start: datetime, end: Optional[datetime], as_datetime: bool = False) -> list:
+        """Điều kiện theo ngày (dùng với rollup): lấy các ngày có mốc 00:00 nằm trong [start, end)"""
+        def first_day_at_or_after(value: datetime):
+            day = value.date() if value.time() == datetime.min.time() else value.date() + timedelta(days=1)
+            return datetime.combine(day, datetime.min.time()) if as_datetime else day
+        
+        conditions = []
+        if start != datetime.min:
+            conditions.append(column >= first_day_at_or_after(start))
+        if end is not None:
+            conditions.append(column < first_day_at_or_after(end))
+        return conditions
+
+    def _sales_filter(self, start: datetime, end: Optional[datetime]) -> list:
+        """Điều kiện khoảng thời gian cho các truy vấn tổng bán hàng"""
+        if self.use_rollup:
+            return self._day_filter(ItemDailySales.sale_date, start, end)
+        return self._date_filter(start, end)
+
+    def _order_filter(self, start: datetime, end: Optional[datetime]) -> list:
+        """Điều kiện khoảng thời gian trên orders, cùng cách chia ngày với tổng bán hàng"""
+        if self.use_rollup:
+            return self._day_filter(Order.order_date, start, end, as_datetime=True)
+        return self._date_filter(start, end)
+
+    def _sales_columns(self):
+        """Các cột tổng bán hàng: số lượng, doanh thu, lợi nhuận (theo giá vốn hiện tại)"""
+        if self.use_rollup:
+            return (
+                func.sum(ItemDailySales.quantity).label('quantity'),
+                func.sum(ItemDailySales.revenue).label('revenue'),
+                func.sum(ItemDailySales.revenue - ItemDailySales.quantity * Item.cost_price).label('profit'),
+            )
+        return (
+            func.sum(OrderItem.quantity).label('quantity'),
+            func.sum(OrderItem.quantity * OrderItem.price_per_unit).label('revenue'),
+            func.sum(OrderItem.quantity * (OrderItem.price_per_unit - Item.cost_price)).label('profit'),
+        )
+
+    def _valid_sales(self, *columns):
+        """SELECT từ order lines hợp lệ (không refund) kèm thông tin item"""
+        if self.use_rollup:
+            # Dòng rollup chỉ có refund (quantity = 0) không tính là có bán hàng
+            return (select(*columns)
+                    .select_from(ItemDailySales)
+                    .join(Item, Item.id == ItemDailySales.item_id)
+                    .where(ItemDailySales.quantity > 0))
+        return (select(*columns)
+                .select_from(OrderItem)
+                .join(Order, Order.id == OrderItem.order_id)
+                .join(Item, Item.id == OrderItem.item_id)
+                .where(Order.status != 'refunded'))
+
+    def daily_sales(self, start: datetime, end: datetime) -> Tuple[int, int, Money, Money]:
+        """Số đơn hợp lệ, số đơn refund, doanh thu và lợi nhuận (đơn vị tiền nhỏ nhất) trong khoảng thời gian"""
+        is_refund = case((Order.status == 'refunded', 1), else_=0)
+        order_rows = self._execute(
+            select(is_refund.label('is_refund'), func.count(Order.id))
+            .where(and_(*self._order_filter(start, end)))
+            .group_by(is_refund)
+        )
+        counts = {int(flag): int(count) for flag, count in order_rows}
+
+        _, revenue, profit = self._execute(
+            self._valid_sales(*self._sales_columns()).where(*self._sales_filter(start, end))
+        )[0]
+        return counts.get(0, 0), counts.get(1, 0), to_minor(revenue), to_minor(profit)
+
+    def top_items(self, start: datetime, end: datetime, sort_column: str, limit: int) -> List:
+        """Top items theo sort_column (quantity/revenue/profit), hòa thì theo item_id: (item_id, quantity, revenue, profit)"""
+        quantity, revenue, profit = self._sales_columns()
+        metric = {'quantity': quantity, 'revenue': revenue, 'profit': profit}[sort_column]
+        return self._money_rows(self._execute(
+            self._valid_sales(self._item_id, quantity, revenue, profit)
+            .where(*self._sales_filter(start, end))
+            .group_by(self._item_id)
+            .order_by(desc(metric), asc(self._item_id))
+            .limit(limit)
+        ))
+
+    def top_groups(self, group: str, start: datetime, end: datetime, sort_column: str, limit: int) -> List:
+        """Top category/brand theo sort_column (quantity/revenue), hòa thì theo id nhóm: (group_id, quantity, revenue, profit)"""
+        group_column = Item.category_id if group == 'category' else Item.brand_id
+        quantity, revenue, profit = self._sales_columns()
+        metric = {'quantity': quantity, 'revenue': revenue}[sort_column]
+        return self._money_rows(self._execute(
+            self._valid_sales(group_column.label('group_id'), quantity, revenue, profit)
+            .where(group_column.isnot(None), *self._sales_filter(start, end))
+            .group_by(group_column)
+            .order_by(desc(metric), asc(group_column))
+            .limit(limit)
+        ))
+
+    @staticmethod
+    def _money_rows(rows: List) -> List[Tuple]:
+        """Đổi revenue, profit của các dòng (key, quantity, revenue, profit) sang đơn vị tiền nhỏ nhất"""
+        return [(key, int(quantity), to_minor(revenue), to_minor(profit)) for key, quantity, revenue, profit in rows]
+
+    def refund_reasons(self) -> List[Optional[str]]:
+        """Các lý do refund gốc (distinct) của toàn bộ đơn refund"""
+        rows = self._execute(select(Order.refund_reason).where(Order.status == 'refunded').distinct())
+        return [reason for reason, in rows]
+
+    def refund_totals(self, start: datetime, end: datetime) -> List:
+        """Số dòng refund và số lượng refund theo (item_id, lý do gốc) trong khoảng thời gian"""
+        return self._execute(
+            select(OrderItem.item_id, Order.refund_reason,
+                   func.count(OrderItem.id).label('refund_count'),
+                   func.sum(OrderItem.quantity).label('refund_quantity'))
+            .select_from(OrderItem)
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(Order.status == 'refunded', *self._order_filter(start, end))
+            .group_by(OrderItem.item_id, Order.refund_reason)
+        )
+
+    def item_quantities(self, start: datetime, end: Optional[datetime]) -> Dict[int, int]:
+        """Tổng số lượng bán hợp lệ theo item_id trong khoảng thời gian"""
+        quantity, _, _ = self._sales_columns()
+        rows = self._execute(
+            self._valid_sales(self._item_id, quantity)
+            .where(*self._sales_filter(start, end))
+            .group_by(self._item_id)
+        )
+        return {item_id: int(quantity) for item_id, quantity in rows}
+
+    def lifetime_sales(self) -> Dict[int, Tuple[int, Money, Money]]:
+        """Tổng số lượng, doanh thu, lợi nhuận (đơn vị tiền nhỏ nhất) hợp lệ toàn thời gian theo item_id"""
+        rows = self._execute(
+            self._valid_sales(self._item_id, *self._sales_columns()).group_by(self._item_id)
+        )
+        return {item_id: (int(quantity), to_minor(revenue), to_minor(profit)) for item_id, quantity, revenue, profit in rows}
+
+    def oldest_live_batches(self) -> Dict[str, object]:
+        """Ngày nhập lô hàng cũ nhất còn tồn kho theo sku"""
+        rows = self._execute(
+            select(Batch.sku, func.min(Batch.import_date))
+            .where(Batch.remain_quantity > 0)
+            .group_by(Batch.sku)
+        )
+        return dict(rows)
+
+    def daily_revenue(self, last_day: date) -> pd.DataFrame:
+        """Doanh thu hợp lệ theo ngày đến hết ngày last_day (cột date, revenue), sắp xếp theo ngày"""
+        day = ItemDailySales.sale_date if self.use_rollup else func.date(Order.order_date)
+        if self.use_rollup:
+            until = ItemDailySales.sale_date <= last_day
+        else:
+            until = Order.order_date < datetime.combine(last_day + timedelta(days=1), datetime.min.time())
+        _, revenue, _ = self._sales_columns()
+        rows = self._execute(
+            self._valid_sales(day.label('date'), revenue)
+            .where(until)
+            .group_by(day)
+            .order_by(day)
+        )
+        daily_revenue = pd.DataFrame(rows, columns=['date', 'revenue'])
+        daily_revenue['date'] = pd.to_datetime(daily_revenue['date'])
+        daily_revenue['revenue'] = daily_revenue['revenue'].astype(float)
+        return daily_revenue
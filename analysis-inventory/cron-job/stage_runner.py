@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Stage Runner
+Chạy các bước phân tích độc lập tuần tự hoặc song song (thread/process pool) và đo thời gian từng bước
+"""
+
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+# off: tuần tự, thread: ThreadPoolExecutor, process: ProcessPoolExecutor (fork, dùng chung dữ liệu đã load)
+PARALLEL_MODES = ('off', 'thread', 'process')
+
+# Một bước phân tích: (key, tên method của engine, tham số)
+Stage = Tuple[Any, str, tuple]
+
+# Engine dùng trong các process con (được kế thừa khi fork, chỉ đọc)
+_worker_engine = None
+
+
+def _run_stage(engine, stage: Stage) -> Tuple[Any, Any, float]:
+    """Chạy một bước, trả về (key, kết quả hoặc exception, số giây)"""
+    key, method_name, args = stage
+    started = time.perf_counter()
+    try:
+        result = getattr(engine, method_name)(*args)
+    except Exception as e:
+        result = e
+    return key, result, time.perf_counter() - started
+
+
+def _init_process_worker():
+    # Không dùng lại các kết nối database của process cha sau khi fork
+    _worker_engine.engine.dispose(close=False)
+
+
+def _run_stage_in_process(stage: Stage) -> Tuple[Any, Any, float]:
+    return _run_stage(_worker_engine, stage)
+
+
+class StageRunner:
+    """Thực thi danh sách các bước phân tích với chế độ song song được cấu hình"""
+
+    def __init__(self, mode: str = 'off', workers: int = None, logger: logging.Logger = None):
+        self.mode = (mode or 'off').strip().lower()
+        if self.mode not in PARALLEL_MODES:
+            raise ValueError(f"Parallel mode không hợp lệ: {self.mode}. Chỉ hỗ trợ: {', '.join(PARALLEL_MODES)}")
+        self.workers = workers or os.cpu_count() or 1
+        self.logger = logger or logging.getLogger(__name__)
+
+        if self.mode == 'process' and 'fork' not in multiprocessing.get_all_start_methods():
+            self.logger.warning("Hệ điều hành không hỗ trợ fork, chuyển sang chế độ thread")
+            self.mode = 'thread'
+
+    @classmethod
+    def from_env(cls, logger: logging.Logger = None) -> 'StageRunner':
+        """Tạo runner từ ANALYTICS_PARALLEL_MODE và ANALYTICS_WORKERS"""
+        workers = os.getenv('ANALYTICS_WORKERS')
+        return cls(os.getenv('ANALYTICS_PARALLEL_MODE', 'off'), int(workers) if workers else None, logger)
+
+    def run(self, engine, stages: List[Stage]) -> Tuple[Dict[Any, Any], Dict[Any, float], float]:
+        """Chạy tất cả các bước. Trả về ({key: kết quả}, {key: số giây}, tổng thời gian thực)"""
+        global _worker_engine
+        started = time.perf_counter()
+
+        if self.mode == 'off' or self.workers <= 1:
+            outcomes = [_run_stage(engine, stage) for stage in stages]
+        elif self.mode == 'thread':
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                outcomes = list(executor.map(lambda stage: _run_stage(engine, stage), stages))
+        else:
+            _worker_engine = engine
+            try:
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('fork'),
+                                         initializer=_init_process_worker) as executor:
+                    outcomes = list(executor.map(_run_stage_in_process, stages))
+            finally:
+                _worker_engine = None
+
+        wall_time = time.perf_counter() - started
+        results = {key: result for key, result, _ in outcomes}
+        timings = {key: elapsed for key, _, elapsed in outcomes}
+        return results, timings, wall_time
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Summary Writer
+Gom các dòng kết quả theo bảng summary và ghi hàng loạt, mỗi bảng một transaction
+Chỉ ghi phần thay đổi so với dữ liệu đang có nên chạy lại với kết quả giống hệt gần như không tốn ghi
+"""
+
+import logging
+import time
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, NamedTuple, Tuple
+from sqlalchemy import Boolean, Integer, Numeric, and_, bindparam, delete, insert, select, tuple_, update
+
+
+class TableWriteStats(NamedTuple):
+    """Kết quả ghi một bảng: số dòng mới, số dòng được thêm/cập nhật/xóa và thời gian"""
+    rows: int
+    inserted: int
+    updated: int
+    deleted: int
+    seconds: float
+
+    @property
+    def unchanged(self) -> int:
+        return self.rows - self.inserted - self.updated
+
+
+class SummaryWriter:
+    """
+    Ghi hàng loạt vào các bảng summary: đọc các dòng hiện có của các lát dữ liệu bị thay thế,
+    so sánh theo primary key rồi chỉ INSERT dòng mới, UPDATE dòng khác giá trị và DELETE dòng không còn
+    """
+
+    def __init__(self, engine, logger: logging.Logger = None):
+        self.engine = engine
+        self.logger = logger or logging.getLogger(__name__)
+        # {model: ([lát dữ liệu bị ghi đè], [dòng mới])}
+        self._pending = defaultdict(lambda: ([], []))
+
+    def add(self, model, slice_values: Dict, rows: List[Dict]):
+        """
+        Thêm các dòng mới cho một lát dữ liệu của bảng
+        slice_values: giá trị các cột xác định lát bị thay thế, vd {'analysis_date': ..., 'sort_type': ...}
+        """
+        slices, pending_rows = self._pending[model]
+        slices.append(slice_values)
+        pending_rows.extend(rows)
+
+    def flush(self) -> Dict[str, TableWriteStats]:
+        """Ghi phần thay đổi của toàn bộ dòng đang chờ, commit một lần cho mỗi bảng. Trả về {tên bảng: thống kê}"""
+        stats = {}
+        pending, self._pending = self._pending, defaultdict(lambda: ([], []))
+        for model, (slices, rows) in pending.items():
+            table = model.__table__
+            self._check_unique_keys(table, rows)
+            started = time.perf_counter()
+            with self.engine.begin() as connection:
+                inserted, updated, deleted = self._write_diff(connection, table, slices, rows)
+            table_stats = TableWriteStats(len(rows), len(inserted), len(updated), len(deleted),
+                                          time.perf_counter() - started)
+            stats[table.name] = table_stats
+            self.logger.info(f"Đã ghi {table.name}: {table_stats.rows} dòng, thêm {table_stats.inserted}, "
+                             f"cập nhật {table_stats.updated}, xóa {table_stats.deleted}, "
+                             f"giữ nguyên {table_stats.unchanged} trong {table_stats.seconds:.3f}s")
+        return stats
+
+    @staticmethod
+    def rows_per_second(rows: int, seconds: float) -> float:
+        return rows / seconds if seconds > 0 else 0
+
+    def _write_diff(self, connection, table, slices: List[Dict], rows: List[Dict]) -> Tuple[List, List, List]:
+        """So sánh với các dòng hiện có của các lát dữ liệu và ghi phần khác biệt. Trả về (thêm, cập nhật, xóa)"""
+        key_columns = [column.name for column in table.primary_key.columns]
+        value_columns = sorted({name for row in rows for name in row} - set(key_columns))
+
+        existing = {}
+        for row in connection.execute(select(*[table.c[name] for name in key_columns + value_columns])
+                                      .where(self._slice_filter(table, slices))).mappings():
+            existing[self._key(table, key_columns, row)] = row
+
+        inserted, updated = [], []
+        for row in rows:
+            current = existing.pop(self._key(table, key_columns, row), None)
+            if current is None:
+                inserted.append(row)
+            elif any(self._normalize(table.c[name], row.get(name)) != self._normalize(table.c[name], current[name])
+                     for name in value_columns):
+                updated.append(row)
+        # Các dòng còn lại của lát dữ liệu không còn trong kết quả mới
+        deleted = list(existing)
+
+        if deleted:
+            connection.execute(delete(table).where(self._key_filter(table, key_columns, deleted)))
+        if updated:
+            # Cột SET lấy từ các key trùng tên cột của tham số, primary key truyền qua key_<cột>
+            statement = update(table).where(and_(*[table.c[name] == bindparam(f'key_{name}') for name in key_columns]))
+            connection.execute(statement, [{**{f'key_{name}': row[name] for name in key_columns},
+                                            **{name: row.get(name) for name in value_columns}} for row in updated])
+        if inserted:
+            connection.execute(insert(table), inserted)
+        return inserted, updated, deleted
+
+    @classmethod
+    def _key(cls, table, key_columns: List[str], row) -> Tuple:
+        return tuple(cls._normalize(table.c[name], row[name]) for name in key_columns)
+
+    @staticmethod
+    def _normalize(column, value):
+        """Giá trị ở dạng database sẽ lưu (vd Decimal làm tròn theo scale của cột) để so sánh"""
+        if value is None:
+            return None
+        if isinstance(column.type, Numeric) and column.type.scale is not None:
+            value = value if isinstance(value, Decimal) else Decimal(str(value))
+            return value.quantize(Decimal(1).scaleb(-column.type.scale), rounding=ROUND_HALF_UP)
+        if isinstance(column.type, Boolean):
+            return bool(value)
+        if isinstance(column.type, Integer):
+            return int(value)
+        return value
+
+    @staticmethod
+    def _slice_filter(table, slices: List[Dict]):
+        """Điều kiện chọn tất cả các lát dữ liệu (các lát cùng tập cột)"""
+        columns = list(slices[0].keys())
+        if len(columns) == 1:
+            return table.c[columns[0]].in_({values[columns[0]] for values in slices})
+        return tuple_(*[table.c[column] for column in columns]).in_(
+            {tuple(values[column] for column in columns) for values in slices}
+        )
+
+    @staticmethod
+    def _key_filter(table, key_columns: List[str], keys: List[Tuple]):
+        """Điều kiện chọn các dòng theo primary key"""
+        if len(key_columns) == 1:
+            return table.c[key_columns[0]].in_([key[0] for key in keys])
+        return tuple_(*[table.c[name] for name in key_columns]).in_(keys)
+
+    @staticmethod
+    def _check_unique_keys(table, rows: List[Dict]):
+        """Các dòng mới phải có primary key khác nhau, trùng key là lỗi của dữ liệu hoặc của primary key"""
+        key_columns = [column.name for column in table.primary_key.columns]
+        seen = set()
+        for row in rows:
+            key = tuple(row.get(column) for column in key_columns)
+            if key in seen:
+                raise ValueError(f"Trùng primary key {dict(zip(key_columns, key))} trong các dòng ghi vào {table.name}")
+            seen.add(key)
@@ -0,0 +1,8 @@
+"""Các module của cron job được import theo tên (như khi chạy analysis.py trong thư mục cron-job)"""
+
+import os
+import sys
+
+CRON_JOB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(CRON_JOB_DIR))
+sys.path.insert(0, CRON_JOB_DIR)
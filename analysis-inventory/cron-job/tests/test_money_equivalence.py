@@ -0,0 +1,157 @@
+"""
+Tổng tiền và tỷ suất lợi nhuận tính bằng số nguyên đơn vị nhỏ nhất (money.py, sales_fact.py) phải khớp
+với cách tính cũ: cộng dồn float(Decimal) rồi ghi vào cột DECIMAL(.., 2)
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+import pytest
+
+from aggregation import WindowAggregates
+from money import margin_percent, to_decimal, to_minor, to_minor_array
+from records import BrandRecord, CategoryRecord, ItemRecord
+from sales_fact import SalesFact
+
+CENT = Decimal('0.01')
+TODAY = datetime(2024, 6, 30)
+# Giá lớn nhất của cột DECIMAL(10, 2) và các mức giá VND thường gặp
+VND_PRICES = ['99999999.99', '89990000.00', '45500000.50', '1250000.00', '199000.00', '25000.75', '0.01']
+
+
+def old_decimal(value: float) -> Decimal:
+    """Giá trị float như cách cũ ghi vào cột DECIMAL(.., 2): Decimal(str(value)) rồi làm tròn 2 chữ số"""
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    """Dữ liệu cố định: 40 items giá VND lớn, 20000 order lines trong 1 năm, khoảng 10% bị refund"""
+    rng = np.random.RandomState(15)
+    brands = [BrandRecord(id=brand_id, name=f'Brand {brand_id}') for brand_id in range(1, 6)]
+    categories = [CategoryRecord(id=category_id, name=f'Category {category_id}') for category_id in range(1, 5)]
+
+    items, prices = [], {}
+    for item_id in range(1, 41):
+        sale_price = Decimal(VND_PRICES[item_id % len(VND_PRICES)])
+        cost_price = (sale_price * Decimal(rng.randint(50, 95)) / 100).quantize(CENT)
+        prices[item_id] = (sale_price, cost_price)
+        items.append(ItemRecord(id=item_id, sku=f'SKU{item_id:03d}', name=f'Item {item_id}',
+                                cost_price=to_minor(cost_price), sale_price=to_minor(sale_price),
+                                stock_quantity=100, brand_id=(item_id % 6) or None,
+                                category_id=item_id % 4 + 1, is_active=True))
+
+    lines = []
+    for line_id in range(20000):
+        item_id = int(rng.randint(1, 41))
+        # Đơn giá bán có thể lệch giá niêm yết (khuyến mãi), vẫn là DECIMAL(10, 2)
+        discount = Decimal(int(rng.randint(0, 30))) / 100
+        price = min((prices[item_id][0] * (1 - discount)).quantize(CENT), Decimal('99999999.99'))
+        status = 'refunded' if rng.rand() < 0.1 else 'completed'
+        order_date = TODAY - timedelta(minutes=int(rng.randint(1, 365 * 24 * 60)))
+        lines.append((line_id // 3, order_date, status, 'Lỗi sản phẩm' if status == 'refunded' else None,
+                      item_id, int(rng.randint(1, 50)), price))
+    return items, brands, categories, prices, lines
+
+
+@pytest.fixture(scope='module')
+def aggregates(dataset):
+    items, brands, categories, _, lines = dataset
+    fact = SalesFact(items, brands, categories)
+    windows = {TODAY.date(): {
+        'all_time': (datetime.min, TODAY),
+        '7_days_ago': (TODAY - timedelta(days=7), TODAY),
+    }}
+    aggregates = WindowAggregates(windows, fact)
+    for start in range(0, len(lines), 3000):
+        aggregates.add_lines(fact.lines_chunk(lines[start:start + 3000]))
+    labels = sorted(set(fact.refund_reasons), key=str)
+    aggregates.finalize(np.zeros(len(fact.refund_reasons), dtype=np.int64), max(len(labels), 1))
+    aggregates.use_date(TODAY.date())
+    return fact, aggregates
+
+
+def old_totals(dataset, window_start: datetime, key):
+    """Tổng doanh thu, lợi nhuận theo key(item) bằng float(Decimal) như trước đây, kèm tổng Decimal chính xác"""
+    _, _, _, prices, lines = dataset
+    floats = defaultdict(lambda: [0.0, 0.0])
+    exact = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for _, order_date, status, _, item_id, quantity, price in lines:
+        if status == 'refunded' or not window_start <= order_date <= TODAY:
+            continue
+        group = key(item_id)
+        if group is None:
+            continue
+        cost_price = prices[item_id][1]
+        floats[group][0] += float(price) * quantity
+        floats[group][1] += (float(price) - float(cost_price)) * quantity
+        exact[group][0] += price * quantity
+        exact[group][1] += (price - cost_price) * quantity
+    return floats, exact
+
+
+@pytest.mark.parametrize('value', VND_PRICES + ['0', '12.34', '-45500000.50'])
+def test_to_minor_matches_decimal(value):
+    decimal_value = Decimal(value)
+    minor = to_minor(decimal_value)
+    assert to_decimal(minor) == decimal_value
+    assert to_minor(float(decimal_value)) == minor
+    assert int(to_minor_array([decimal_value])[0]) == minor
+
+
+@pytest.mark.parametrize('window, window_start', [
+    ('all_time', datetime.min),
+    ('7_days_ago', TODAY - timedelta(days=7)),
+])
+def test_item_totals_match_float_path(dataset, aggregates, window, window_start):
+    fact, aggregates = aggregates
+    totals = aggregates.item_totals(window)
+    floats, exact = old_totals(dataset, window_start, lambda item_id: item_id)
+    assert floats
+
+    for pos, item_id in enumerate(fact.item_ids.tolist()):
+        old_revenue, old_profit = floats.get(item_id, (0.0, 0.0))
+        revenue, profit = int(totals['revenue'][pos]), int(totals['profit'][pos])
+        # Số nguyên đơn vị nhỏ nhất là tổng chính xác và bằng giá trị cách cũ ghi vào database
+        assert to_decimal(revenue) == exact.get(item_id, [Decimal(0)] * 2)[0]
+        assert to_decimal(profit) == exact.get(item_id, [Decimal(0)] * 2)[1]
+        assert to_decimal(revenue) == old_decimal(old_revenue)
+        assert to_decimal(profit) == old_decimal(old_profit)
+
+        old_margin = (old_profit / old_revenue * 100) if old_revenue > 0 else 0
+        assert margin_percent(profit, revenue) == pytest.approx(old_margin, rel=1e-12, abs=1e-12)
+        assert old_decimal(margin_percent(profit, revenue)) == old_decimal(old_margin)
+
+
+@pytest.mark.parametrize('group', ['category', 'brand'])
+def test_group_totals_match_float_path(dataset, aggregates, group):
+    fact, aggregates = aggregates
+    items = {item.id: item for item in dataset[0]}
+    group_ids = fact.category_ids if group == 'category' else fact.brand_ids
+    totals = aggregates.group_totals('all_time', group)
+    floats, exact = old_totals(dataset, datetime.min,
+                               lambda item_id: getattr(items[item_id], f'{group}_id'))
+
+    for pos, group_id in enumerate(group_ids.tolist()):
+        revenue, profit = int(totals['revenue'][pos]), int(totals['profit'][pos])
+        old_revenue, old_profit = floats[group_id]
+        assert to_decimal(revenue) == exact[group_id][0]
+        assert to_decimal(revenue) == old_decimal(old_revenue)
+        assert to_decimal(profit) == old_decimal(old_profit)
+        assert margin_percent(profit, revenue) == pytest.approx(old_profit / old_revenue * 100, rel=1e-12)
+
+
+def test_to_minor_array_exact_beyond_float64():
+    """Cột tiền rộng (vượt 2^53 đơn vị nhỏ nhất) vẫn đổi đúng từng xu, không đi qua float64"""
+    values = (Decimal('12345678901234567.89'), Decimal('90071992547409.93'), None)
+    assert to_minor_array(values).tolist() == [1234567890123456789, 9007199254740993, 0]
+
+
+def test_large_vnd_totals_stay_exact():
+    """Tổng rất lớn (hàng triệu dòng ở giá lớn nhất) vẫn chính xác đến từng xu với int64"""
+    price = Decimal('99999999.99')
+    quantity, lines = 49, 3_000_000
+    minor_total = int(np.full(lines, to_minor(price) * quantity, dtype=np.int64).sum())
+    assert to_decimal(minor_total) == price * quantity * lines
@@ -58,13 +58,13 @@ CREATE TABLE refund_analysis (
     total_orders INTEGER DEFAULT 0,
     refund_orders INTEGER DEFAULT 0,
     refund_rate DECIMAL(5,2) DEFAULT 0,
-    refund_reason VARCHAR(200),
+    refund_reason VARCHAR(200) NOT NULL DEFAULT '',
     refund_quantity INTEGER DEFAULT 0,
     items_affected INTEGER DEFAULT 0,
     rank_position INTEGER DEFAULT 0,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-    PRIMARY KEY (analysis_date, data_range, sort_type, sku)
+    PRIMARY KEY (analysis_date, data_range, sort_type, sku, refund_reason)
 );
 
 -- 5. Create DailySalesSummary table with composite primary key
@@ -158,4 +158,55 @@ CREATE TABLE `revenue_predictions` (
     `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT 'Thời gian tạo bản ghi',
     `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT 'Thời gian cập nhật bản ghi',
     PRIMARY KEY (`analysis_date`, `prediction_period`)
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='Bảng lưu trữ dự đoán doanh thu';
\ No newline at end of file
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='Bảng lưu trữ dự đoán doanh thu';
+
+-- Bảng rollup bán hàng theo ngày và item (cron job làm mới các ngày có thay đổi)
+CREATE TABLE `item_daily_sales` (
+    `sale_date` DATE NOT NULL COMMENT 'Ngày đặt hàng (YYYY-MM-DD)',
+    `item_id` INT NOT NULL COMMENT 'ID sản phẩm',
+    `quantity` INT DEFAULT 0 COMMENT 'Số lượng bán hợp lệ (không refund)',
+    `revenue` DECIMAL(15,2) DEFAULT 0.00 COMMENT 'Doanh thu gộp của các dòng hợp lệ',
+    `cost` DECIMAL(15,2) DEFAULT 0.00 COMMENT 'Giá vốn của các dòng hợp lệ (theo giá vốn lúc làm mới)',
+    `refund_count` INT DEFAULT 0 COMMENT 'Số dòng order bị refund',
+    `refund_quantity` INT DEFAULT 0 COMMENT 'Số lượng sản phẩm bị refund',
+    `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT 'Thời gian tạo bản ghi',
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT 'Thời gian làm mới bản ghi',
+    PRIMARY KEY (`sale_date`, `item_id`),
+    KEY `idx_item_daily_sales_updated_at` (`updated_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='Rollup bán hàng theo ngày và sản phẩm';
+
+-- Watermark của orders/order_items (đọc trước khi đọc phần thay đổi) tại lần làm mới rollup gần nhất
+CREATE TABLE `rollup_watermarks` (
+    `rollup_name` VARCHAR(64) NOT NULL COMMENT 'Tên bảng rollup, vd item_daily_sales',
+    `order_id` INT NOT NULL DEFAULT 0 COMMENT 'orders.id lớn nhất',
+    `order_updated_at` DATETIME NULL COMMENT 'orders.updated_at lớn nhất',
+    `order_item_id` INT NOT NULL DEFAULT 0 COMMENT 'order_items.id lớn nhất',
+    `order_item_updated_at` DATETIME NULL COMMENT 'order_items.updated_at lớn nhất',
+    `refreshed_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT 'Thời gian làm mới rollup',
+    PRIMARY KEY (`rollup_name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='Watermark làm mới các bảng rollup';
+
+-- Bảng marker: cron job ghi sau khi ghi xong (commit) một bảng summary cho một ngày phân tích
+CREATE TABLE `analysis_versions` (
+    `analysis_date` DATE NOT NULL COMMENT 'Ngày phân tích (YYYY-MM-DD)',
+    `table_name` VARCHAR(64) NOT NULL COMMENT 'Tên bảng summary đã ghi xong',
+    `published_at` DATETIME NOT NULL COMMENT 'Thời điểm ghi xong',
+    PRIMARY KEY (`analysis_date`, `table_name`),
+    KEY `idx_analysis_versions_published_at` (`published_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='Các lát dữ liệu summary đã được công bố';
+
+-- Bảng JSON response tính sẵn của các endpoint chuẩn (cron job ghi sau các bảng summary)
+CREATE TABLE `api_documents` (
+    `analysis_date` DATE NOT NULL COMMENT 'Ngày phân tích (YYYY-MM-DD)',
+    `document_key` VARCHAR(255) NOT NULL COMMENT 'Endpoint và tham số chuẩn hóa, vd /api/top-selling-items?limit=10&period=all_time&sort_type=revenue',
+    `body` MEDIUMTEXT NOT NULL COMMENT 'Body JSON của response',
+    `created_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP COMMENT 'Thời gian tạo bản ghi',
+    `updated_at` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT 'Thời gian cập nhật bản ghi',
+    PRIMARY KEY (`analysis_date`, `document_key`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='JSON response tính sẵn cho API';
+
+-- Database đã tạo trước khi đổi primary key của refund_analysis (mỗi SKU nhiều lý do refund, các dòng refund_reason có sku=''):
+-- ALTER TABLE refund_analysis
+--     MODIFY refund_reason VARCHAR(200) NOT NULL DEFAULT '',
+--     DROP PRIMARY KEY,
+--     ADD PRIMARY KEY (analysis_date, data_range, sort_type, sku, refund_reason);
@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+"""
+API Documents
+Nội dung JSON của các endpoint chuẩn trong api-server, dùng chung cho:
+- API server: dựng response trực tiếp từ database khi không có document tính sẵn
+- cron job: tính sẵn document cho mọi tổ hợp tham số chuẩn sau khi ghi các bảng summary
+Mỗi hàm *_document trả về (payload, HTTP status)
+"""
+
+import json
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from sqlalchemy import and_, asc
+
+from package.models.models import (
+    DailySalesSummary, TopSellingItem, CategorySummary, BrandSummary,
+    RefundAnalysis, LowStockAlert, SlowMovingItem, RevenuePrediction
+)
+
+DATA_RANGES = [
+    '1_day_ago', '7_days_ago', '1_month_ago',
+    '3_months_ago', '6_months_ago', '1_year_ago', 'all_time'
+]
+TOP_SELLING_SORT_TYPES = ['revenue', 'profit', 'quantity']
+GROUP_SORT_TYPES = ['revenue', 'quantity']
+REFUND_SORT_TYPES = ['refund_count', 'refund_rate', 'refund_quantity', 'refund_reason']
+SLOW_MOVING_SORT_TYPES = ['no_sales', 'low_sales', 'high_stock_low_sales', 'aging_stock']
+
+
+def daily_sales_document(session, target_date) -> Tuple[Dict, int]:
+    """/api/daily-sales"""
+    latest_summary = session.query(DailySalesSummary).filter(
+        DailySalesSummary.analysis_date == target_date
+    ).first()
+
+    if not latest_summary:
+        return {
+            'success': False,
+            'message': 'Không có dữ liệu daily sales'
+        }, 404
+
+    return {
+        'success': True,
+        'data': {
+            'analysis_date': latest_summary.analysis_date.isoformat(),
+            'total_orders': latest_summary.total_orders,
+            'total_revenue': float(latest_summary.total_revenue),
+            'total_profit': float(latest_summary.total_profit),
+            'total_refunds': latest_summary.total_refunds,
+            'created_at': latest_summary.created_at.isoformat() if latest_summary.created_at else None,
+            'updated_at': latest_summary.updated_at.isoformat() if latest_summary.updated_at else None
+        }
+    }, 200
+
+
+def top_selling_items_document(session, target_date, period: str, sort_type: str, limit: int) -> Tuple[Dict, int]:
+    """/api/top-selling-items"""
+    items = session.query(TopSellingItem).filter(
+        and_(
+            TopSellingItem.analysis_date == target_date,
+            TopSellingItem.data_range == period,
+            TopSellingItem.sort_type == sort_type
+        )
+    ).order_by(TopSellingItem.rank_position).limit(limit).all()
+
+    if not items:
+        return {
+            'success': False,
+            'message': f'Không có dữ liệu top selling items cho period {period} và sort_type {sort_type}'
+        }, 404
+
+    return {
+        'success': True,
+        'period': period,
+        'sort_type': sort_type,
+        'limit': limit,
+        'data': [
+            {
+                'analysis_date': item.analysis_date.isoformat(),
+                'data_range': item.data_range,
+                'sort_type': item.sort_type,
+                'sku': item.sku,
+                'item_name': item.item_name,
+                'total_quantity_sold': item.total_quantity_sold,
+                'total_revenue': float(item.total_revenue),
+                'total_profit': float(item.total_profit),
+                'rank_position': item.rank_position,
+                'created_at': item.created_at.isoformat() if item.created_at else None
+            } for item in items
+        ]
+    }, 200
+
+
+def category_summary_document(session, target_date, period: str, sort_type: str) -> Tuple[Dict, int]:
+    """/api/category-summary"""
+    categories = session.query(CategorySummary).filter(
+        and_(
+            CategorySummary.analysis_date == target_date,
+            CategorySummary.data_range == period,
+            CategorySummary.sort_type == sort_type
+        )
+    ).order_by(CategorySummary.rank_position).all()
+
+    if not categories:
+        return {
+            'success': False,
+            'message': f'Không có dữ liệu category summary cho period {period} và sort_type {sort_type}'
+        }, 404
+
+    return {
+        'success': True,
+        'period': period,
+        'sort_type': sort_type,
+        'data': [
+            {
+                'analysis_date': category.analysis_date.isoformat(),
+                'data_range': category.data_range,
+                'sort_type': category.sort_type,
+                'category_id': category.category_id,
+                'category_name': category.category_name,
+                'total_quantity_sold': category.total_quantity_sold,
+                'total_revenue': float(category.total_revenue),
+                'total_profit': float(category.total_profit),
+                'profit_margin': float(category.profit_margin),
+                'rank_position': category.rank_position,
+                'created_at': category.created_at.isoformat() if category.created_at else None
+            } for category in categories
+        ]
+    }, 200
+
+
+def brand_summary_document(session, target_date, period: str, sort_type: str) -> Tuple[Dict, int]:
+    """/api/brand-summary"""
+    brands = session.query(BrandSummary).filter(
+        and_(
+            BrandSummary.analysis_date == target_date,
+            BrandSummary.data_range == period,
+            BrandSummary.sort_type == sort_type
+        )
+    ).order_by(BrandSummary.rank_position).all()
+
+    if not brands:
+        return {
+            'success': False,
+            'message': f'Không có dữ liệu brand summary cho period {period} và sort_type {sort_type}'
+        }, 404
+
+    return {
+        'success': True,
+        'period': period,
+        'sort_type': sort_type,
+        'data': [
+            {
+                'analysis_date': brand.analysis_date.isoformat(),
+                'data_range': brand.data_range,
+                'sort_type': brand.sort_type,
+                'brand_id': brand.brand_id,
+                'brand_name': brand.brand_name,
+                'total_quantity_sold': brand.total_quantity_sold,
+                'total_revenue': float(brand.total_revenue),
+                'total_profit': float(brand.total_profit),
+                'profit_margin': float(brand.profit_margin),
+                'rank_position': brand.rank_position,
+                'created_at': brand.created_at.isoformat() if brand.created_at else None
+            } for brand in brands
+        ]
+    }, 200
+
+
+def refund_analysis_document(session, target_date, period: str, sort_type: str) -> Tuple[Dict, int]:
+    """/api/refund-analysis"""
+    refunds = session.query(RefundAnalysis).filter(
+        and_(
+            RefundAnalysis.analysis_date == target_date,
+            RefundAnalysis.data_range == period,
+            RefundAnalysis.sort_type == sort_type
+        )
+    ).order_by(RefundAnalysis.rank_position).all()
+
+    if not refunds:
+        return {
+            'success': False,
+            'message': f'Không có dữ liệu refund analysis cho period {period} và sort_type {sort_type}'
+        }, 404
+
+    return {
+        'success': True,
+        'period': period,
+        'sort_type': sort_type,
+        'data': [
+            {
+                'analysis_date': refund.analysis_date.isoformat(),
+                'data_range': refund.data_range,
+                'sort_type': refund.sort_type,
+                'sku': refund.sku,
+                'item_name': refund.item_name,
+                'total_orders': refund.total_orders,
+                'refund_orders': refund.refund_orders,
+                'refund_rate': float(refund.refund_rate),
+                'refund_reason': refund.refund_reason,
+                'refund_quantity': refund.refund_quantity,
+                'items_affected': refund.items_affected,
+                'rank_position': refund.rank_position,
+                'created_at': refund.created_at.isoformat() if refund.created_at else None
+            } for refund in refunds
+        ]
+    }, 200
+
+
+def low_stock_alerts_document(session, target_date) -> Tuple[Dict, int]:
+    """/api/low-stock-alerts"""
+    alerts = session.query(LowStockAlert).filter(
+        LowStockAlert.analysis_date == target_date
+    ).order_by(asc(LowStockAlert.days_left)).all()
+
+    if not alerts:
+        return {
+            'success': False,
+            'message': 'Không có dữ liệu low stock alerts'
+        }, 404
+
+    return {
+        'success': True,
+        'data': [
+            {
+                'analysis_date': alert.analysis_date.isoformat(),
+                'sku': alert.sku,
+                'item_name': alert.item_name,
+                'current_stock': alert.current_stock,
+                'avg_daily_sales': float(alert.avg_daily_sales),
+                'days_left': float(alert.days_left),
+                'alert_type': alert.alert_type,
+                'created_at': alert.created_at.isoformat() if alert.created_at else None
+            } for alert in alerts
+        ]
+    }, 200
+
+
+def slow_moving_items_document(session, target_date, sort_type: str, limit: int) -> Tuple[Dict, int]:
+    """/api/slow-moving-items"""
+    items = session.query(SlowMovingItem).filter(
+        SlowMovingItem.analysis_date == target_date,
+        SlowMovingItem.sort_type == sort_type
+    ).order_by(SlowMovingItem.rank_position).limit(limit).all()
+
+    if not items:
+        return {
+            'success': False,
+            'message': f'Không có dữ liệu slow moving items cho sort_type {sort_type}'
+        }, 404
+
+    return {
+        'success': True,
+        'sort_type': sort_type,
+        'data': [
+            {
+                'analysis_date': item.analysis_date.isoformat(),
+                'sort_type': item.sort_type,
+                'sku': item.sku,
+                'item_name': item.item_name,
+                'brand_name': item.brand_name,
+                'category_name': item.category_name,
+                'current_stock': item.current_stock,
+                'total_quantity_sold': item.total_quantity_sold,
+                'total_revenue': float(item.total_revenue),
+                'total_profit': float(item.total_profit),
+                'profit_margin': float(item.profit_margin),
+                'stock_to_sales_ratio': float(item.stock_to_sales_ratio),
+                'stock_value': float(item.stock_value),
+                'potential_loss': float(item.potential_loss),
+                'cost_price': float(item.cost_price),
+                'sale_price': float(item.sale_price),
+                'days_in_stock': item.days_in_stock,
+                'rank_position': item.rank_position,
+                'created_at': item.created_at.isoformat() if item.created_at else None
+            } for item in items
+        ]
+    }, 200
+
+
+def summary_overview_document(session, target_date) -> Tuple[Dict, int]:
+    """/api/summary/overview"""
+    # Lấy daily sales summary
+    daily_sales = session.query(DailySalesSummary).filter(
+        DailySalesSummary.analysis_date == target_date
+    ).first()
+
+    # Lấy top selling items (revenue)
+    top_items_revenue = session.query(TopSellingItem).filter(
+        and_(
+            TopSellingItem.analysis_date == target_date,
+            TopSellingItem.data_range == 'all_time',
+            TopSellingItem.sort_type == 'revenue'
+        )
+    ).order_by(TopSellingItem.rank_position).limit(5).all()
+
+    # Lấy category summary (revenue)
+    top_categories = session.query(CategorySummary).filter(
+        and_(
+            CategorySummary.analysis_date == target_date,
+            CategorySummary.data_range == 'all_time',
+            CategorySummary.sort_type == 'revenue'
+        )
+    ).order_by(CategorySummary.rank_position).limit(5).all()
+
+    # Lấy brand summary (revenue)
+    top_brands = session.query(BrandSummary).filter(
+        and_(
+            BrandSummary.analysis_date == target_date,
+            BrandSummary.data_range == 'all_time',
+            BrandSummary.sort_type == 'revenue'
+        )
+    ).order_by(BrandSummary.rank_position).limit(5).all()
+
+    # Lấy low stock alerts
+    low_stock_alerts = session.query(LowStockAlert).filter(
+        LowStockAlert.analysis_date == target_date
+    ).order_by(asc(LowStockAlert.days_left)).limit(10).all()
+
+    return {
+        'success': True,
+        'analysis_date': target_date.isoformat(),
+        'daily_sales': {
+            'total_orders': daily_sales.total_orders if daily_sales else 0,
+            'total_revenue': float(daily_sales.total_revenue) if daily_sales else 0,
+            'total_profit': float(daily_sales.total_profit) if daily_sales else 0,
+            'total_refunds': daily_sales.total_refunds if daily_sales else 0
+        },
+        'top_selling_items': [
+            {
+                'sku': item.sku,
+                'item_name': item.item_name,
+                'total_revenue': float(item.total_revenue),
+                'total_profit': float(item.total_profit),
+                'rank_position': item.rank_position
+            } for item in top_items_revenue
+        ],
+        'top_categories': [
+            {
+                'category_id': cat.category_id,
+                'category_name': cat.category_name,
+                'total_revenue': float(cat.total_revenue),
+                'total_profit': float(cat.total_profit),
+                'rank_position': cat.rank_position
+            } for cat in top_categories
+        ],
+        'top_brands': [
+            {
+                'brand_id': brand.brand_id,
+                'brand_name': brand.brand_name,
+                'total_revenue': float(brand.total_revenue),
+                'total_profit': float(brand.total_profit),
+                'rank_position': brand.rank_position
+            } for brand in top_brands
+        ],
+        'low_stock_alerts': [
+            {
+                'sku': alert.sku,
+                'item_name': alert.item_name,
+                'current_stock': alert.current_stock,
+                'days_left': float(alert.days_left),
+                'alert_type': alert.alert_type
+            } for alert in low_stock_alerts
+        ]
+    }, 200
+
+
+def group_ranked_rows(session, model, target_date, limit):
+    """
+    Toàn bộ dòng của bảng xếp hạng cho một ngày phân tích trong một query, chia theo
+    (data_range, sort_type) (hoặc (sort_type,) nếu bảng không có data_range), mỗi nhóm tối đa limit dòng
+    """
+    group_columns = [model.data_range, model.sort_type] if hasattr(model, 'data_range') else [model.sort_type]
+    rows = session.query(model).filter(model.analysis_date == target_date).order_by(
+        *group_columns, model.rank_position
+    ).all()
+
+    groups = {}
+    for row in rows:
+        group = groups.setdefault(tuple(getattr(row, column.key) for column in group_columns), [])
+        if len(group) < limit:
+            group.append(row)
+    return groups
+
+
+def comprehensive_summary_document(session, target_date) -> Tuple[Dict, int]:
+    """/api/summary/all"""
+    summary_data = {
+        'success': True,
+        'analysis_date': target_date.isoformat(),
+        'data': {}
+    }
+
+    # Mỗi bảng summary chỉ đọc một lần cho ngày phân tích (mọi data range và sort type),
+    # sau đó chia nhóm trong bộ nhớ thay vì một query cho từng (data range, sort type)
+    daily_sales = session.query(DailySalesSummary).filter(
+        DailySalesSummary.analysis_date == target_date
+    ).first()
+    top_items = group_ranked_rows(session, TopSellingItem, target_date, 10)
+    categories = group_ranked_rows(session, CategorySummary, target_date, 10)
+    brands = group_ranked_rows(session, BrandSummary, target_date, 10)
+    refunds = group_ranked_rows(session, RefundAnalysis, target_date, 10)
+    slow_items = group_ranked_rows(session, SlowMovingItem, target_date, 20)
+
+    # Tổng hợp data cho từng data range
+    for data_range in DATA_RANGES:
+        summary_data['data'][data_range] = {
+            'daily_sales': {},
+            'top_selling_items': {
+                sort_type: [
+                    {
+                        'sku': item.sku,
+                        'item_name': item.item_name,
+                        'total_quantity_sold': item.total_quantity_sold,
+                        'total_revenue': float(item.total_revenue),
+                        'total_profit': float(item.total_profit),
+                        'rank_position': item.rank_position
+                    } for item in top_items.get((data_range, sort_type), [])
+                ] for sort_type in TOP_SELLING_SORT_TYPES
+            },
+            'category_summary': {
+                sort_type: [
+                    {
+                        'category_id': cat.category_id,
+                        'category_name': cat.category_name,
+                        'total_quantity_sold': cat.total_quantity_sold,
+                        'total_revenue': float(cat.total_revenue),
+                        'total_profit': float(cat.total_profit),
+                        'profit_margin': float(cat.profit_margin),
+                        'rank_position': cat.rank_position
+                    } for cat in categories.get((data_range, sort_type), [])
+                ] for sort_type in GROUP_SORT_TYPES
+            },
+            'brand_summary': {
+                sort_type: [
+                    {
+                        'brand_id': brand.brand_id,
+                        'brand_name': brand.brand_name,
+                        'total_quantity_sold': brand.total_quantity_sold,
+                        'total_revenue': float(brand.total_revenue),
+                        'total_profit': float(brand.total_profit),
+                        'profit_margin': float(brand.profit_margin),
+                        'rank_position': brand.rank_position
+                    } for brand in brands.get((data_range, sort_type), [])
+                ] for sort_type in GROUP_SORT_TYPES
+            },
+            'refund_analysis': {
+                sort_type: [
+                    {
+                        'sku': refund.sku,
+                        'item_name': refund.item_name,
+                        'total_orders': refund.total_orders,
+                        'refund_orders': refund.refund_orders,
+                        'refund_rate': float(refund.refund_rate),
+                        'refund_reason': refund.refund_reason,
+                        'refund_quantity': refund.refund_quantity,
+                        'items_affected': refund.items_affected,
+                        'rank_position': refund.rank_position
+                    } for refund in refunds.get((data_range, sort_type), [])
+                ] for sort_type in REFUND_SORT_TYPES
+            },
+            # Hàng bán ế không phụ thuộc data range
+            'slow_moving_items': {
+                sort_type: [
+                    {
+                        'sku': item.sku,
+                        'item_name': item.item_name,
+                        'brand_name': item.brand_name,
+                        'category_name': item.category_name,
+                        'current_stock': item.current_stock,
+                        'total_quantity_sold': item.total_quantity_sold,
+                        'total_revenue': float(item.total_revenue),
+                        'total_profit': float(item.total_profit),
+                        'profit_margin': float(item.profit_margin),
+                        'stock_to_sales_ratio': float(item.stock_to_sales_ratio),
+                        'stock_value': float(item.stock_value),
+                        'potential_loss': float(item.potential_loss),
+                        'cost_price': float(item.cost_price),
+                        'sale_price': float(item.sale_price),
+                        'days_in_stock': item.days_in_stock,
+                        'rank_position': item.rank_position
+                    } for item in slow_items.get((sort_type,), [])
+                ] for sort_type in SLOW_MOVING_SORT_TYPES
+            }
+        }
+
+        if daily_sales:
+            summary_data['data'][data_range]['daily_sales'] = {
+                'total_orders': daily_sales.total_orders,
+                'total_revenue': float(daily_sales.total_revenue),
+                'total_profit': float(daily_sales.total_profit),
+                'total_refunds': daily_sales.total_refunds
+            }
+
+    return summary_data, 200
+
+
+def revenue_prediction_document(session, target_date) -> Tuple[Dict, int]:
+    """/api/revenue-prediction"""
+    latest_prediction = session.query(RevenuePrediction).filter(
+        RevenuePrediction.analysis_date == target_date,
+        RevenuePrediction.prediction_period == 'next_month'
+    ).first()
+
+    if not latest_prediction:
+        return {
+            'success': False,
+            'message': 'Không có dữ liệu dự đoán doanh thu'
+        }, 404
+
+    # Parse JSON data
+    daily_predictions = json.loads(latest_prediction.daily_predictions) if latest_prediction.daily_predictions else []
+    weekday_analysis = json.loads(latest_prediction.weekday_analysis) if latest_prediction.weekday_analysis else {}
+    features_used = json.loads(latest_prediction.features_used) if latest_prediction.features_used else []
+
+    return {
+        'success': True,
+        'analysis_date': latest_prediction.analysis_date.isoformat(),
+        'prediction_period': latest_prediction.prediction_period,
+        'prediction_days': latest_prediction.prediction_days,
+        'historical_analysis': {
+            'total_revenue': float(latest_prediction.total_historical_revenue),
+            'avg_daily_revenue': float(latest_prediction.avg_daily_revenue),
+            'std_daily_revenue': float(latest_prediction.std_daily_revenue),
+            'data_days': latest_prediction.data_days,
+            'trend_percentage': float(latest_prediction.trend_percentage),
+            'r2_score': float(latest_prediction.r2_score),
+            'mape': float(latest_prediction.mape) if latest_prediction.mape > 0 else None
+        },
+        'predictions': {
+            'total_predicted_revenue': float(latest_prediction.total_predicted_revenue),
+            'avg_daily_prediction': float(latest_prediction.avg_daily_prediction),
+            'confidence_interval': float(latest_prediction.confidence_interval),
+            'lower_bound': float(latest_prediction.lower_bound),
+            'upper_bound': float(latest_prediction.upper_bound)
+        },
+        'daily_predictions': daily_predictions,
+        'weekday_analysis': weekday_analysis,
+        'model_info': {
+            'algorithm': latest_prediction.algorithm,
+            'features_used': features_used,
+            'data_points': latest_prediction.data_points,
+            'confidence_level': float(latest_prediction.confidence_level)
+        },
+        'risk_assessment': {
+            'high_volatility': latest_prediction.high_volatility,
+            'negative_trend': latest_prediction.negative_trend,
+            'low_confidence': latest_prediction.low_confidence,
+            'insufficient_data': latest_prediction.insufficient_data
+        },
+        'created_at': latest_prediction.created_at.isoformat() if latest_prediction.created_at else None,
+        'updated_at': latest_prediction.updated_at.isoformat() if latest_prediction.updated_at else None
+    }, 200
+
+
+class DocumentEndpoint:
+    """
+    Endpoint có document tính sẵn: bảng xác định ngày mới nhất, tham số mặc định và các bộ tham số chuẩn
+    accepts_date: view của endpoint đọc tham số date (False: luôn trả ngày mới nhất, date bị bỏ qua)
+    sources: các bảng summary document đọc (mặc định chỉ bảng model), document được dựng lại khi một trong các bảng này được ghi
+    """
+
+    def __init__(self, model, build: Callable, defaults: Dict[str, str], variants: List[Dict[str, str]],
+                 int_params: Tuple[str, ...] = (), accepts_date: bool = True, sources: Tuple = ()):
+        self.model = model
+        self.build = build
+        self.defaults = defaults
+        self.variants = variants
+        self.int_params = int_params
+        self.accepts_date = accepts_date
+        self.tables = {source.__tablename__ for source in sources or (model,)}
+
+    def document(self, session, target_date, params: Dict[str, str]) -> Tuple[Dict, int]:
+        arguments = {name: int(value) if name in self.int_params else value for name, value in params.items()}
+        return self.build(session, target_date, **arguments)
+
+
+DOCUMENT_ENDPOINTS = {
+    '/api/daily-sales': DocumentEndpoint(DailySalesSummary, daily_sales_document, {}, [{}], accepts_date=False),
+    '/api/top-selling-items': DocumentEndpoint(
+        TopSellingItem, top_selling_items_document,
+        {'period': 'all_time', 'sort_type': 'revenue', 'limit': '10'},
+        [{'period': period, 'sort_type': sort_type, 'limit': '10'}
+         for period in DATA_RANGES for sort_type in TOP_SELLING_SORT_TYPES],
+        int_params=('limit',)),
+    '/api/category-summary': DocumentEndpoint(
+        CategorySummary, category_summary_document,
+        {'period': 'all_time', 'sort_type': 'revenue'},
+        [{'period': period, 'sort_type': sort_type} for period in DATA_RANGES for sort_type in GROUP_SORT_TYPES]),
+    '/api/brand-summary': DocumentEndpoint(
+        BrandSummary, brand_summary_document,
+        {'period': 'all_time', 'sort_type': 'revenue'},
+        [{'period': period, 'sort_type': sort_type} for period in DATA_RANGES for sort_type in GROUP_SORT_TYPES]),
+    '/api/refund-analysis': DocumentEndpoint(
+        RefundAnalysis, refund_analysis_document,
+        {'period': 'all_time', 'sort_type': 'refund_count'},
+        [{'period': period, 'sort_type': sort_type} for period in DATA_RANGES for sort_type in REFUND_SORT_TYPES]),
+    '/api/low-stock-alerts': DocumentEndpoint(LowStockAlert, low_stock_alerts_document, {}, [{}]),
+    '/api/slow-moving-items': DocumentEndpoint(
+        SlowMovingItem, slow_moving_items_document,
+        {'sort_type': 'no_sales', 'limit': '20'},
+        [{'sort_type': sort_type, 'limit': '20'} for sort_type in SLOW_MOVING_SORT_TYPES],
+        int_params=('limit',)),
+    '/api/summary/overview': DocumentEndpoint(
+        DailySalesSummary, summary_overview_document, {}, [{}],
+        sources=(DailySalesSummary, TopSellingItem, CategorySummary, BrandSummary, LowStockAlert)),
+    '/api/summary/all': DocumentEndpoint(
+        DailySalesSummary, comprehensive_summary_document, {}, [{}],
+        sources=(DailySalesSummary, TopSellingItem, CategorySummary, BrandSummary, RefundAnalysis, SlowMovingItem)),
+    '/api/revenue-prediction': DocumentEndpoint(RevenuePrediction, revenue_prediction_document, {}, [{}],
+                                                accepts_date=False),
+}
+
+
+def document_key(path: str, params: Dict[str, str]) -> Optional[str]:
+    """
+    Key của document cho một request: path và các tham số (đã điền giá trị mặc định) theo thứ tự tên
+    None nếu endpoint không có document tính sẵn hoặc tham số không thuộc các bộ tham số chuẩn
+    """
+    endpoint = DOCUMENT_ENDPOINTS.get(path)
+    if endpoint is None or set(params) - set(endpoint.defaults):
+        return None
+    values = {**endpoint.defaults, **params}
+    if values not in endpoint.variants:
+        return None
+    return f"{path}?{urlencode(sorted(values.items()))}" if values else path
+
+
+def serialize_document(payload: Dict) -> str:
+    """JSON giống hệt body của jsonify ở chế độ production (sort key, compact, ensure_ascii, xuống dòng cuối)"""
+    return json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n'
+
+
+def document_keys(tables=None) -> List[str]:
+    """Key của các document chuẩn đọc từ một trong các bảng tables (None: mọi document)"""
+    return [document_key(path, params) for path, endpoint in DOCUMENT_ENDPOINTS.items()
+            if tables is None or endpoint.tables & set(tables) for params in endpoint.variants]
+
+
+def build_documents(session, target_date, tables=None) -> Dict[str, str]:
+    """
+    Các document chuẩn (chỉ các response thành công) của một ngày phân tích: {key: JSON}
+    tables: chỉ dựng các document đọc từ một trong các bảng này (None: mọi document)
+    """
+    documents = {}
+    for path, endpoint in DOCUMENT_ENDPOINTS.items():
+        if tables is not None and not endpoint.tables & set(tables):
+            continue
+        for params in endpoint.variants:
+            payload, status = endpoint.document(session, target_date, params)
+            if status == 200:
+                documents[document_key(path, params)] = serialize_document(payload)
+    return documents
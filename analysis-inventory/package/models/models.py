@@ -7,10 +7,11 @@ SQLAlchemy Models for Analytics System
 from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, Boolean, Text, ForeignKey, text
 from sqlalchemy.types import DECIMAL
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import scoped_session, sessionmaker, relationship
 from sqlalchemy.sql import func
 from datetime import datetime
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -182,7 +183,7 @@ class RefundAnalysis(Base):
     total_orders = Column(Integer, default=0)
     refund_orders = Column(Integer, default=0)
     refund_rate = Column(DECIMAL(5,2), default=0)
-    refund_reason = Column(String(200))
+    refund_reason = Column(String(200), nullable=False, default='')
     refund_quantity = Column(Integer, default=0)
     items_affected = Column(Integer, default=0)
     rank_position = Column(Integer, default=0)
@@ -190,7 +191,8 @@ class RefundAnalysis(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
     __table_args__ = (
-        PrimaryKeyConstraint('analysis_date', 'data_range', 'sort_type', 'sku'),
+        # Một SKU có thể xuất hiện với nhiều lý do refund, các dòng sort_type='refund_reason' đều có sku=''
+        PrimaryKeyConstraint('analysis_date', 'data_range', 'sort_type', 'sku', 'refund_reason'),
     )
 
 class DailySalesSummary(Base):
@@ -301,6 +303,65 @@ class RevenuePrediction(Base):
         PrimaryKeyConstraint('analysis_date', 'prediction_period'),
     )
 
+class ItemDailySales(Base):
+    """Rollup bán hàng theo (ngày, item), được cron job làm mới"""
+    __tablename__ = 'item_daily_sales'
+    
+    sale_date = Column(Date, nullable=False)
+    item_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, default=0)
+    revenue = Column(DECIMAL(15,2), default=0)
+    cost = Column(DECIMAL(15,2), default=0)
+    refund_count = Column(Integer, default=0)
+    refund_quantity = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint('sale_date', 'item_id'),
+    )
+
+class RollupWatermark(Base):
+    """Watermark của bảng nguồn (id, updated_at lớn nhất) tại lần làm mới rollup gần nhất"""
+    __tablename__ = 'rollup_watermarks'
+    
+    rollup_name = Column(String(64), nullable=False)
+    order_id = Column(Integer, nullable=False, default=0)
+    order_updated_at = Column(DateTime)
+    order_item_id = Column(Integer, nullable=False, default=0)
+    order_item_updated_at = Column(DateTime)
+    refreshed_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint('rollup_name'),
+    )
+
+class AnalysisVersion(Base):
+    """Marker cron job ghi sau khi ghi xong một bảng summary cho một ngày phân tích"""
+    __tablename__ = 'analysis_versions'
+    
+    analysis_date = Column(Date, nullable=False)
+    table_name = Column(String(64), nullable=False)
+    published_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint('analysis_date', 'table_name'),
+    )
+
+class ApiDocument(Base):
+    """JSON response tính sẵn của các endpoint chuẩn theo ngày phân tích (cron job ghi)"""
+    __tablename__ = 'api_documents'
+    
+    analysis_date = Column(Date, nullable=False)
+    document_key = Column(String(255), nullable=False)
+    body = Column(Text(16777215), nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        PrimaryKeyConstraint('analysis_date', 'document_key'),
+    )
+
 # Database connection functions
 def get_database_url():
     """Get database URL from environment variables"""
@@ -313,13 +374,62 @@ def get_database_url():
     url = f"mysql+pymysql://{user}:{password}@{host}:{port}/{database}"
     return url
 
+def get_pool_options():
+    """Cấu hình connection pool từ environment variables"""
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').strip().lower() in ('1', 'true', 'yes'),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '3600')),
+    }
+
 def create_db_engine():
-    """Create SQLAlchemy engine"""
+    """Create SQLAlchemy engine (một connection pool mới, nên dùng get_engine() để dùng chung)"""
+    database_url = get_database_url()
+    return create_engine(database_url, **get_pool_options())
+
+# Engine và session factory dùng chung trong process, mỗi database URL một connection pool
+_engines = {}
+_session_factories = {}
+_registry_lock = threading.Lock()
+
+def get_engine():
+    """Engine dùng chung của process (tạo một lần cho mỗi database URL)"""
     database_url = get_database_url()
-    return create_engine(database_url)
+    engine = _engines.get(database_url)
+    if engine is None:
+        with _registry_lock:
+            engine = _engines.get(database_url)
+            if engine is None:
+                engine = _engines[database_url] = create_db_engine()
+    return engine
+
+def get_session_factory():
+    """Session factory theo phạm vi request/thread trên engine dùng chung"""
+    engine = get_engine()
+    factory = _session_factories.get(engine)
+    if factory is None:
+        with _registry_lock:
+            factory = _session_factories.get(engine)
+            if factory is None:
+                factory = _session_factories[engine] = scoped_session(sessionmaker(bind=engine))
+    return factory
 
 def create_session():
-    """Create database session"""
-    engine = create_db_engine()
-    Session = sessionmaker(bind=engine)
-    return Session()
\ No newline at end of file
+    """Create database session (session của request/thread hiện tại, đóng bằng remove_session())"""
+    return get_session_factory()()
+
+def remove_session():
+    """Đóng session của request/thread hiện tại và trả connection về pool"""
+    for factory in list(_session_factories.values()):
+        factory.remove()
+
+def dispose_engines():
+    """Đóng toàn bộ connection pool của process (vd khi tắt server)"""
+    with _registry_lock:
+        for factory in _session_factories.values():
+            factory.remove()
+        for engine in _engines.values():
+            engine.dispose()
+        _session_factories.clear()
+        _engines.clear()